@@ -0,0 +1,95 @@
+"""
+首頁選單樹：一次查詢建好整棵啟用中的選單，存在 process 內，之後的請求不再查資料庫
+
+    menus = get_menu_tree()     # (MenuNode, ...)，只含啟用中的父選單
+    for m in menus: m.title, m.url, m.children
+
+- 資料庫只查一次：所有啟用中的選單一起撈出，在 Python 中依 parent 組成樹；
+  停用的選單連同其下的子選單都不顯示
+- 快取以版本號判斷是否過期：Menu 新增、修改、刪除時（signals）換一個新版本號，
+  各 process 看到版本號改變就重建
+- 版本號存在 Django cache（settings.CACHES）；多 worker 部署請設定共用的 cache（Redis / Memcached），
+  否則其他 worker 最晚在 MENU_TREE_TTL 秒後才會看到變更
+  （版本號若放在 DatabaseCache，每次仍會有一次 cache 查詢）
+
+設定（settings.py，皆可省略）：
+  MENU_TREE_TTL   process 內快取的最長保留秒數，預設 300；0 表示只依版本號判斷
+"""
+import threading
+import time
+from typing import NamedTuple, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = "core:menu_tree:version"
+DEFAULT_TTL = 300
+
+
+class MenuNode(NamedTuple):
+    id: int
+    title: str
+    url: str
+    children: Tuple["MenuNode", ...] = ()
+
+
+_lock = threading.Lock()
+_cached = None  # (version, 建立時間, tree)
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # cache 重啟或被清掉：補一個新版本號（add 不會覆蓋其他 process 剛寫入的值）
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def build_menu_tree():
+    """單一查詢建出整棵選單樹；回傳最上層的 MenuNode tuple"""
+    from .models import Menu
+
+    rows = list(
+        Menu.objects.filter(is_active=True)
+        .order_by("order", "id")
+        .values_list("id", "parent_id", "title", "url")
+    )
+    children = {}
+    for menu_id, parent_id, title, url in rows:
+        children.setdefault(parent_id, []).append((menu_id, title, url))
+
+    def build(parent_id, seen):
+        nodes = []
+        for menu_id, title, url in children.get(parent_id, ()):
+            if menu_id in seen:  # parent 被設成自己的子孫時避免無窮遞迴
+                continue
+            nodes.append(MenuNode(menu_id, title, url, build(menu_id, seen | {menu_id})))
+        return tuple(nodes)
+
+    return build(None, frozenset())
+
+
+def get_menu_tree():
+    """回傳快取的選單樹；版本號改變或超過 MENU_TREE_TTL 時重建"""
+    global _cached
+    version = _current_version()
+    ttl = getattr(settings, "MENU_TREE_TTL", DEFAULT_TTL)
+    now = time.monotonic()
+    cached = _cached
+    if cached and cached[0] == version and (not ttl or now - cached[1] < ttl):
+        return cached[2]
+    with _lock:
+        cached = _cached
+        if cached and cached[0] == version and (not ttl or now - cached[1] < ttl):
+            return cached[2]
+        tree = build_menu_tree()
+        _cached = (version, time.monotonic(), tree)
+        return tree
+
+
+def invalidate_menu_tree():
+    """換一個新版本號，所有 process 下次讀取時重建"""
+    global _cached
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    _cached = None
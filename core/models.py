@@ -23,5 +23,5 @@ class Menu(models.Model):
 
     @property
     def active_children(self):
-        """回傳啟用中的子選單"""
+        """回傳啟用中的子選單（每次都查資料庫；首頁請用 core.menu_tree.get_menu_tree）"""
         return self.children.filter(is_active=True)
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .menu_tree import invalidate_menu_tree
+from .models import Menu
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def _menu_changed(sender, instance, **kwargs):
+    # 交易提交後才換版本號，避免其他請求在提交前以舊資料重建快取
+    transaction.on_commit(invalidate_menu_tree)
@@ -1,3 +1,39 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from .menu_tree import get_menu_tree, invalidate_menu_tree
+from .models import Menu
+
+
+class MenuTreeTests(TestCase):
+    def setUp(self):
+        invalidate_menu_tree()
+        self.addCleanup(invalidate_menu_tree)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.top = Menu.objects.create(title="文件", url="/docs", order=2)
+            Menu.objects.create(title="匯入", url="/docs/import", parent=self.top)
+            Menu.objects.create(title="停用", url="/off", parent=self.top, is_active=False)
+            Menu.objects.create(title="首頁", url="/", order=1)
+
+    def test_tree_shape(self):
+        tree = get_menu_tree()
+        self.assertEqual([m.title for m in tree], ["首頁", "文件"])
+        self.assertEqual([c.title for c in tree[1].children], ["匯入"])
+
+    def test_cached_between_requests(self):
+        get_menu_tree()
+        with CaptureQueriesContext(connection) as queries:
+            get_menu_tree()
+        self.assertFalse([q for q in queries if "core_menu" in q["sql"]])
+
+    def test_edit_invalidates_cache(self):
+        get_menu_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.top.title = "文件區"
+            self.top.save()
+        self.assertEqual(get_menu_tree()[1].title, "文件區")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.top.delete()
+        self.assertEqual([m.title for m in get_menu_tree()], ["首頁"])
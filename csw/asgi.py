@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+以 ASGI 部署時（例如 `uvicorn csw.asgi:application`），projects 的 *_async view
+（test_api_async、generate_image_async、crawl_async）在等待 Gemini 與網路時不佔用 thread。
 """
 
 import os
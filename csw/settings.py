@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'projects.middleware.MetricsMiddleware',  # 放最外層：view 耗時含其他 middleware；輸出 Server-Timing
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,10 +77,19 @@ WSGI_APPLICATION = 'csw.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# csw.sqlite_backend：內建 sqlite3 後端加上 WAL、synchronous=NORMAL、page cache、mmap、busy timeout（見該模組說明）
+# CONN_MAX_AGE：連線保留秒數，請求之間重複使用，不必每次重新連線、重設 PRAGMA
+# transaction_mode IMMEDIATE：交易一開始就取得寫入鎖，由 busy_timeout 排隊等待；
+#   預設的 DEFERRED 在交易中途由讀轉寫時若遇到其他寫入，會直接失敗（database is locked）而不等待
 DATABASES = {
     'default': {
-       'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'csw.sqlite_backend',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
@@ -127,5 +137,65 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 專案向量矩陣快取（每個 process）可使用的記憶體上限，超過時以 LRU 淘汰
+PROJECT_VECTOR_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# 其他 process（背景 worker）寫入的片段，最晚幾秒後會被各 web process 的矩陣快取與回答快取察覺
+PROJECT_VECTOR_CACHE_CHECK_SECONDS = 10
+
+# 文件向量存放的精度："float32"（預設）或 "float16"（空間再減半，精度略降）
+PROJECT_EMBEDDING_DTYPE = "float32"
+
+# ANN 索引：片段數達 PROJECT_ANN_MIN_ROWS 才啟用；PROJECT_ANN_NPROBE 越大召回越高、越慢
+PROJECT_ANN_BACKEND = "ivf"
+PROJECT_ANN_DIR = BASE_DIR / "vector_indexes"
+PROJECT_ANN_MIN_ROWS = 5000
+PROJECT_ANN_NPROBE = 8
+
+# 檢索模式："vector"、"lexical"（BM25）或 "hybrid"（兩者以 RRF 融合）
+# hybrid 模式下像關鍵字的短查詢（不超過 PROJECT_KEYWORD_QUERY_MAX_CHARS 字的代號、分機、人名，
+# 不含空白、標點、疑問詞）若 BM25 已有命中，就不呼叫 embedding API；一般問句一律融合
+PROJECT_RETRIEVAL_MODE = "hybrid"
+PROJECT_KEYWORD_QUERY_MAX_CHARS = 8
+
+# LLMProject.llm_model → 實際 Gemini 模型名稱；未列出的選項使用 "gemini" 對應的模型
+PROJECT_LLM_MODELS = {
+    "gemini": "gemini-1.5-pro",
+}
+PROJECT_LLM_TIMEOUT = 60  # 秒
+PROJECT_IMAGE_TIMEOUT = (5, 120)  # (連線, 讀取) 秒
+# 生成圖片快取：相同 (模型, 提示詞, 參數) 只生成一次；總大小超過上限時淘汰最久沒用到的
+PROJECT_IMAGE_CACHE_DIR = BASE_DIR / "image_cache"
+PROJECT_IMAGE_CACHE_MAX_MB = 1024
+
+# 回答快取：TTL 秒數（0 關閉）；語意快取門檻（None 關閉，例如 0.95）
+PROJECT_ANSWER_CACHE_TTL = 86400
+PROJECT_ANSWER_CACHE_SEMANTIC_THRESHOLD = None
+
+# 多頁爬蟲（背景工作 crawl_site）
+PROJECT_CRAWL_WORKERS = 8
+PROJECT_CRAWL_HOST_DELAY = 0.5  # 同一主機兩次請求的最小間隔（秒）
+PROJECT_CRAWL_MAX_DEPTH = 2
+PROJECT_CRAWL_MAX_PAGES = 100
+
+# 批次匯入（多檔 / ZIP / 資料夾，背景工作 bulk_import）
+PROJECT_BULK_IMPORT_WORKERS = 4  # 並行解析的執行緒數
+PROJECT_BULK_IMPORT_MAX_FILES = 1000
+# Django 預設一次最多上傳 100 個檔案；更多檔案請壓成 ZIP
+DATA_UPLOAD_MAX_NUMBER_FILES = 500
+
+# 指標：Server-Timing header；/project/metrics（Prometheus）除 staff 外也接受此 Bearer token
+PROJECT_SERVER_TIMING = True
+PROJECT_METRICS_TOKEN = os.environ.get('PROJECT_METRICS_TOKEN')
+
+# 背景工作（manage.py run_jobs）：同時執行數、失敗重試次數上限
+# 部署時需有 run_jobs 常駐執行：文件匯入、爬蟲、圖片生成，以及 migrate 0013 排入的舊文件片段補建都靠它處理
+PROJECT_JOB_WORKERS = 2
+PROJECT_JOB_MAX_ATTEMPTS = 3
+# 各類型同時執行的上限（所有 worker 合計）；圖片生成另可開專用 worker：
+#   manage.py run_jobs --kind generate_image --workers 4
+PROJECT_JOB_CONCURRENCY = {"generate_image": 4}
+# 非同步圖片生成（/project/image_jobs/）：一次最多幾個提示詞
+PROJECT_IMAGE_JOB_MAX_PROMPTS = 8
+
 # Allow iframe embedding for modal windows
 X_FRAME_OPTIONS = 'SAMEORIGIN'
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""
+SQLite 資料庫後端：Django 內建 sqlite3 後端，每條新連線額外設定 PRAGMA
+
+    DATABASES = {"default": {"ENGINE": "csw.sqlite_backend", "NAME": ..., "OPTIONS": {...}}}
+
+預設的 PRAGMA（依序執行）：
+  busy_timeout = 20000     被鎖住時最多等 20 秒再回報 "database is locked"
+  journal_mode = WAL       讀寫互不阻擋：匯入寫入時聊天查詢照常讀取（設定存在資料庫檔，一次即永久）
+  synchronous  = NORMAL    WAL 下每次 commit 不 fsync，只在 checkpoint 時 fsync；斷電最多遺失最後幾筆交易，不會損壞
+  cache_size   = -65536    每條連線的 page cache 64 MB（負值單位為 KB）
+  mmap_size    = 268435456 以 256 MB 記憶體映射讀取資料庫檔，少一次 read() 複製
+  temp_store   = MEMORY    排序、暫存索引放記憶體
+
+OPTIONS 中的 "pragmas" 可覆蓋或新增（值為 None 表示不設定），其餘 OPTIONS 照常傳給 sqlite3.connect /
+Django（例如 "transaction_mode": "IMMEDIATE"）。busy_timeout 同時作為 sqlite3.connect 的 timeout。
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    "busy_timeout": 20000,
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+_NAME_RE = re.compile(r"^[a-z_]+$")
+_VALUE_RE = re.compile(r"^-?\w+$")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        pragmas = dict(DEFAULT_PRAGMAS)
+        pragmas.update(kwargs.pop("pragmas", None) or {})
+        for name, value in pragmas.items():
+            if not _NAME_RE.match(name) or (value is not None and not _VALUE_RE.match(str(value))):
+                raise ImproperlyConfigured(
+                    f"settings.DATABASES[{self.alias!r}]['OPTIONS']['pragmas'] 含有無效的設定：{name} = {value!r}"
+                )
+        self.pragmas = {name: value for name, value in pragmas.items() if value is not None}
+        if "busy_timeout" in self.pragmas:
+            kwargs.setdefault("timeout", int(self.pragmas["busy_timeout"]) / 1000)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
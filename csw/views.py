@@ -1,5 +1,5 @@
 from django.shortcuts import render
-from core.models import Menu
+from core.menu_tree import get_menu_tree
 from django.contrib.auth.decorators import login_required
 
 # def menu(request):
@@ -7,11 +7,8 @@ from django.contrib.auth.decorators import login_required
 
 @login_required
 def menu(request):
-    # 只撈出「父選單」(parent 為空的)
-    menus = Menu.objects.filter(parent__isnull=True, is_active=True).order_by("order")
-    print(menus)
-    print('menu')
-    return render(request, "menu.html", {"menus": menus})
+    # 啟用中的選單樹（process 內快取，選單異動時自動重建）
+    return render(request, "menu.html", {"menus": get_menu_tree()})
 
 
 
@@ -0,0 +1,328 @@
+"""
+近似最近鄰（ANN）索引：每個專案一份，只用 NumPy
+
+目前提供 IVF（inverted file）後端：
+- 以 spherical k-means 把片段向量分成 nlist 群，只記錄「片段 id → 群編號」與各群中心
+- 查詢時先找最近的 nprobe 個群，只對這些群裡的片段算分數（向量本身取自 vector_cache 的矩陣）
+- 尚未分群的新片段一律列入候選，因此增量更新漏掉也只會變慢、不會查不到
+
+索引檔存在 settings.PROJECT_ANN_DIR（預設 db.sqlite3 旁的 vector_indexes/），
+每個 process 依檔案修改時間自動重新載入。
+
+設定（settings.py，皆可省略）：
+  PROJECT_ANN_BACKEND    "ivf"
+  PROJECT_ANN_DIR        索引檔目錄
+  PROJECT_ANN_MIN_ROWS   片段數少於此值直接精確搜尋，預設 5000
+  PROJECT_ANN_NPROBE     每次查詢掃描的群數，越大越準越慢，預設 8
+"""
+import copy
+import itertools
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_ROWS = 5000
+DEFAULT_NPROBE = 8
+# 未分群的片段超過此比例就排程重建索引
+REBUILD_UNASSIGNED_RATIO = 0.1
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def index_dir() -> Path:
+    return Path(_setting("PROJECT_ANN_DIR", Path(settings.BASE_DIR) / "vector_indexes"))
+
+
+class IVFIndex:
+    """
+    centroids : (nlist, dim) float32，已正規化
+    ids       : 已分群的片段 id（int64，遞增排序）
+    lists     : 與 ids 等長，每個片段所屬的群編號（int32）
+    """
+    backend = "ivf"
+
+    def __init__(self, centroids: np.ndarray, ids: np.ndarray, lists: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.token = 0
+        order = np.argsort(ids, kind="stable")
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.lists = np.asarray(lists, dtype=np.int32)[order]
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    # ---- 建立 ----
+    @classmethod
+    def build(cls, ids, matrix, nlist: int = None, iterations: int = 10, seed: int = 0):
+        """
+        ids/matrix 來自 ProjectMatrix（每列已正規化）
+        nlist 預設 √n，訓練樣本最多取 nlist × 64 筆
+        """
+        n = len(ids)
+        if n == 0:
+            raise ValueError("沒有向量可以建立索引")
+        nlist = int(nlist or max(1, round(np.sqrt(n))))
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, nlist * 64)
+        sample = matrix[rng.choice(n, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # 空群改放隨機樣本，避免群數縮水
+                sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            centroids = sums / norms
+
+        index = cls(centroids, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32))
+        index.add(ids, matrix)
+        return index
+
+    # ---- 增量更新 ----
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 4096):
+            block = vectors[start:start + 4096]
+            out[start:start + 4096] = np.argmax(block @ self.centroids.T, axis=1)
+        return out
+
+    def add(self, ids, vectors):
+        """vectors 需已正規化；重複的 id 會以新的分群覆蓋"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if vectors.shape[1] != self.dim:
+            return
+        lists = self._assign(vectors)
+        keep = ~np.isin(self.ids, ids)
+        all_ids = np.concatenate([self.ids[keep], ids])
+        all_lists = np.concatenate([self.lists[keep], lists])
+        order = np.argsort(all_ids, kind="stable")
+        self.ids, self.lists = all_ids[order], all_lists[order]
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        self.ids, self.lists = self.ids[keep], self.lists[keep]
+
+    # ---- 查詢 ----
+    def lists_for_rows(self, row_ids: np.ndarray) -> np.ndarray:
+        """矩陣每一列所屬的群；未分群為 -1"""
+        out = np.full(len(row_ids), -1, dtype=np.int32)
+        if len(self.ids) == 0:
+            return out
+        pos = np.minimum(np.searchsorted(self.ids, row_ids), len(self.ids) - 1)
+        found = self.ids[pos] == row_ids
+        out[found] = self.lists[pos[found]]
+        return out
+
+    def probe(self, q_unit: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = max(1, min(nprobe, self.nlist))
+        scores = self.centroids @ q_unit
+        if nprobe < self.nlist:
+            return np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.arange(self.nlist)
+
+    # ---- 存檔 ----
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, centroids=self.centroids, ids=self.ids, lists=self.lists)
+            os.replace(tmp, path)  # 原子替換，讀取端不會看到寫一半的檔案
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["ids"], data["lists"])
+
+
+BACKENDS = {
+    IVFIndex.backend: IVFIndex,
+}
+
+
+def backend_class():
+    name = _setting("PROJECT_ANN_BACKEND", IVFIndex.backend)
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"未知的 ANN 後端：{name}（可用：{', '.join(BACKENDS)}）")
+
+
+def index_path(project_id: int) -> Path:
+    return index_dir() / f"project_{project_id}.{backend_class().backend}.npz"
+
+
+class _IndexRegistry:
+    """
+    process 內的索引快取，檔案被其他 process 更新時（mtime 改變）自動重新載入
+    每次載入或更新都給索引一個新的 token，讓查詢端知道要重算矩陣列的群編號
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.RLock()
+        self._tokens = itertools.count(1)
+
+    def get(self, project_id: int):
+        path = index_path(project_id)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._items.pop(project_id, None)
+            return None
+        with self._lock:
+            cached = self._items.get(project_id)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        index = backend_class().load(path)
+        index.token = next(self._tokens)
+        with self._lock:
+            self._items[project_id] = (mtime, index)
+        return index
+
+    def put(self, project_id: int, index):
+        path = index_path(project_id)
+        with self._lock:
+            index.save(path)
+            index.token = next(self._tokens)
+            self._items[project_id] = (path.stat().st_mtime_ns, index)
+
+    def drop(self, project_id: int):
+        with self._lock:
+            self._items.pop(project_id, None)
+            try:
+                index_path(project_id).unlink()
+            except FileNotFoundError:
+                pass
+
+    def lock(self):
+        return self._lock
+
+
+registry = _IndexRegistry()
+
+
+def build_index(project_id: int, nlist: int = None):
+    """以目前的片段矩陣重建索引並存檔；沒有向量時刪除索引"""
+    from .vector_cache import get_project_matrix
+
+    matrix = get_project_matrix(project_id)
+    if len(matrix) == 0:
+        registry.drop(project_id)
+        return None
+    started = time.monotonic()
+    index = backend_class().build(matrix.ids, matrix.matrix, nlist=nlist)
+    registry.put(project_id, index)
+    logger.info(
+        "ANN 索引已重建：專案 %s，%s 筆，%s 群，%.1fs",
+        project_id, len(matrix), index.nlist, time.monotonic() - started,
+    )
+    return index
+
+
+def add_to_index(project_id: int, ids, vectors):
+    """新片段寫入後呼叫；索引不存在時略過（查詢時會以精確搜尋或排程重建處理）"""
+    with registry.lock():
+        index = registry.get(project_id)
+        if index is None:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        # 在副本上修改，正在查詢的執行緒仍看到完整的舊索引
+        index = copy.copy(index)
+        index.add(ids, vectors / norms)
+        registry.put(project_id, index)
+
+
+def remove_from_index(project_id: int, ids):
+    with registry.lock():
+        index = registry.get(project_id)
+        if index is None or len(ids) == 0:
+            return
+        index = copy.copy(index)
+        index.remove(ids)
+        registry.put(project_id, index)
+
+
+def schedule_rebuild(project_id: int):
+    """排一個重建索引的背景工作（已有排隊或執行中的就不重複排）；會查 DB"""
+    from .jobs import enqueue
+    from .models import BackgroundJob
+
+    pending = BackgroundJob.objects.filter(
+        kind="rebuild_ann_index",
+        payload__project_id=project_id,
+        status__in=[BackgroundJob.STATUS_QUEUED, BackgroundJob.STATUS_RUNNING],
+    ).exists()
+    if not pending:
+        enqueue("rebuild_ann_index", {"project_id": project_id})
+
+
+def search(project_id: int, matrix, q_vec, k: int, min_score: float, nprobe: int = None,
+           on_stale=schedule_rebuild):
+    """
+    小專案或尚無索引時做精確搜尋；否則只掃描最近 nprobe 群與尚未分群的片段
+    索引不存在或過舊時呼叫 on_stale(project_id)；預設直接排重建工作（會查 DB），
+    在非 ORM thread 上執行時應改傳只做記錄的 callable，回到 ORM thread 再排程
+    """
+    if len(matrix) < _setting("PROJECT_ANN_MIN_ROWS", DEFAULT_MIN_ROWS):
+        return matrix.top_k(q_vec, k=k, min_score=min_score)
+
+    index = registry.get(project_id)
+    if index is None or index.dim != matrix.dim:
+        on_stale(project_id)
+        return matrix.top_k(q_vec, k=k, min_score=min_score)
+
+    # 矩陣列依群編號排好的倒排表，只在矩陣或索引換新時重算
+    if matrix.ann_state is not None and matrix.ann_state[0] == index.token:
+        _, order, bounds = matrix.ann_state
+    else:
+        row_lists = index.lists_for_rows(matrix.ids)
+        if (row_lists < 0).mean() > REBUILD_UNASSIGNED_RATIO:
+            on_stale(project_id)
+        # 未分群（-1）排在最前面；bounds[g + 1]:bounds[g + 2] 為第 g 群的列
+        order = np.argsort(row_lists, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(row_lists + 1, minlength=index.nlist + 1))])
+        matrix.ann_state = (index.token, order, bounds)
+
+    q = np.asarray(q_vec, dtype=np.float32).ravel()
+    q_norm = np.linalg.norm(q)
+    if q.shape[0] != matrix.dim or q_norm == 0:
+        return []
+    probed = index.probe(q / q_norm, nprobe or _setting("PROJECT_ANN_NPROBE", DEFAULT_NPROBE))
+    rows = np.concatenate(
+        [order[bounds[0]:bounds[1]]] + [order[bounds[g + 1]:bounds[g + 2]] for g in probed]
+    )
+    return matrix.top_k(q, k=k, min_score=min_score, rows=rows)
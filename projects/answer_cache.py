@@ -0,0 +1,203 @@
+"""
+回答快取（project_test_api / project_test_stream_api）
+
+兩層：
+- 精確：key = (專案, sha256(llm_model + role_prompt + response_template), sha256(正規化問題))
+- 語意（可選）：同專案、同提示詞設定下，問題向量的 cosine ≥ 門檻就沿用既有回答
+
+每筆都記下當時的片段指紋（vector_cache.corpus_fingerprint，與向量矩陣快取共用、不必每題查 DB），
+文件新增、重建、刪除後指紋改變，舊回答就不再命中；提示詞修改則改變 prompt_hash。
+過期與失效的資料在寫入時順便清掉。
+
+設定（settings.py，皆可省略）：
+  PROJECT_ANSWER_CACHE_TTL                   秒，預設 86400；0 表示關閉回答快取
+  PROJECT_ANSWER_CACHE_SEMANTIC_THRESHOLD    語意快取門檻（例如 0.95），None 表示只用精確快取
+  PROJECT_ANSWER_CACHE_SEMANTIC_CANDIDATES   語意比對最多看幾筆最近的回答，預設 500
+"""
+import datetime
+import hashlib
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .embedding_cache import text_hash
+from .vector_cache import corpus_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 86400
+DEFAULT_SEMANTIC_CANDIDATES = 500
+
+_SPACE_RE = re.compile(r"\s+")
+# 句尾的問號、句號等不影響語意
+_TRAILING_PUNCT = "?？。.!！~～…、，,；;：: "
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def ttl() -> int:
+    return _setting("PROJECT_ANSWER_CACHE_TTL", DEFAULT_TTL)
+
+
+def semantic_threshold():
+    return _setting("PROJECT_ANSWER_CACHE_SEMANTIC_THRESHOLD", None)
+
+
+def normalize_question(question: str) -> str:
+    """全形半形統一（NFKC）、英文轉小寫、壓縮空白、去掉句尾標點"""
+    q = unicodedata.normalize("NFKC", question or "").lower()
+    q = _SPACE_RE.sub(" ", q).strip()
+    return q.rstrip(_TRAILING_PUNCT) or q
+
+
+def prompt_hash(project) -> str:
+    raw = "\x1f".join([project.llm_model or "", project.role_prompt or "", project.response_template or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def corpus_version(project_id: int) -> str:
+    n, last = corpus_fingerprint(project_id)
+    return f"{n}:{last or 0}"
+
+
+@dataclass
+class CacheKey:
+    project_id: int
+    prompt_hash: str
+    question: str
+    question_hash: str
+    corpus_version: str
+
+
+def make_key(project, question: str) -> CacheKey:
+    normalized = normalize_question(question)
+    return CacheKey(
+        project_id=project.pk,
+        prompt_hash=prompt_hash(project),
+        question=normalized,
+        question_hash=text_hash(normalized),
+        corpus_version=corpus_version(project.pk),
+    )
+
+
+def _question_vector(question: str):
+    # 與檢索相同的 task_type，向量多半已在 embedding_cache 中
+    from .embeddings import embed_text
+
+    return embed_text(question, task_type="retrieval_query")
+
+
+def _valid_entries(key: CacheKey):
+    from .models import AnswerCacheEntry
+
+    return AnswerCacheEntry.objects.filter(
+        project_id=key.project_id,
+        prompt_hash=key.prompt_hash,
+        corpus_version=key.corpus_version,
+        expires_at__gt=timezone.now(),
+    )
+
+
+def get(key: CacheKey):
+    """命中回傳 AnswerCacheEntry（entry.semantic_score 為語意命中的相似度，精確命中為 None），否則 None"""
+    if ttl() <= 0:
+        return None
+
+    with metrics.span("answer_cache"):
+        entry = _valid_entries(key).filter(question_hash=key.question_hash).order_by("-id").first()
+        if entry is not None:
+            entry.semantic_score = None
+            result = "hit"
+        else:
+            entry = _semantic_get(key)
+            result = "miss" if entry is None else "semantic_hit"
+        if entry is not None:
+            type(entry).objects.filter(pk=entry.pk).update(hits=F("hits") + 1)
+    metrics.CACHE_REQUESTS.inc(cache="answer", result=result)
+    return entry
+
+
+def _semantic_get(key: CacheKey):
+    threshold = semantic_threshold()
+    if threshold is None:
+        return None
+    limit = _setting("PROJECT_ANSWER_CACHE_SEMANTIC_CANDIDATES", DEFAULT_SEMANTIC_CANDIDATES)
+    candidates = list(_valid_entries(key).exclude(embedding_vector=None).order_by("-id")[:limit])
+    if not candidates:
+        return None
+    try:
+        q = np.asarray(_question_vector(key.question), dtype=np.float32)
+    except Exception as e:
+        logger.warning("語意快取向量化失敗：%s", e)
+        metrics.ERRORS.inc(component="answer_cache")
+        return None
+    q_norm = np.linalg.norm(q)
+    candidates = [e for e in candidates if e.embedding is not None and e.embedding.shape == q.shape]
+    if not candidates or q_norm == 0:
+        return None
+
+    matrix = np.stack([e.embedding for e in candidates])
+    norms = np.linalg.norm(matrix, axis=1) * q_norm
+    norms[norms == 0] = 1.0
+    scores = matrix @ q / norms
+    best = int(np.argmax(scores))
+    if scores[best] < threshold:
+        return None
+    entry = candidates[best]
+    entry.semantic_score = float(scores[best])
+    return entry
+
+
+def put(key: CacheKey, answer: str, sources):
+    """寫入回答；同 key 的舊回答與此專案已失效的資料一併刪除"""
+    from .models import AnswerCacheEntry
+
+    seconds = ttl()
+    if seconds <= 0:
+        return None
+
+    entry = AnswerCacheEntry(
+        project_id=key.project_id,
+        prompt_hash=key.prompt_hash,
+        question_hash=key.question_hash,
+        question=key.question,
+        corpus_version=key.corpus_version,
+        answer=answer,
+        sources=sources or [],
+        expires_at=timezone.now() + datetime.timedelta(seconds=seconds),
+    )
+    if semantic_threshold() is not None:
+        try:
+            entry.embedding = _question_vector(key.question)
+        except Exception as e:
+            logger.warning("語意快取向量化失敗：%s", e)
+            metrics.ERRORS.inc(component="answer_cache")
+
+    stale = AnswerCacheEntry.objects.filter(project_id=key.project_id)
+    (
+        stale.filter(question_hash=key.question_hash, prompt_hash=key.prompt_hash)
+        | stale.exclude(prompt_hash=key.prompt_hash)
+        | stale.exclude(corpus_version=key.corpus_version)
+        | stale.filter(expires_at__lte=timezone.now())
+    ).delete()
+    entry.save()
+    return entry
+
+
+def invalidate_project(project, keep_current_prompt: bool = False):
+    """刪除專案的回答快取；keep_current_prompt=True 時只刪提示詞設定已變更的部分"""
+    from .models import AnswerCacheEntry
+
+    qs = AnswerCacheEntry.objects.filter(project_id=project.pk)
+    if keep_current_prompt:
+        qs = qs.exclude(prompt_hash=prompt_hash(project))
+    qs.delete()
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 class ProjectsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
-    name = "projects"
\ No newline at end of file
+    name = "projects"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import tasks  # noqa: F401  註冊背景工作 handler
@@ -0,0 +1,476 @@
+"""
+RAG 效能基準測試（manage.py benchmark_rag）
+
+在暫存目錄建立一個新的 SQLite 資料庫（migrate 後建立合成專案：N 份文件、每份約 C 個片段），
+以離線、可重現的替身取代 genai（不連網、不花費用），量測：
+- 匯入吞吐量：切段 + 向量化、寫入（bulk_create）各自耗時，文件/片段每秒數
+- 查詢向量化延遲：第一次（未命中快取）embed_text 的耗時，含 PROJECT_EMBEDDING_COALESCE_MS 合併等待
+- search_similar_docs 延遲：vector / lexical / hybrid 三種模式，精確搜尋與 ANN 各一輪，p50/p95/p99；
+  查詢向量此時已在快取中，量到的是檢索本身（矩陣、打分、BM25、讀取片段）
+- 回答延遲：檢索 + 組 prompt + 替身 LLM（可設定固定延遲）
+- 記憶體：向量矩陣大小、冷載入耗時與峰值、ANN 索引大小、process RSS
+- 召回率：ANN 與精確搜尋 top-k 的重疊比例（recall@k）
+結果為 JSON，可與先前的結果比較（compare_results）。
+
+替身：
+- embedding：特徵雜湊（feature hashing）——每個詞雜湊到固定的隨機向量後加總再正規化，
+  相同文字得到相同向量，用詞相近的文字向量也相近，召回率才有意義
+- LLM：固定延遲後回傳固定格式的回答，usage_metadata 依字數估算
+settings 中的正式資料庫與 ANN 索引目錄都不會被讀寫；結束時刪除暫存目錄（--keep 則保留）。
+"""
+import asyncio
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import zlib
+from contextlib import ExitStack, contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+from django.test.utils import override_settings
+
+from . import ann, metrics
+from .chunking import DEFAULT_CHUNK_SIZE
+from .indexing import build_chunks_many, create_indexed_documents
+from .lexical import tokenize
+from .llm import call_gemini
+from .embedding_cache import embedding_cache
+from .retriever import embed_text_gemini, search_similar_docs
+from .vector_cache import get_project_matrix, invalidate_project, load_project_matrix, matrix_cache
+
+PROJECT_CODE_PREFIX = "bench-"
+HASH_BUCKETS = 1 << 14
+MODES = ("vector", "lexical", "hybrid")
+
+
+# ---- 離線替身 ----
+class HashEmbedder:
+    """可重現的特徵雜湊向量：詞 → crc32 → 固定隨機向量（含正負號），加總後正規化"""
+
+    def __init__(self, dim: int, buckets: int = HASH_BUCKETS, seed: int = 0):
+        self.dim = dim
+        self.buckets = buckets
+        self.table = np.random.default_rng(seed).standard_normal((buckets, dim)).astype(np.float32)
+
+    def embed(self, text: str) -> np.ndarray:
+        terms = tokenize(text)
+        if not terms:
+            return np.zeros(self.dim, dtype=np.float32)
+        codes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in terms), dtype=np.uint32, count=len(terms))
+        signs = np.where(codes & 1, 1.0, -1.0).astype(np.float32)
+        vec = (self.table[(codes >> 1) % self.buckets] * signs[:, None]).sum(axis=0)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+class OfflineGenAI:
+    """取代 embeddings 模組中的 genai：embed_content / embed_content_async"""
+
+    def __init__(self, embedder: HashEmbedder):
+        self.embedder = embedder
+
+    def embed_content(self, model, content, task_type=None, **kwargs):
+        if isinstance(content, str):
+            return {"embedding": self.embedder.embed(content).tolist()}
+        return {"embedding": [self.embedder.embed(t).tolist() for t in content]}
+
+    async def embed_content_async(self, model, content, task_type=None, **kwargs):
+        return self.embed_content(model, content, task_type)
+
+
+class OfflineModel:
+    """取代 GenerativeModel：延遲 latency 秒後回傳固定格式的回答"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def _response(self, prompt):
+        text = f"（離線回答）共參考 {prompt.count('[已知資料]')} 段資料。"
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 2, candidates_token_count=len(text) // 2)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        time.sleep(self.latency)
+        response = self._response(prompt)
+        return [response] if stream else response
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._response(prompt)
+
+
+def offline_backends(dim: int, llm_latency: float = 0.0, seed: int = 0):
+    """
+    context manager：embedding 與 LLM 改用離線替身；回答快取關閉，
+    向量快取使用獨立的模型名稱，不會混入真正的 embedding
+    """
+    stack = ExitStack()
+    stack.enter_context(mock.patch("projects.embeddings.genai", OfflineGenAI(HashEmbedder(dim, seed=seed))))
+    stack.enter_context(mock.patch("projects.embeddings.ensure_configured", lambda: None))
+    stack.enter_context(mock.patch("projects.llm.get_model", lambda name=None: OfflineModel(llm_latency)))
+    stack.enter_context(override_settings(
+        PROJECT_EMBEDDING_MODEL=offline_model_name(dim),
+        PROJECT_ANSWER_CACHE_TTL=0,
+    ))
+    return stack
+
+
+def offline_model_name(dim: int) -> str:
+    return f"offline-hash-{dim}"
+
+
+# ---- 合成語料 ----
+class Corpus:
+    """
+    主題式的合成文件：每個主題有自己偏好的詞（Zipf 分布），文件由某一主題的段落組成
+    段落長度約為 0.8 × chunk_size，因此每段大致切成一個片段
+    """
+
+    def __init__(self, seed: int = 0, vocab: int = 5000, topics: int = 50, chunk_size: int = None):
+        self.rng = np.random.default_rng(seed)
+        self.words = np.array([f"w{i:05d}" for i in range(vocab)])
+        self.topics = [self.rng.permutation(vocab)[:400] for _ in range(topics)]
+        weights = 1.0 / np.arange(1, 401)
+        self.weights = weights / weights.sum()
+        chunk_size = chunk_size or getattr(settings, "PROJECT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+        self.words_per_paragraph = max(5, int(chunk_size * 0.8) // 7)
+
+    def paragraph(self, topic: int) -> str:
+        idx = self.rng.choice(self.topics[topic], size=self.words_per_paragraph, p=self.weights)
+        words = self.words[idx]
+        # 每 12 個詞一句
+        sentences = [" ".join(words[i:i + 12]) + "." for i in range(0, len(words), 12)]
+        return " ".join(sentences)
+
+    def document(self, paragraphs: int) -> str:
+        topic = int(self.rng.integers(len(self.topics)))
+        return "\n\n".join(self.paragraph(topic) for _ in range(paragraphs))
+
+    def query_from(self, text: str, words: int = 8) -> str:
+        """從片段中抽幾個詞組成查詢（模擬使用者用文件裡的說法發問）"""
+        terms = text.split()
+        picked = self.rng.choice(len(terms), size=min(words, len(terms)), replace=False)
+        return " ".join(terms[i].rstrip(".") for i in sorted(picked))
+
+
+# ---- 量測工具 ----
+def latency_stats(samples):
+    """秒 → 毫秒統計"""
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": int(len(ms)),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def _rss_mb() -> float:
+    # Linux 的 ru_maxrss 單位為 KB（峰值）
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+# ---- 各項量測 ----
+def _import_corpus(project, corpus, dim: int, docs: int, paragraphs: int, batch: int, log):
+    from .models import ProjectDocument
+
+    model = offline_model_name(dim)
+    calls_before = metrics.EMBEDDING_CALLS.value(model=model)
+    embed_seconds = write_seconds = 0.0
+    n_chunks = 0
+    texts = []
+    for start in range(0, docs, batch):
+        group = [
+            ProjectDocument(
+                project=project,
+                filename=f"doc_{i:06d}.txt",
+                content=corpus.document(paragraphs),
+                status=ProjectDocument.STATUS_READY,
+            )
+            for i in range(start, min(start + batch, docs))
+        ]
+        chunk_lists, seconds = _timed(build_chunks_many, group, strict=True)
+        embed_seconds += seconds
+        chunks = [c for doc_chunks in chunk_lists for c in doc_chunks]
+        _, seconds = _timed(create_indexed_documents, group, chunks)
+        write_seconds += seconds
+        n_chunks += len(chunks)
+        texts.extend(c.content for c in chunks)
+        log(f"匯入 {min(start + batch, docs)}/{docs} 份文件，{n_chunks} 個片段")
+
+    total = embed_seconds + write_seconds
+    return texts, {
+        "documents": docs,
+        "chunks": n_chunks,
+        "chunk_embed_seconds": round(embed_seconds, 3),
+        "write_seconds": round(write_seconds, 3),
+        "total_seconds": round(total, 3),
+        "documents_per_second": round(docs / total, 1) if total else None,
+        "chunks_per_second": round(n_chunks / total, 1) if total else None,
+        "embedding_calls": int(metrics.EMBEDDING_CALLS.value(model=model) - calls_before),
+    }
+
+
+def _query_embedding_latency(queries):
+    samples = []
+    for q in queries:
+        _, seconds = _timed(embed_text_gemini, q)
+        samples.append(seconds)
+    return latency_stats(samples)
+
+
+def _search_latency(project_id, queries, top_k, nprobe, warmup: int = 5):
+    result = {}
+    for mode in MODES:
+        for q in queries[:warmup]:
+            search_similar_docs(project_id, q, top_k=top_k, nprobe=nprobe, mode=mode)
+        samples = []
+        for q in queries[warmup:]:
+            _, seconds = _timed(search_similar_docs, project_id, q, top_k=top_k, nprobe=nprobe, mode=mode)
+            samples.append(seconds)
+        result[mode] = latency_stats(samples)
+    return result
+
+
+def _answer_latency(project_id, queries, top_k):
+    samples = []
+    for q in queries:
+        started = time.perf_counter()
+        hits = search_similar_docs(project_id, q, top_k=top_k)
+        context = "\n\n".join(f"[{i + 1}] {h['text']}" for i, h in enumerate(hits))
+        call_gemini("你是基準測試助理。", q, context=context)
+        samples.append(time.perf_counter() - started)
+    return latency_stats(samples)
+
+
+def _recall(project_id, embedder, queries, top_k, nprobe):
+    """ANN 與精確搜尋（同一個矩陣）top-k 的重疊比例；同時記錄純計算延遲"""
+    matrix = get_project_matrix(project_id)
+    recalls, exact_s, ann_s = [], [], []
+    for q in queries:
+        q_vec = embedder.embed(q)
+        exact, seconds = _timed(matrix.top_k, q_vec, k=top_k, min_score=-1.0)
+        exact_s.append(seconds)
+        approx, seconds = _timed(ann.search, project_id, matrix, q_vec, k=top_k, min_score=-1.0, nprobe=nprobe)
+        ann_s.append(seconds)
+        truth = {i for i, _ in exact}
+        if truth:
+            recalls.append(len(truth & {i for i, _ in approx}) / len(truth))
+    return {
+        f"recall_at_{top_k}": round(float(np.mean(recalls)), 4) if recalls else None,
+        "exact_scan": latency_stats(exact_s),
+        "ann_scan": latency_stats(ann_s),
+    }
+
+
+def _memory(project_id):
+    invalidate_project(project_id)
+    tracemalloc.start()
+    matrix, seconds = _timed(load_project_matrix, project_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    index = ann.registry.get(project_id)
+    index_bytes = 0
+    if index is not None:
+        index_bytes = index.centroids.nbytes + index.ids.nbytes + index.lists.nbytes
+    return {
+        "rows": len(matrix),
+        "dim": matrix.dim,
+        "matrix_mb": round(matrix.nbytes / 1024 / 1024, 2),
+        "matrix_cold_load_seconds": round(seconds, 3),
+        "matrix_cold_load_peak_mb": round(peak / 1024 / 1024, 2),
+        "ann_index_mb": round(index_bytes / 1024 / 1024, 2),
+        "ann_nlist": index.nlist if index is not None else None,
+        "rss_peak_mb": _rss_mb(),
+    }
+
+
+@contextmanager
+def use_database(path: str, profile: dict):
+    """暫時把 default 資料庫換成 path（套用 profile 的 ENGINE / OPTIONS / CONN_MAX_AGE）"""
+    db = connections.settings["default"]
+    saved = dict(db)
+    connections["default"].close()
+    del connections["default"]
+    db.update(profile, NAME=path)
+    try:
+        yield
+    finally:
+        connections["default"].close()
+        del connections["default"]
+        db.clear()
+        db.update(saved)
+
+
+def _sqlite_profile() -> dict:
+    """暫存資料庫的設定：default 是 SQLite 時沿用其 ENGINE / OPTIONS，否則用內建的 sqlite3"""
+    db = settings.DATABASES["default"]
+    if "sqlite" in db["ENGINE"]:
+        return {"ENGINE": db["ENGINE"], "OPTIONS": dict(db.get("OPTIONS", {})), "CONN_MAX_AGE": 0}
+    return {"ENGINE": "django.db.backends.sqlite3", "OPTIONS": {}, "CONN_MAX_AGE": 0}
+
+
+def run_benchmark(docs: int = 200, paragraphs: int = 5, dim: int = 768, queries: int = 200, top_k: int = 3,
+                  nprobe: int = None, nlist: int = None, batch: int = 100, llm_latency: float = 0.0,
+                  seed: int = 0, keep: bool = False, log=print):
+    """執行全部量測，回傳結果 dict；資料庫與 ANN 索引都在暫存目錄，keep=False 時結束後刪除"""
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    directory = tempfile.mkdtemp(prefix="csw-rag-benchmark-")
+    profile = _sqlite_profile()
+    # process 內的快取以專案 id 為 key，與正式資料庫的專案會撞號，前後都清掉
+    embedding_cache.clear_memory()
+    matrix_cache.clear()
+    try:
+        with use_database(os.path.join(directory, "benchmark.sqlite3"), profile), \
+                override_settings(PROJECT_ANN_DIR=os.path.join(directory, "ann")):
+            log(f"建立暫存資料庫 {directory}")
+            call_command("migrate", verbosity=0)
+            result = _run(started_at, docs, paragraphs, dim, queries, top_k, nprobe, nlist, batch,
+                          llm_latency, seed, log)
+    finally:
+        embedding_cache.clear_memory()
+        matrix_cache.clear()
+        if not keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    result["meta"]["database"] = profile["ENGINE"]
+    result["meta"]["directory"] = directory if keep else None
+    result["meta"]["seconds"] = round((datetime.datetime.now(datetime.timezone.utc) - started_at).total_seconds(), 1)
+    return result
+
+
+def _run(started_at, docs, paragraphs, dim, queries, top_k, nprobe, nlist, batch, llm_latency, seed, log):
+    from .models import LLMProject
+
+    corpus = Corpus(seed=seed)
+    embedder = HashEmbedder(dim, seed=seed)
+    project = LLMProject.objects.create(
+        project_code=f"{PROJECT_CODE_PREFIX}{started_at:%m%d%H%M%S}",
+        name=f"基準測試 {docs}×{paragraphs} d={dim}",
+        llm_model="gemini",
+    )
+    result = {
+        "meta": {
+            "started_at": started_at.isoformat(),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+            "params": {
+                "docs": docs, "paragraphs_per_doc": paragraphs, "dim": dim, "queries": queries,
+                "top_k": top_k, "nprobe": nprobe or getattr(settings, "PROJECT_ANN_NPROBE", ann.DEFAULT_NPROBE),
+                "nlist": nlist, "batch": batch, "llm_latency_ms": llm_latency * 1000, "seed": seed,
+                "coalesce_ms": getattr(settings, "PROJECT_EMBEDDING_COALESCE_MS", 10),
+                "retrieval_mode": getattr(settings, "PROJECT_RETRIEVAL_MODE", "hybrid"),
+            },
+        },
+        "memory": {"rss_before_mb": _rss_mb()},
+    }
+    with offline_backends(dim, llm_latency=llm_latency, seed=seed):
+        texts, result["import"] = _import_corpus(project, corpus, dim, docs, paragraphs, batch, log)
+        result["memory"]["rss_after_import_mb"] = _rss_mb()
+
+        n_queries = max(queries, 10)
+        picks = corpus.rng.choice(len(texts), size=n_queries, replace=len(texts) < n_queries)
+        query_texts = [corpus.query_from(texts[i]) for i in picks]
+
+        log("量測查詢向量化延遲")
+        result["query_embedding"] = _query_embedding_latency(query_texts)
+        log("量測精確搜尋延遲")
+        with override_settings(PROJECT_ANN_MIN_ROWS=10 ** 12):
+            result["search_exact"] = _search_latency(project.pk, query_texts, top_k, nprobe)
+
+        log("建立 ANN 索引")
+        _, seconds = _timed(ann.build_index, project.pk, nlist=nlist)
+        result["ann_build_seconds"] = round(seconds, 3)
+        with override_settings(PROJECT_ANN_MIN_ROWS=0):
+            log("量測 ANN 搜尋延遲與召回率")
+            result["search_ann"] = _search_latency(project.pk, query_texts, top_k, nprobe)
+            result["recall"] = _recall(project.pk, embedder, query_texts, top_k, nprobe)
+
+        log("量測回答延遲")
+        result["answer"] = _answer_latency(project.pk, query_texts[: max(10, n_queries // 4)], top_k)
+        result["memory"].update(_memory(project.pk))
+    return result
+
+
+# ---- 比較 ----
+COMPARE_KEYS = [
+    ("import", "documents_per_second", True),
+    ("import", "chunks_per_second", True),
+    ("query_embedding", "p50_ms", False),
+    ("search_exact.vector", "p50_ms", False),
+    ("search_exact.vector", "p99_ms", False),
+    ("search_exact.hybrid", "p50_ms", False),
+    ("search_exact.hybrid", "p99_ms", False),
+    ("search_ann.vector", "p50_ms", False),
+    ("search_ann.vector", "p99_ms", False),
+    ("search_ann.hybrid", "p50_ms", False),
+    ("search_ann.hybrid", "p99_ms", False),
+    ("recall", None, True),
+    ("answer", "p50_ms", False),
+    ("answer", "p99_ms", False),
+    ("memory", "matrix_mb", False),
+    ("memory", "rss_peak_mb", False),
+]
+
+
+def _lookup(data, path, key):
+    """回傳 (key, 值)；key 為 None 時取 recall_at_k"""
+    for part in path.split("."):
+        data = (data or {}).get(part)
+    if key is None and isinstance(data, dict):
+        key = next((k for k in data if k.startswith("recall_at_")), None)
+    return key, (data or {}).get(key) if key else None
+
+
+def compare_results(old: dict, new: dict):
+    """回傳 [(指標, 舊值, 新值, 變化 %, 是否變好)]；變化以新值相對舊值計"""
+    rows = []
+    for path, key, higher_is_better in COMPARE_KEYS:
+        _, a = _lookup(old, path, key)
+        name, b = _lookup(new, path, key)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a * 100 if a else None
+        better = None if change is None else (change > 0) == higher_is_better
+        rows.append((f"{path}.{name}", a, b, change, better))
+    return rows
+
+
+def write_json(result: dict, path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
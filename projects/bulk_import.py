@@ -0,0 +1,255 @@
+"""
+批次匯入：一次匯入多個上傳檔、ZIP 壓縮檔，或伺服器上的整個資料夾（背景工作 bulk_import）
+
+流程：
+1. 列出所有來源檔案（ZIP 內的檔案、資料夾內的檔案遞迴展開；不支援的格式列入略過）
+2. thread pool 並行解析文字
+3. 以內容雜湊去重：同批重複、或專案中已有相同內容（content_hash）的檔案不再建立
+4. 所有新文件的片段合併批次向量化（embed_texts 依供應商上限分批）
+5. 文件、片段、詞頻在同一個交易內 bulk_create
+最後回傳摘要報告（新增、重複、略過、失敗、片段數、耗時）。
+
+來源項目（payload 中的 files / archives）：
+  {"name": 原始檔名, "storage": default_storage 中的檔名} 或 {"name": 原始檔名, "path": 伺服器路徑}
+
+設定（settings.py，皆可省略）：
+  PROJECT_BULK_IMPORT_WORKERS        並行解析的執行緒數，預設 4
+  PROJECT_BULK_IMPORT_MAX_FILES      一次最多匯入幾個檔案，預設 1000
+  PROJECT_BULK_IMPORT_MAX_FILE_MB    ZIP 內單一檔案解壓後上限（MB），預設 100
+  PROJECT_BULK_IMPORT_EMBED_DOCS     每幾份文件向量化一次並回報進度，預設 50
+"""
+import io
+import logging
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from . import metrics
+from .embedding_cache import text_hash
+from .extraction import extract_text_from_file
+from .indexing import build_chunks_many, create_indexed_documents
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".xls", ".xlsx", ".csv", ".txt")
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_FILES = 1000
+DEFAULT_MAX_FILE_MB = 100
+DEFAULT_EMBED_DOCS = 50
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_supported(name: str) -> bool:
+    parts = name.replace("\\", "/").split("/")
+    # macOS 壓縮檔夾帶的 __MACOSX/、._xxx 與隱藏檔
+    if "__MACOSX" in parts or parts[-1].startswith("."):
+        return False
+    return os.path.splitext(parts[-1])[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def is_archive(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() == ".zip"
+
+
+@dataclass
+class Source:
+    name: str                   # 文件檔名（ZIP / 資料夾內為相對路徑）
+    open: Callable              # 回傳可 seek 的二進位檔案物件
+    storage: str = ""           # 上傳檔在 default_storage 中的檔名，會寫入 uploaded_file
+    size: int = 0
+
+
+def _opener(item):
+    if item.get("storage"):
+        return lambda: default_storage.open(item["storage"], "rb")
+    return lambda: open(item["path"], "rb")
+
+
+def _member_name(info: zipfile.ZipInfo) -> str:
+    """沒有 UTF-8 旗標的檔名 zipfile 會用 cp437 解碼；Windows 壓的中文檔名多半是 Big5 / GBK"""
+    name = info.filename
+    if info.flag_bits & 0x800:
+        return name
+    try:
+        raw = name.encode("cp437")
+    except UnicodeEncodeError:
+        return name
+    for encoding in ("utf-8", "big5", "gbk"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return name
+
+
+def _archive_sources(item, skipped):
+    open_archive = _opener(item)
+    max_bytes = _setting("PROJECT_BULK_IMPORT_MAX_FILE_MB", DEFAULT_MAX_FILE_MB) * 1024 * 1024
+    with open_archive() as fh, zipfile.ZipFile(fh) as zf:
+        infos = [i for i in zf.infolist() if not i.is_dir()]
+    for info in infos:
+        name = _member_name(info)
+        if not is_supported(name):
+            skipped.append({"name": f"{item['name']}/{name}", "reason": "不支援的檔案格式"})
+            continue
+        if info.file_size > max_bytes:
+            skipped.append({"name": f"{item['name']}/{name}", "reason": "檔案過大"})
+            continue
+
+        def open_member(member=info.filename):
+            # 每個執行緒各自開啟壓縮檔；解壓後放在記憶體中（試算表、PDF 解析需要 seek）
+            with open_archive() as fh, zipfile.ZipFile(fh) as zf:
+                return io.BytesIO(zf.read(member))
+
+        yield Source(name=name, open=open_member, size=info.file_size)
+
+
+def _directory_sources(directory, skipped):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, directory)
+            if is_archive(name):
+                yield from _archive_sources({"name": name, "path": path}, skipped)
+            elif is_supported(name):
+                yield Source(name=name, open=_opener({"path": path}), size=os.path.getsize(path))
+            else:
+                skipped.append({"name": name, "reason": "不支援的檔案格式"})
+
+
+def collect_sources(files=(), archives=(), directory=None, skipped=None):
+    """展開所有來源；不支援或過大的檔案加入 skipped"""
+    skipped = [] if skipped is None else skipped
+    sources = []
+    for item in files:
+        if is_supported(item["name"]):
+            sources.append(Source(name=item["name"], open=_opener(item), storage=item.get("storage", "")))
+        else:
+            skipped.append({"name": item["name"], "reason": "不支援的檔案格式"})
+    for item in archives:
+        try:
+            sources.extend(_archive_sources(item, skipped))
+        except zipfile.BadZipFile:
+            skipped.append({"name": item["name"], "reason": "不是有效的 ZIP 檔"})
+    if directory:
+        sources.extend(_directory_sources(directory, skipped))
+    return sources
+
+
+def _extract(source: Source) -> str:
+    with source.open() as f:
+        return extract_text_from_file(f, source.name)
+
+
+def run_bulk_import(project_id: int, files=(), archives=(), directory=None, user_id: int = None,
+                    on_progress=None):
+    """
+    匯入所有來源並回傳摘要報告；解析過程中每完成一個檔案呼叫 on_progress(progress)
+    向量化失敗直接 raise（交給背景工作重試）；此時尚未寫入任何文件
+    """
+    from .models import ProjectDocument
+
+    started = time.monotonic()
+    progress = {
+        "files": 0,
+        "extracted": 0,
+        "embedded": 0,
+        "created": 0,
+        "chunks": 0,
+        "duplicates": [],
+        "skipped": [],
+        "failed": [],
+        "documents": [],
+        "seconds": 0,
+    }
+
+    def report():
+        progress["seconds"] = round(time.monotonic() - started, 1)
+        if on_progress is not None:
+            on_progress(progress)
+
+    sources = collect_sources(files, archives, directory, skipped=progress["skipped"])
+    limit = _setting("PROJECT_BULK_IMPORT_MAX_FILES", DEFAULT_MAX_FILES)
+    for source in sources[limit:]:
+        progress["skipped"].append({"name": source.name, "reason": f"超過單次匯入上限 {limit} 個檔案"})
+    sources = sources[:limit]
+    progress["files"] = len(sources)
+    report()
+
+    # 專案中已有的內容（先前批次匯入或爬蟲的文件）
+    seen = dict(
+        ProjectDocument.objects.filter(project_id=project_id).exclude(content_hash="")
+        .values_list("content_hash", "filename")
+    )
+    docs = []
+    workers = max(1, _setting("PROJECT_BULK_IMPORT_WORKERS", DEFAULT_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-import") as pool:
+        futures = [pool.submit(_extract, source) for source in sources]
+        # 依來源順序收結果：重複內容時保留排在前面的檔案
+        for source, future in zip(sources, futures):
+            try:
+                text = future.result()
+            except Exception as e:
+                progress["failed"].append({"name": source.name, "error": str(e)[:500]})
+            else:
+                if not (text or "").strip():
+                    progress["skipped"].append({"name": source.name, "reason": "沒有可擷取的文字"})
+                else:
+                    h = text_hash(text)
+                    if h in seen:
+                        progress["duplicates"].append({"name": source.name, "duplicate_of": seen[h]})
+                    else:
+                        seen[h] = source.name
+                        docs.append(ProjectDocument(
+                            project_id=project_id,
+                            filename=source.name[:512],
+                            uploaded_file=source.storage or None,
+                            content=text,
+                            content_hash=h,
+                            imported_by_id=user_id,
+                            status=ProjectDocument.STATUS_READY,
+                        ))
+            progress["extracted"] += 1
+            report()
+
+    # 分組向量化只是為了回報進度；每組內的片段仍合併成批次請求
+    group = max(1, _setting("PROJECT_BULK_IMPORT_EMBED_DOCS", DEFAULT_EMBED_DOCS))
+    chunks = []
+    for start in range(0, len(docs), group):
+        for doc_chunks in build_chunks_many(docs[start:start + group], strict=True):
+            chunks.extend(doc_chunks)
+        progress["embedded"] = min(start + group, len(docs))
+        report()
+
+    if docs:
+        create_indexed_documents(docs, chunks)
+    progress["created"] = len(docs)
+    progress["chunks"] = len(chunks)
+    progress["documents"] = [{"id": d.pk, "filename": d.filename} for d in docs[-50:]]
+
+    # 上傳的 ZIP 已展開成文件；略過、重複、解析失敗的上傳檔沒有成為文件，都不必保留
+    discard_uploads(files, archives, keep={d.uploaded_file.name for d in docs if d.uploaded_file})
+    report()
+    return progress
+
+
+def discard_uploads(files=(), archives=(), keep=()):
+    """刪除 default_storage 中不再需要的上傳檔（keep 為已寫入文件 uploaded_file 的檔名）"""
+    for item in list(files) + list(archives):
+        name = item.get("storage")
+        if name and name not in keep:
+            try:
+                default_storage.delete(name)
+            except Exception as e:
+                logger.warning("刪除上傳檔失敗 %s：%s", name, e)
+                metrics.ERRORS.inc(component="bulk_import")
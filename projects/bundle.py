@@ -0,0 +1,316 @@
+"""
+專案包（bundle）：在不同環境之間搬移整個專案，匯入時不需重新向量化
+
+ZIP 內容：
+  project.json     格式版本、專案欄位、向量模型與維度、筆數
+  documents.jsonl  每行一份文件（ref 為原始 id，供片段對應）
+  chunks.jsonl     每行一個片段；vector_row 指向 vectors.npy 的列，沒有向量為 null
+  vectors.npy      所有片段向量，一個 (n, dim) float32 little-endian 矩陣（不壓縮）
+
+匯出以 streaming.stream_zip 邊查邊送；匯入逐行讀取、分批 bulk_create，向量依序從 .npy 讀出。
+"""
+import array
+import io
+import json
+import zipfile
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .embeddings import embedding_model
+from .lexical import build_terms
+from .streaming import stream_zip
+from .vector_cache import invalidate_project
+
+FORMAT = "csw-project-bundle"
+VERSION = 1
+BATCH_SIZE = 500
+
+PROJECT_FIELDS = [
+    "project_code", "name", "description", "llm_model", "embedding_engine",
+    "role_prompt", "response_template", "example_prompts",
+]
+DOCUMENT_FIELDS = [
+    "filename", "content", "status", "status_message",
+    "source_url", "etag", "last_modified", "content_hash",
+]
+CHUNK_FIELDS = ["chunk_index", "heading", "content", "token_count"]
+ENTRIES = ["project.json", "documents.jsonl", "chunks.jsonl", "vectors.npy"]
+
+_VECTOR_DTYPE = np.dtype("<f4")
+
+
+def _jsonl(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+# ---- 匯出 ----
+def export_entries(project):
+    """回傳 stream_zip 用的 entries；各檔案內容都是 generator，依序產生"""
+    from .models import DocumentChunk, ProjectDocument
+
+    state = {"documents": 0, "chunks": 0, "dim": None, "vector_ids": array.array("q")}
+
+    def documents():
+        rows = (
+            ProjectDocument.objects.filter(project=project).order_by("id")
+            .values_list("id", "imported_at", "fetched_at", *DOCUMENT_FIELDS)
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+        for doc_id, imported_at, fetched_at, *values in rows:
+            state["documents"] += 1
+            row = dict(zip(DOCUMENT_FIELDS, values))
+            row.update(ref=doc_id, imported_at=_iso(imported_at), fetched_at=_iso(fetched_at))
+            yield _jsonl(row)
+
+    def chunks():
+        rows = (
+            DocumentChunk.objects.filter(project=project).order_by("id")
+            .values_list("id", "document_id", "embedding_dim", *CHUNK_FIELDS)
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+        for chunk_id, document_id, dim, *values in rows:
+            state["chunks"] += 1
+            if dim and state["dim"] is None:
+                state["dim"] = dim
+            vector_row = None
+            # 維度與第一筆不同的向量（換過模型的殘留）不匯出
+            if dim and dim == state["dim"]:
+                vector_row = len(state["vector_ids"])
+                state["vector_ids"].append(chunk_id)
+            row = dict(zip(CHUNK_FIELDS, values))
+            row.update(document=document_id, vector_row=vector_row)
+            yield _jsonl(row)
+
+    def vectors():
+        ids = np.frombuffer(state["vector_ids"], dtype=np.int64) if state["vector_ids"] else np.empty(0, np.int64)
+        dim = state["dim"] or 0
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(
+            header, {"descr": _VECTOR_DTYPE.str, "fortran_order": False, "shape": (len(ids), dim)}
+        )
+        yield header.getvalue()
+        if not len(ids):
+            return
+        zero = np.zeros(dim, dtype=_VECTOR_DTYPE).tobytes()
+        written = 0
+        rows = (
+            DocumentChunk.objects.filter(project=project, id__gte=int(ids[0]), id__lte=int(ids[-1]))
+            .order_by("id")
+            .values_list("id", "embedding_vector", "embedding_dim", "embedding_dtype")
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+        for chunk_id, data, row_dim, dtype in rows:
+            # 兩次讀取之間被刪掉的片段補零，維持列數與 chunks.jsonl 一致
+            while written < len(ids) and ids[written] < chunk_id:
+                yield zero
+                written += 1
+            if written >= len(ids):
+                break
+            if ids[written] != chunk_id:
+                continue
+            vec = np.frombuffer(data, dtype=np.dtype(dtype or "float32").newbyteorder("<"))
+            yield vec.astype(_VECTOR_DTYPE).tobytes() if row_dim == dim else zero
+            written += 1
+        while written < len(ids):
+            yield zero
+            written += 1
+
+    def manifest():
+        data = {
+            "format": FORMAT,
+            "version": VERSION,
+            "exported_at": timezone.now().isoformat(),
+            "project": {f: getattr(project, f) for f in PROJECT_FIELDS},
+            "embedding": {"model": embedding_model(), "dim": state["dim"], "dtype": "float32"},
+            "counts": {
+                "documents": state["documents"],
+                "chunks": state["chunks"],
+                "vectors": len(state["vector_ids"]),
+            },
+        }
+        yield json.dumps(data, ensure_ascii=False, indent=2)
+
+    return [
+        ("documents.jsonl", documents()),
+        ("chunks.jsonl", chunks()),
+        ("vectors.npy", vectors(), zipfile.ZIP_STORED),  # 浮點數幾乎壓不動，直接存放
+        ("project.json", manifest()),
+    ]
+
+
+def export_stream(project):
+    return stream_zip(export_entries(project))
+
+
+# ---- 匯入 ----
+class BundleError(ValueError):
+    pass
+
+
+def read_manifest(zf: zipfile.ZipFile) -> dict:
+    try:
+        manifest = json.loads(zf.read("project.json"))
+    except KeyError:
+        raise BundleError("不是專案包：缺少 project.json")
+    except ValueError:
+        raise BundleError("不是專案包：project.json 不是有效的 JSON")
+    if not isinstance(manifest, dict) or manifest.get("format") != FORMAT:
+        raise BundleError("不是專案包：格式不符")
+    if manifest.get("version", 0) > VERSION:
+        raise BundleError(f"專案包版本 {manifest.get('version')} 過新，請先更新系統")
+    return manifest
+
+
+def _lines(zf, name):
+    with zf.open(name) as f:
+        for lineno, line in enumerate(io.TextIOWrapper(f, encoding="utf-8"), 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                raise BundleError(f"{name} 第 {lineno} 行不是有效的 JSON 物件")
+            yield row
+
+
+class _VectorReader:
+    """依序讀出 vectors.npy 的列；每次讀一批，不把整個矩陣載入記憶體"""
+
+    def __init__(self, f):
+        self.f = f
+        try:
+            major, _ = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if major == 1 else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+        except ValueError:
+            raise BundleError("vectors.npy 格式不符")
+        if fortran_order or len(shape) != 2:
+            raise BundleError("vectors.npy 格式不符")
+        self.rows, self.dim = shape
+        self.dtype = dtype
+        self.next_row = 0
+        self._buffer = np.empty((0, self.dim), dtype=dtype)
+        self._offset = 0
+
+    def read(self, row: int):
+        if row != self.next_row:
+            raise BundleError(f"vector_row 不連續：預期 {self.next_row}，收到 {row}")
+        if self._offset >= len(self._buffer):
+            n = min(BATCH_SIZE, self.rows - self.next_row)
+            if n <= 0:
+                raise BundleError("vectors.npy 列數不足")
+            raw = self.f.read(n * self.dim * self.dtype.itemsize)
+            self._buffer = np.frombuffer(raw, dtype=self.dtype).reshape(n, self.dim)
+            self._offset = 0
+        vec = self._buffer[self._offset]
+        self._offset += 1
+        self.next_row += 1
+        return vec
+
+
+def import_bundle(fileobj, project_code: str = None, name: str = None, user=None, allow_model_mismatch=False):
+    """
+    從專案包建立新專案（含文件、片段、向量與 BM25 詞頻）；回傳 (project, counts)
+    project_code / name 可覆蓋專案包內的值；專案代碼重複、或專案包內容缺漏／損壞時 raise BundleError
+    """
+    from .models import DocumentChunk, LLMProject, ProjectDocument
+
+    try:
+        zf = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise BundleError("不是有效的 ZIP 檔")
+
+    with zf:
+        manifest = read_manifest(zf)
+        missing = [n for n in ENTRIES if n not in zf.namelist()]
+        if missing:
+            raise BundleError(f"專案包不完整：缺少 {', '.join(missing)}")
+        if not isinstance(manifest.get("project"), dict):
+            raise BundleError("專案包不完整：project.json 沒有專案欄位")
+        model = manifest.get("embedding", {}).get("model")
+        if model and model != embedding_model() and not allow_model_mismatch:
+            raise BundleError(f"專案包的向量模型為 {model}，與目前設定的 {embedding_model()} 不同，查詢向量將無法比對")
+
+        fields = {f: manifest["project"].get(f) for f in PROJECT_FIELDS}
+        if project_code:
+            fields["project_code"] = project_code
+        if name:
+            fields["name"] = name
+        if fields["project_code"] and LLMProject.objects.filter(project_code=fields["project_code"]).exists():
+            raise BundleError(f"專案代碼 {fields['project_code']} 已存在，請指定新的專案代碼")
+
+        counts = {"documents": 0, "chunks": 0, "vectors": 0}
+        with transaction.atomic():
+            project = LLMProject.objects.create(**fields)
+
+            doc_ids = {}
+            batch, refs = [], []
+            for row in _lines(zf, "documents.jsonl"):
+                if row.get("ref") is None:
+                    raise BundleError("documents.jsonl 有文件缺少 ref")
+                refs.append(row["ref"])
+                batch.append(ProjectDocument(
+                    project=project,
+                    imported_by=user,
+                    fetched_at=row.get("fetched_at"),
+                    **{f: row.get(f) if row.get(f) is not None else "" for f in DOCUMENT_FIELDS},
+                ))
+                if len(batch) >= BATCH_SIZE:
+                    _create_documents(batch, refs, doc_ids)
+                    counts["documents"] += len(batch)
+                    batch, refs = [], []
+            if batch:
+                _create_documents(batch, refs, doc_ids)
+                counts["documents"] += len(batch)
+
+            with zf.open("vectors.npy") as vf:
+                vectors = _VectorReader(vf)
+                batch = []
+                for row in _lines(zf, "chunks.jsonl"):
+                    document_id = doc_ids.get(row.get("document"))
+                    if document_id is None:
+                        raise BundleError(f"chunks.jsonl 的片段指向不存在的文件 {row.get('document')}")
+                    missing = [f for f in CHUNK_FIELDS if f not in row]
+                    if missing:
+                        raise BundleError(f"chunks.jsonl 的片段缺少欄位 {', '.join(missing)}")
+                    chunk = DocumentChunk(
+                        project=project,
+                        document_id=document_id,
+                        **{f: row[f] for f in CHUNK_FIELDS},
+                    )
+                    if row.get("vector_row") is not None:
+                        chunk.embedding = vectors.read(row["vector_row"])
+                        counts["vectors"] += 1
+                    batch.append(chunk)
+                    if len(batch) >= BATCH_SIZE:
+                        _create_chunks(batch)
+                        counts["chunks"] += len(batch)
+                        batch = []
+                if batch:
+                    _create_chunks(batch)
+                    counts["chunks"] += len(batch)
+
+    invalidate_project(project.pk)
+    return project, counts
+
+
+def _create_documents(batch, refs, doc_ids):
+    from .models import ProjectDocument
+
+    ProjectDocument.objects.bulk_create(batch)
+    doc_ids.update(zip(refs, (d.pk for d in batch)))
+
+
+def _create_chunks(batch):
+    from .models import ChunkTerm, DocumentChunk
+
+    DocumentChunk.objects.bulk_create(batch)
+    ChunkTerm.objects.bulk_create(build_terms(batch), batch_size=1000)
@@ -0,0 +1,145 @@
+"""
+文件切段（chunking）
+
+長文件先依標題（Markdown `#`、「第一章」、「第3條」、「一、」…）切成章節，
+章節內再依段落 → 行 → 句子 → 字元的順序遞迴切開，最後合併成
+不超過 chunk_size 個字、彼此重疊 chunk_overlap 個字的片段。
+
+設定（settings.py，皆可省略）：
+  PROJECT_CHUNK_SIZE        每段最多字數，預設 800
+  PROJECT_CHUNK_OVERLAP     相鄰兩段重疊字數，預設 100
+  PROJECT_CHUNK_SEPARATORS  章節內切分順序，預設 DEFAULT_SEPARATORS
+"""
+import re
+from dataclasses import dataclass
+
+from django.conf import settings
+
+DEFAULT_CHUNK_SIZE = 800
+DEFAULT_CHUNK_OVERLAP = 100
+# 由粗到細；"" 代表最後手段：直接按字數硬切
+DEFAULT_SEPARATORS = ["\n\n", "\n", "。", "！", "？", "；", ". ", "! ", "? ", "; ", "，", ", ", " ", ""]
+
+# 視為標題的行：Markdown 標題、第X章/節/條/篇、「一、」「（一）」開頭的短行
+_HEADING_RE = re.compile(
+    r"^(?:"
+    r"#{1,6}\s+\S.*"
+    r"|第[一二三四五六七八九十百千零〇\d]+[章節條篇部].{0,40}"
+    r"|[一二三四五六七八九十]+、.{1,40}"
+    r"|[（(][一二三四五六七八九十\d]+[)）].{1,40}"
+    r")$"
+)
+
+
+def with_heading(heading: str, text: str) -> str:
+    """給向量化與 LLM context 用：在片段前補上所屬章節標題"""
+    if heading and not text.startswith(heading):
+        return f"{heading}\n{text}"
+    return text
+
+
+@dataclass
+class Chunk:
+    heading: str
+    text: str
+
+    @property
+    def full_text(self) -> str:
+        return with_heading(self.heading, self.text)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def split_sections(text: str, min_size: int = 0):
+    """
+    依標題行把全文切成 [(heading, body), ...]；第一個標題前的內容 heading 為 ""
+    內容少於 min_size 字的章節併入前一章節，避免條列式標題切出一堆碎片
+    """
+    sections = []
+    heading, lines = "", []
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped and len(stripped) <= 60 and _HEADING_RE.match(stripped):
+            if "".join(lines).strip():
+                sections.append((heading, "".join(lines)))
+            heading, lines = stripped.lstrip("#").strip(), [line]
+        else:
+            lines.append(line)
+    if "".join(lines).strip():
+        sections.append((heading, "".join(lines)))
+
+    merged = []
+    for heading, body in sections:
+        if merged and len(merged[-1][1].strip()) < min_size:
+            merged[-1] = (merged[-1][0] or heading, merged[-1][1] + body)
+        else:
+            merged.append((heading, body))
+    return merged
+
+
+def _split_keep(text: str, sep: str):
+    """以 sep 切開，但把 sep 留在每一段尾端，串回去與原文相同"""
+    parts = text.split(sep)
+    out = [p + sep for p in parts[:-1]]
+    if parts[-1]:
+        out.append(parts[-1])
+    return [p for p in out if p]
+
+
+def _recursive_split(text: str, separators, size: int):
+    if len(text) <= size:
+        return [text]
+    for i, sep in enumerate(separators):
+        if sep == "":
+            return [text[j:j + size] for j in range(0, len(text), size)]
+        if sep in text:
+            out = []
+            for part in _split_keep(text, sep):
+                if len(part) > size:
+                    out.extend(_recursive_split(part, separators[i + 1:], size))
+                else:
+                    out.append(part)
+            return out
+    return [text[j:j + size] for j in range(0, len(text), size)]
+
+
+def _merge(pieces, size: int, overlap: int):
+    """把小片段貪婪地併成 ≤ size 的段落，並保留上一段尾端 ≤ overlap 字作為重疊"""
+    chunks = []
+    current, length = [], 0
+    for piece in pieces:
+        if current and length + len(piece) > size:
+            text = "".join(current).strip()
+            if text:
+                chunks.append(text)
+            while current and (length > overlap or length + len(piece) > size):
+                length -= len(current[0])
+                current.pop(0)
+        current.append(piece)
+        length += len(piece)
+    text = "".join(current).strip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def split_text(text: str, chunk_size: int = None, chunk_overlap: int = None, separators=None):
+    """
+    把文字切成 [Chunk, ...]
+    """
+    chunk_size = chunk_size or _setting("PROJECT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    if chunk_overlap is None:
+        chunk_overlap = _setting("PROJECT_CHUNK_OVERLAP", DEFAULT_CHUNK_OVERLAP)
+    separators = separators or _setting("PROJECT_CHUNK_SEPARATORS", DEFAULT_SEPARATORS)
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap 必須小於 chunk_size")
+
+    text = (text or "").replace("\r\n", "\n").replace("\r", "\n")
+    chunks = []
+    for heading, body in split_sections(text, min_size=chunk_size // 4):
+        pieces = _recursive_split(body, list(separators), chunk_size)
+        for piece in _merge(pieces, chunk_size, chunk_overlap):
+            chunks.append(Chunk(heading=heading, text=piece))
+    return chunks
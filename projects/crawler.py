@@ -0,0 +1,419 @@
+"""
+多頁爬蟲（背景工作 "crawl_site"）
+
+- 起點可以是一般網址或 sitemap.xml（含 sitemap index）
+- 以廣度優先方式跟隨同網域連結，直到 max_depth 層或 max_pages 頁
+- 多執行緒同時抓取；同一主機兩次請求至少間隔 PROJECT_CRAWL_HOST_DELAY 秒，並遵守 robots.txt
+- 頁面以 extraction.html_to_markdown 轉成 Markdown，每累積一批就交給 save_pages：
+  依 source_url 找既有文件，內容雜湊沒變的略過，新頁面建立、有變動的就地更新，
+  需要（重新）向量化的文件以 indexing.index_documents 合併處理
+- 已抓過的頁面帶 If-None-Match / If-Modified-Since 條件式請求，304 時連下載都省掉；
+  但還要往下找連結的頁面（depth < max_depth）一定完整下載，變動與否改由內容雜湊判斷
+
+設定（settings.py，皆可省略）：
+  PROJECT_CRAWL_WORKERS       同時抓取的執行緒數，預設 8
+  PROJECT_CRAWL_HOST_DELAY    同一主機請求間隔（秒），預設 0.5
+  PROJECT_CRAWL_MAX_PAGES     頁數上限的預設值，預設 100
+  PROJECT_CRAWL_MAX_DEPTH     連結深度的預設值，預設 2
+  PROJECT_CRAWL_TIMEOUT       單頁逾時（秒），預設 20
+  PROJECT_CRAWL_BATCH_SIZE    每幾頁寫入並向量化一次，預設 20
+"""
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from urllib.parse import urldefrag, urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .embedding_cache import text_hash
+from .extraction import html_to_markdown
+
+USER_AGENT = 'Mozilla/5.0 (compatible; CSWBot/1.0; +https://example.com/bot)'
+CRAWL_HEADERS = {'User-Agent': USER_AGENT}
+
+DEFAULT_WORKERS = 8
+DEFAULT_HOST_DELAY = 0.5
+DEFAULT_MAX_PAGES = 100
+DEFAULT_MAX_DEPTH = 2
+DEFAULT_TIMEOUT = 20
+DEFAULT_BATCH_SIZE = 20
+MAX_SITEMAPS = 50
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+
+# 明顯不是網頁的連結直接略過
+_SKIP_EXT_RE = re.compile(
+    r"\.(?:jpe?g|png|gif|svg|webp|ico|pdf|zip|gz|rar|7z|exe|dmg|mp[34]|avi|mov|wmv|css|js|json|xml|docx?|xlsx?|pptx?)$",
+    re.I,
+)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def host_key(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def normalize_url(url: str) -> str:
+    url, _ = urldefrag(url.strip())
+    return url
+
+
+def document_filename(url: str) -> str:
+    filename = re.sub(r'[^a-zA-Z0-9._-]+', '_', url)[:200] or 'page'
+    return f"crawl_{filename}.md"
+
+
+class HostRateLimiter:
+    """同一主機的請求至少間隔 delay 秒；不同主機互不影響"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        host = host_key(url)
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def extract_links(html: str, base_url: str):
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for a in soup.find_all('a', href=True):
+        href = a['href'].strip()
+        if not href or href.startswith(('mailto:', 'tel:', 'javascript:')):
+            continue
+        url = normalize_url(urljoin(base_url, href))
+        if urlparse(url).scheme in ('http', 'https') and not _SKIP_EXT_RE.search(urlparse(url).path):
+            links.append(url)
+    return links
+
+
+def parse_sitemap(xml_text: str):
+    """回傳 (網頁網址列表, 子 sitemap 網址列表)"""
+    try:
+        root = ET.fromstring(xml_text.encode('utf-8') if isinstance(xml_text, str) else xml_text)
+    except ET.ParseError:
+        return [], []
+    locs = [el.text.strip() for el in root.iter() if el.tag.endswith('loc') and el.text]
+    if root.tag.endswith('sitemapindex'):
+        return [], locs
+    return locs, []
+
+
+def is_sitemap_url(url: str) -> bool:
+    return urlparse(url).path.lower().endswith('.xml')
+
+
+@dataclass
+class Page:
+    url: str                      # 請求的網址
+    final_url: str                # 轉址後的網址
+    depth: int
+    markdown: str = ""
+    links: list = field(default_factory=list)
+    etag: str = ""
+    last_modified: str = ""
+    not_modified: bool = False    # 條件式請求得到 304
+
+
+class Crawler:
+    """
+    crawl() 逐頁 yield Page；抓取失敗的頁面記在 self.failed
+    seed 可為單一網址、sitemap.xml，或網址列表（重爬既有來源時使用）
+    known：{網址: (etag, last_modified)}，用來送條件式請求
+    """
+
+    def __init__(self, seed, max_depth: int = None, max_pages: int = None, workers: int = None,
+                 host_delay: float = None, respect_robots: bool = True, known: dict = None):
+        seeds = [seed] if isinstance(seed, str) else list(seed)
+        self.seeds = [normalize_url(u) for u in seeds]
+        self.max_depth = _setting("PROJECT_CRAWL_MAX_DEPTH", DEFAULT_MAX_DEPTH) if max_depth is None else max_depth
+        self.max_pages = max_pages or _setting("PROJECT_CRAWL_MAX_PAGES", DEFAULT_MAX_PAGES)
+        self.workers = workers or _setting("PROJECT_CRAWL_WORKERS", DEFAULT_WORKERS)
+        self.timeout = _setting("PROJECT_CRAWL_TIMEOUT", DEFAULT_TIMEOUT)
+        self.limiter = HostRateLimiter(
+            _setting("PROJECT_CRAWL_HOST_DELAY", DEFAULT_HOST_DELAY) if host_delay is None else host_delay
+        )
+        self.respect_robots = respect_robots
+        self.known = known or {}
+        self.allowed_hosts = {host_key(u) for u in self.seeds}
+        self.seen = set()
+        self.failed = []
+        self._robots = {}
+        self._robots_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(CRAWL_HEADERS)
+
+    # ---- 單頁 ----
+    def get(self, url: str, **kwargs):
+        self.limiter.wait(url)
+        return self.session.get(url, timeout=self.timeout, **kwargs)
+
+    def allowed(self, url: str) -> bool:
+        if host_key(url) not in self.allowed_hosts:
+            return False
+        if not self.respect_robots:
+            return True
+        parsed = urlparse(url)
+        root = f"{parsed.scheme}://{parsed.netloc}"
+        with self._robots_lock:
+            parser = self._robots.get(root)
+        if parser is None:
+            parser = RobotFileParser()
+            try:
+                resp = self.get(f"{root}/robots.txt")
+                parser.parse(resp.text.splitlines() if resp.status_code == 200 else [])
+            except requests.RequestException:
+                parser.parse([])
+            with self._robots_lock:
+                self._robots[root] = parser
+        return parser.can_fetch(USER_AGENT, url)
+
+    def fetch(self, url: str, depth: int = 0) -> Page:
+        """
+        抓取單頁；不是 HTML 或失敗則 raise
+        不需要再往下找連結的已知頁面送條件式請求，伺服器回 304 時 Page.not_modified 為 True
+        """
+        headers = {}
+        if depth >= self.max_depth and url in self.known:
+            etag, last_modified = self.known[url]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        resp = self.get(url, headers=headers)
+        if resp.status_code == 304:
+            etag, last_modified = self.known.get(url, ("", ""))
+            return Page(url=url, final_url=url, depth=depth, not_modified=True,
+                        etag=resp.headers.get('ETag', '') or etag,
+                        last_modified=resp.headers.get('Last-Modified', '') or last_modified)
+        resp.raise_for_status()
+        content_type = resp.headers.get('Content-Type', '')
+        if 'html' not in content_type.lower():
+            raise ValueError(f"不是 HTML：{content_type or '未知類型'}")
+        if len(resp.content) > MAX_PAGE_BYTES:
+            raise ValueError("頁面過大")
+        html = resp.text
+        final_url = normalize_url(resp.url)
+        return Page(
+            url=url,
+            final_url=final_url,
+            depth=depth,
+            markdown=html_to_markdown(html),
+            links=extract_links(html, final_url) if depth < self.max_depth else [],
+            etag=resp.headers.get('ETag', ''),
+            last_modified=resp.headers.get('Last-Modified', ''),
+        )
+
+    # ---- 起點 ----
+    def seed_urls(self):
+        pages, pending, visited = [], [], set()
+        for url in self.seeds:
+            if is_sitemap_url(url):
+                pending.append(url)
+            else:
+                pages.append(url)
+        while pending and len(visited) < MAX_SITEMAPS and len(pages) < self.max_pages:
+            sitemap = pending.pop(0)
+            if sitemap in visited:
+                continue
+            visited.add(sitemap)
+            try:
+                resp = self.get(sitemap)
+                resp.raise_for_status()
+            except requests.RequestException as e:
+                self.failed.append((sitemap, str(e)))
+                continue
+            urls, children = parse_sitemap(resp.content)
+            urls = [normalize_url(u) for u in urls]
+            pages.extend(urls)
+            pending.extend(children)
+            # sitemap 列出的網址都視為同一網站
+            self.allowed_hosts.update(host_key(u) for u in urls)
+        return pages
+
+    # ---- 主流程 ----
+    def crawl(self):
+        frontier = []
+        for url in self.seed_urls():
+            if url not in self.seen:
+                self.seen.add(url)
+                frontier.append(url)
+
+        emitted = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="crawler") as pool:
+            depth = 0
+            while frontier and emitted < self.max_pages:
+                batch = [u for u in frontier if self.allowed(u)][:self.max_pages - emitted]
+                futures = {pool.submit(self.fetch, url, depth): url for url in batch}
+                next_frontier = []
+                for fut in as_completed(futures):
+                    url = futures[fut]
+                    try:
+                        page = fut.result()
+                    except Exception as e:
+                        self.failed.append((url, str(e)))
+                        continue
+                    self.seen.add(page.final_url)
+                    if (page.markdown or page.not_modified) and emitted < self.max_pages:
+                        emitted += 1
+                        yield page
+                    for link in page.links:
+                        if link not in self.seen and host_key(link) in self.allowed_hosts:
+                            self.seen.add(link)
+                            next_frontier.append(link)
+                frontier = next_frontier
+                depth += 1
+
+
+def known_sources(project_id: int):
+    """專案中已爬過的網址 → (etag, last_modified)"""
+    from .models import ProjectDocument
+
+    rows = (
+        ProjectDocument.objects
+        .filter(project_id=project_id)
+        .exclude(source_url="")
+        .values_list("source_url", "etag", "last_modified")
+    )
+    return {url: (etag, last_modified) for url, etag, last_modified in rows}
+
+
+def save_pages(project_id: int, pages, user_id: int = None):
+    """
+    把一批 Page 寫入 ProjectDocument（以 source_url 對應既有文件）：
+    - 新網址：建立文件
+    - 304 或內容雜湊相同：只更新 ETag / Last-Modified / 抓取時間，不重新向量化
+    - 內容有變：就地更新內容並重建片段；ETag 與內容雜湊在向量化成功後才寫入
+    回傳 {"created": [doc], "updated": [doc], "unchanged": [doc], "chunks": int}
+    """
+    from .indexing import index_documents
+    from .models import ProjectDocument
+
+    now = timezone.now()
+    urls = {p.url for p in pages} | {p.final_url for p in pages}
+    existing = {}
+    for doc in ProjectDocument.objects.filter(project_id=project_id, source_url__in=urls).order_by("id"):
+        existing.setdefault(doc.source_url, doc)
+
+    created, updated, unchanged = [], [], []
+    validators = []  # 內容有變的文件：[(doc, etag, last_modified, content_hash)]，向量化成功後才寫入
+    for page in pages:
+        doc = existing.get(page.final_url) or existing.get(page.url)
+        if doc is not None and doc.pk is None:
+            continue  # 同一批裡轉址到同一頁
+        content_hash = "" if page.not_modified else text_hash(page.markdown)
+        if doc is None:
+            if page.not_modified:
+                continue
+            doc = ProjectDocument(
+                project_id=project_id,
+                filename=document_filename(page.final_url),
+                imported_by_id=user_id,
+                content=page.markdown,
+                source_url=page.final_url,
+                status=ProjectDocument.STATUS_EMBEDDING,
+            )
+            existing[page.final_url] = doc
+            created.append(doc)
+        elif page.not_modified or content_hash == doc.content_hash:
+            unchanged.append(doc)
+            doc.etag = page.etag[:255]
+            doc.last_modified = page.last_modified[:64]
+            doc.fetched_at = now
+            continue
+        else:
+            doc.content = page.markdown
+            doc.status = ProjectDocument.STATUS_EMBEDDING
+            updated.append(doc)
+        # ETag / 雜湊要等片段與向量寫入後才更新：向量化失敗時下次重爬仍會重新處理這一頁，
+        # 不會因為雜湊相同（或伺服器回 304）而被當成沒變
+        validators.append((doc, page.etag[:255], page.last_modified[:64], content_hash))
+        doc.fetched_at = now
+
+    with transaction.atomic():
+        ProjectDocument.objects.bulk_create(created)
+        ProjectDocument.objects.bulk_update(
+            updated + unchanged,
+            ["content", "status", "etag", "last_modified", "fetched_at"],
+            batch_size=200,
+        )
+    # strict：向量化失敗直接 raise，由工作佇列重試
+    chunks = index_documents(created + updated, strict=True)
+    for doc, etag, last_modified, content_hash in validators:
+        doc.etag, doc.last_modified, doc.content_hash = etag, last_modified, content_hash
+        doc.status = ProjectDocument.STATUS_READY
+    ProjectDocument.objects.bulk_update(
+        [v[0] for v in validators], ["etag", "last_modified", "content_hash", "status"], batch_size=200,
+    )
+    return {"created": created, "updated": updated, "unchanged": unchanged, "chunks": chunks}
+
+
+def run_crawl(project_id: int, seed, max_depth: int = None, max_pages: int = None, user_id: int = None,
+              on_progress=None):
+    """
+    爬取並寫入文件；每處理一頁呼叫 on_progress(progress)，回傳最終的 progress
+    """
+    crawler = Crawler(seed, max_depth=max_depth, max_pages=max_pages, known=known_sources(project_id))
+    batch_size = _setting("PROJECT_CRAWL_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    progress = {
+        "url": seed if isinstance(seed, str) else f"{len(crawler.seeds)} 個來源網址",
+        "max_pages": crawler.max_pages,
+        "pages": 0,
+        "created": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "chunks": 0,
+        "failed": 0,
+        "depth": 0,
+        "documents": [],
+    }
+    pending = []
+
+    def flush():
+        if not pending:
+            return
+        saved = save_pages(project_id, pending, user_id=user_id)
+        for key in ("created", "updated", "unchanged"):
+            progress[key] += len(saved[key])
+        progress["chunks"] += saved["chunks"]
+        changed = saved["created"] + saved["updated"]
+        progress["documents"] = (progress["documents"] + [{"id": d.pk, "filename": d.filename} for d in changed])[-50:]
+        pending.clear()
+
+    for page in crawler.crawl():
+        pending.append(page)
+        progress["pages"] += 1
+        progress["depth"] = page.depth
+        progress["failed"] = len(crawler.failed)
+        if len(pending) >= batch_size:
+            flush()
+        if on_progress is not None:
+            on_progress(progress)
+    flush()
+
+    progress["failed"] = len(crawler.failed)
+    progress["errors"] = [f"{url}：{error}" for url, error in crawler.failed[:20]]
+    return progress
@@ -0,0 +1,230 @@
+"""
+SQLite 並行負載基準測試（manage.py benchmark_db）
+
+在暫存目錄為每種資料庫設定各建一個新的資料庫（migrate 後灌入相同的合成文件），
+同時執行兩種負載，量測吞吐量、延遲與 "database is locked" 錯誤數：
+- 聊天：每個執行緒以 Django test Client 反覆呼叫 project_test_api（經過完整的 middleware、
+  session、回答快取讀寫、檢索、LLM），請求結束時依 CONN_MAX_AGE 關閉或保留連線，與正式環境相同
+- 匯入：每個執行緒反覆把一批新文件切段、向量化後寫入（create_indexed_documents，與批次匯入相同）
+embedding 與 LLM 使用 benchmark.offline_backends 的離線替身；不會碰到 settings 中的正式資料庫與 ANN 索引。
+各設定使用相同的種子資料（專案、片段 id 也相同），開始前清空 process 內的 embedding / 矩陣快取，
+避免後跑的設定沾到前一輪的快取；embedding 合併執行緒（長駐、連線不會隨設定切換）在測試中關閉。
+
+比較的設定（PROFILES）：
+  plain   Django 內建 sqlite3 後端、預設 PRAGMA（rollback journal、synchronous=FULL）、每個請求重新連線
+  tuned   csw.sqlite_backend（WAL、synchronous=NORMAL、page cache、mmap、busy timeout）、
+          transaction_mode IMMEDIATE、CONN_MAX_AGE 600
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.core.management import call_command
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .benchmark import Corpus, latency_stats, offline_backends, use_database
+from .embedding_cache import embedding_cache
+from .vector_cache import matrix_cache
+
+PROFILES = {
+    "plain": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "OPTIONS": {},
+        "CONN_MAX_AGE": 0,
+    },
+    "tuned": {
+        "ENGINE": "csw.sqlite_backend",
+        "OPTIONS": {"transaction_mode": "IMMEDIATE"},
+        "CONN_MAX_AGE": 600,
+    },
+}
+REPORTED_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "busy_timeout")
+
+
+def _pragmas():
+    with connections["default"].cursor() as cursor:
+        values = {}
+        for name in REPORTED_PRAGMAS:
+            cursor.execute(f"PRAGMA {name}")
+            values[name] = cursor.fetchone()[0]
+    return values
+
+
+def _seed(corpus, docs: int, paragraphs: int):
+    from django.contrib.auth import get_user_model
+
+    from .indexing import build_chunks_many, create_indexed_documents
+    from .models import LLMProject, ProjectDocument
+
+    user = get_user_model().objects.create_user(username="benchmark", password=None)
+    project = LLMProject.objects.create(project_code="bench", name="並行負載測試", llm_model="gemini")
+    texts = []
+    for start in range(0, docs, 100):
+        group = [
+            ProjectDocument(project=project, filename=f"seed_{i:06d}.txt", content=corpus.document(paragraphs),
+                            status=ProjectDocument.STATUS_READY)
+            for i in range(start, min(start + 100, docs))
+        ]
+        chunks = [c for doc_chunks in build_chunks_many(group, strict=True) for c in doc_chunks]
+        create_indexed_documents(group, chunks)
+        texts.extend(c.content for c in chunks)
+    return user, project, texts
+
+
+class _Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+        self.errors = []
+        self.items = 0
+
+    def ok(self, seconds, items=1):
+        with self.lock:
+            self.samples.append(seconds)
+            self.items += items
+
+    def error(self, message):
+        with self.lock:
+            self.errors.append(message[:200])
+
+    def summary(self, seconds, unit):
+        locked = sum("locked" in e for e in self.errors)
+        return {
+            "operations": len(self.samples),
+            f"{unit}": self.items,
+            f"{unit}_per_second": round(self.items / seconds, 1) if seconds else None,
+            "errors": len(self.errors),
+            "locked_errors": locked,
+            "error_samples": sorted(set(self.errors))[:5],
+            "latency": latency_stats(self.samples),
+        }
+
+
+def _chat_worker(user, url, questions, offset, start, deadline, recorder):
+    client = Client()
+    client.force_login(user)
+    i = offset
+    start.wait()
+    try:
+        while time.monotonic() < deadline:
+            question = questions[i % len(questions)]
+            i += 1
+            began = time.perf_counter()
+            try:
+                response = client.post(url, {"question": question})
+            except Exception as e:
+                recorder.error(f"{type(e).__name__}: {e}")
+                continue
+            if response.status_code == 200:
+                recorder.ok(time.perf_counter() - began)
+            else:
+                recorder.error(f"HTTP {response.status_code}")
+    finally:
+        connections.close_all()
+
+
+def _import_worker(project_id, corpus, lock, batch, paragraphs, start, deadline, recorder):
+    from .indexing import build_chunks_many, create_indexed_documents
+    from .models import ProjectDocument
+
+    start.wait()
+    n = 0
+    try:
+        while time.monotonic() < deadline:
+            with lock:  # numpy Generator 不是 thread-safe
+                contents = [corpus.document(paragraphs) for _ in range(batch)]
+            name = threading.current_thread().name
+            group = [
+                ProjectDocument(project_id=project_id, filename=f"{name}_{n + j:06d}.txt", content=text,
+                                status=ProjectDocument.STATUS_READY)
+                for j, text in enumerate(contents)
+            ]
+            n += batch
+            began = time.perf_counter()
+            try:
+                chunks = [c for doc_chunks in build_chunks_many(group, strict=True) for c in doc_chunks]
+                create_indexed_documents(group, chunks)
+            except Exception as e:
+                recorder.error(f"{type(e).__name__}: {e}")
+                continue
+            recorder.ok(time.perf_counter() - began, items=len(group))
+    finally:
+        connections.close_all()
+
+
+def run_profile(name: str, directory: str, docs: int = 200, paragraphs: int = 5, seconds: float = 20,
+                chat_workers: int = 8, import_workers: int = 2, import_batch: int = 10, questions: int = 50,
+                seed: int = 0, log=print):
+    """以一種設定執行一輪，回傳結果 dict"""
+    path = os.path.join(directory, f"{name}.sqlite3")
+    embedding_cache.clear_memory()
+    matrix_cache.clear()
+    with use_database(path, PROFILES[name]), override_settings(PROJECT_ANN_DIR=os.path.join(directory, f"{name}-ann")):
+        log(f"[{name}] 建立資料庫 {path}")
+        call_command("migrate", verbosity=0)
+        corpus = Corpus(seed=seed)
+        user, project, texts = _seed(corpus, docs, paragraphs)
+        pool = [corpus.query_from(texts[i]) for i in corpus.rng.choice(len(texts), size=questions)]
+        pragmas = _pragmas()
+        connections["default"].close()
+
+        chat, imports = _Recorder(), _Recorder()
+        start = threading.Barrier(chat_workers + import_workers + 1)
+        deadline = time.monotonic() + seconds + 1  # 含等待所有執行緒就緒的時間
+        url = reverse("project_test_api", args=[project.pk])
+        corpus_lock = threading.Lock()
+        threads = [
+            threading.Thread(target=_chat_worker, name=f"chat-{i}",
+                             args=(user, url, pool, i * 7, start, deadline, chat))
+            for i in range(chat_workers)
+        ] + [
+            threading.Thread(target=_import_worker, name=f"import-{i}",
+                             args=(project.pk, corpus, corpus_lock, import_batch, paragraphs, start, deadline, imports))
+            for i in range(import_workers)
+        ]
+        log(f"[{name}] 執行 {seconds} 秒：聊天 {chat_workers} 執行緒、匯入 {import_workers} 執行緒")
+        for t in threads:
+            t.start()
+        start.wait()
+        began = time.monotonic()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - began
+
+        return {
+            "engine": PROFILES[name]["ENGINE"],
+            "conn_max_age": PROFILES[name]["CONN_MAX_AGE"],
+            "options": PROFILES[name]["OPTIONS"],
+            "pragmas": pragmas,
+            "seconds": round(elapsed, 2),
+            "chat": chat.summary(elapsed, "requests"),
+            "import": imports.summary(elapsed, "documents"),
+        }
+
+
+def run_benchmark(profiles=("plain", "tuned"), keep: bool = False, llm_latency: float = 0.0, dim: int = 256,
+                  seed: int = 0, log=print, **options):
+    """依序執行各設定；回傳 {"meta": ..., "profiles": {name: 結果}}"""
+    directory = tempfile.mkdtemp(prefix="csw-db-benchmark-")
+    result = {
+        "meta": {"directory": directory if keep else None, "dim": dim, "llm_latency_ms": llm_latency * 1000,
+                 "seed": seed, **options},
+        "profiles": {},
+    }
+    try:
+        with offline_backends(dim, llm_latency=llm_latency, seed=seed), override_settings(
+            PROJECT_ANSWER_CACHE_TTL=86400,
+            PROJECT_EMBEDDING_COALESCE_MS=0,
+            ALLOWED_HOSTS=["testserver"],
+        ):
+            for name in profiles:
+                result["profiles"][name] = run_profile(name, directory, seed=seed, log=log, **options)
+    finally:
+        if not keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    return result
@@ -0,0 +1,97 @@
+"""
+內容定址的向量快取
+
+key = (model, task_type, sha256(text))
+- 前端：process 內 LRU（settings.PROJECT_EMBEDDING_CACHE_SIZE 筆，預設 10000）
+- 後端：SQLite 的 EmbeddingCacheEntry 資料表，重啟後仍有效
+
+重存未修改的文件、重爬沒變的網頁、重複的熱門問題都不必再呼叫 API。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_MEMORY_SIZE = 10000
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, memory_size: int = None):
+        self._memory_size = memory_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def memory_size(self) -> int:
+        if self._memory_size is not None:
+            return self._memory_size
+        return getattr(settings, "PROJECT_EMBEDDING_CACHE_SIZE", DEFAULT_MEMORY_SIZE)
+
+    def get_memory(self, key):
+        with self._lock:
+            vec = self._items.get(key)
+            if vec is not None:
+                self._items.move_to_end(key)
+            return vec
+
+    def put_memory(self, key, vec):
+        with self._lock:
+            self._items[key] = vec
+            self._items.move_to_end(key)
+            while len(self._items) > self.memory_size:
+                self._items.popitem(last=False)
+
+    def get_many(self, model: str, task_type: str, hashes):
+        """
+        回傳 {text_hash: vector}，只包含命中的項目；先查記憶體再查 DB
+        """
+        from .models import EmbeddingCacheEntry
+
+        found, missing = {}, []
+        for h in set(hashes):
+            vec = self.get_memory((model, task_type, h))
+            if vec is not None:
+                found[h] = vec
+            else:
+                missing.append(h)
+
+        # SQLite 單一查詢的參數數量有限，分批查
+        for start in range(0, len(missing), 500):
+            rows = (
+                EmbeddingCacheEntry.objects
+                .filter(model=model, task_type=task_type, text_hash__in=missing[start:start + 500])
+            )
+            for row in rows:
+                vec = row.embedding
+                if vec is None:
+                    continue
+                found[row.text_hash] = vec
+                self.put_memory((model, task_type, row.text_hash), vec)
+        return found
+
+    def set_many(self, model: str, task_type: str, items):
+        """
+        items: {text_hash: vector}；已存在的 key 會被略過
+        """
+        from .models import EmbeddingCacheEntry
+
+        entries = []
+        for h, vec in items.items():
+            self.put_memory((model, task_type, h), vec)
+            entry = EmbeddingCacheEntry(model=model, task_type=task_type, text_hash=h)
+            entry.embedding = vec
+            entries.append(entry)
+        if entries:
+            EmbeddingCacheEntry.objects.bulk_create(entries, batch_size=500, ignore_conflicts=True)
+
+    def clear_memory(self):
+        with self._lock:
+            self._items.clear()
+
+
+embedding_cache = EmbeddingCache()
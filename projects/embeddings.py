@@ -0,0 +1,249 @@
+"""
+向量化服務（Google text-embedding-004）
+
+- embed_texts()：一次把多段文字送進 batchEmbedContents，依供應商上限自動分批
+- embed_text()：單筆呼叫；同一時間窗內的多個單筆請求會被合併成一個批次送出
+- genai.configure 由 llm.ensure_configured 統一處理，只執行一次
+- 已算過的文字直接取自 embedding_cache（記憶體 LRU + SQLite），不再呼叫 API
+- aembed_texts() / aembed_text()：給 async view 使用，等待期間不佔用 thread
+
+設定（settings.py，皆可省略）：
+  PROJECT_EMBEDDING_MODEL         預設 "models/text-embedding-004"
+  PROJECT_EMBEDDING_BATCH_SIZE    每個請求最多幾段文字，預設 100（API 上限）
+  PROJECT_EMBEDDING_COALESCE_MS   單筆請求合併等待時間（毫秒），預設 10；0 表示不合併
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import google.generativeai as genai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import metrics
+from .embedding_cache import embedding_cache, text_hash
+from .llm import ensure_configured
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "models/text-embedding-004"
+MAX_BATCH_SIZE = 100  # batchEmbedContents 每次最多 100 筆
+DEFAULT_COALESCE_MS = 10
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def embedding_model() -> str:
+    return _setting("PROJECT_EMBEDDING_MODEL", DEFAULT_MODEL)
+
+
+def _batch_size() -> int:
+    return max(1, min(_setting("PROJECT_EMBEDDING_BATCH_SIZE", MAX_BATCH_SIZE), MAX_BATCH_SIZE))
+
+
+def _embed_remote(texts, task_type: str, model: str):
+    ensure_configured()
+    size = _batch_size()
+    vectors = []
+    for start in range(0, len(texts), size):
+        batch = texts[start:start + size]
+        metrics.EMBEDDING_CALLS.inc(model=model)
+        metrics.EMBEDDING_TEXTS.inc(len(batch), model=model)
+        with metrics.span("embed_api"):
+            res = genai.embed_content(model=model, content=batch, task_type=task_type)
+        embeddings = res["embedding"]
+        if len(embeddings) != len(batch):
+            raise RuntimeError(f"向量數量不符：送出 {len(batch)} 筆，收到 {len(embeddings)} 筆")
+        vectors.extend(np.asarray(e, dtype=np.float32) for e in embeddings)
+    return vectors
+
+
+def embed_texts(texts, task_type: str = "retrieval_document", model: str = None, use_cache: bool = True):
+    """
+    多段文字向量化，回傳與輸入等長的 [np.ndarray(float32), ...]
+    重複的文字只送一次；快取未命中的部分才呼叫 API
+    呼叫失敗會直接 raise，由呼叫端決定如何處理
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    model = model or embedding_model()
+
+    hashes = [text_hash(t) for t in texts]
+    found = embedding_cache.get_many(model, task_type, hashes) if use_cache else {}
+
+    todo = {}
+    for h, t in zip(hashes, texts):
+        if h not in found:
+            todo.setdefault(h, t)
+    if use_cache:
+        metrics.CACHE_REQUESTS.inc(len(texts) - len(todo), cache="embedding", result="hit")
+        metrics.CACHE_REQUESTS.inc(len(todo), cache="embedding", result="miss")
+    if todo:
+        fresh = dict(zip(todo.keys(), _embed_remote(list(todo.values()), task_type, model)))
+        if use_cache:
+            embedding_cache.set_many(model, task_type, fresh)
+        found.update(fresh)
+
+    return [found[h] for h in hashes]
+
+
+class _Coalescer:
+    """
+    把短時間內的單筆請求合併成批次：
+    呼叫端 submit() 取得 Future，背景執行緒等待 window 秒（或湊滿一批）後一起送出
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str, task_type: str, model: str) -> Future:
+        fut = Future()
+        self._queue.put((text, task_type, model, fut))
+        self._ensure_thread()
+        return fut
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-coalescer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            items = [first]
+            window = _setting("PROJECT_EMBEDDING_COALESCE_MS", DEFAULT_COALESCE_MS) / 1000.0
+            deadline = time.monotonic() + window
+            limit = _batch_size()
+            while len(items) < limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._flush(items)
+            except Exception:
+                # 執行緒不能死：否則之後所有 embed_text 都會等到逾時
+                logger.exception("embedding 合併批次發生錯誤")
+                metrics.ERRORS.inc(component="embedding_coalescer")
+
+    def _flush(self, items):
+        # 相同 model + task_type 才能放在同一批；已被呼叫端取消（逾時、斷線）的請求略過
+        groups = {}
+        for text, task_type, model, fut in items:
+            if fut.set_running_or_notify_cancel():
+                groups.setdefault((model, task_type), []).append((text, fut))
+        for (model, task_type), group in groups.items():
+            try:
+                vectors = embed_texts([t for t, _ in group], task_type=task_type, model=model)
+            except Exception as e:
+                for _, fut in group:
+                    _settle(fut, error=e)
+                continue
+            for (_, fut), vec in zip(group, vectors):
+                _settle(fut, result=vec)
+
+
+def _settle(fut: Future, result=None, error=None):
+    """設定 Future 結果；單一 Future 的狀態異常不影響同批的其他請求"""
+    try:
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+    except Exception:
+        pass
+
+
+_coalescer = _Coalescer()
+
+
+def embed_text(text: str, task_type: str = "retrieval_document", model: str = None, timeout: float = 60):
+    """
+    單段文字向量化，回傳 np.ndarray(float32)
+    並行的單筆呼叫會在 PROJECT_EMBEDDING_COALESCE_MS 內合併成一個批次請求
+    """
+    model = model or embedding_model()
+    # 記憶體快取命中就不必進合併佇列等待
+    vec = embedding_cache.get_memory((model, task_type, text_hash(text)))
+    if vec is not None:
+        metrics.CACHE_REQUESTS.inc(cache="embedding", result="hit")
+        return vec
+    if _setting("PROJECT_EMBEDDING_COALESCE_MS", DEFAULT_COALESCE_MS) <= 0:
+        return embed_texts([text], task_type=task_type, model=model)[0]
+    return _coalescer.submit(text, task_type, model).result(timeout=timeout)
+
+
+async def _aembed_remote(texts, task_type: str, model: str):
+    ensure_configured()
+    size = _batch_size()
+    batches = [texts[start:start + size] for start in range(0, len(texts), size)]
+    metrics.EMBEDDING_CALLS.inc(len(batches), model=model)
+    metrics.EMBEDDING_TEXTS.inc(len(texts), model=model)
+    with metrics.span("embed_api"):
+        results = await asyncio.gather(*(
+            genai.embed_content_async(model=model, content=batch, task_type=task_type) for batch in batches
+        ))
+    vectors = []
+    for batch, res in zip(batches, results):
+        embeddings = res["embedding"]
+        if len(embeddings) != len(batch):
+            raise RuntimeError(f"向量數量不符：送出 {len(batch)} 筆，收到 {len(embeddings)} 筆")
+        vectors.extend(np.asarray(e, dtype=np.float32) for e in embeddings)
+    return vectors
+
+
+async def aembed_texts(texts, task_type: str = "retrieval_document", model: str = None):
+    """
+    async 版 embed_texts：快取查詢／寫入在 thread 中執行，API 各批次同時送出
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    model = model or embedding_model()
+
+    hashes = [text_hash(t) for t in texts]
+    found = await sync_to_async(embedding_cache.get_many)(model, task_type, hashes)
+
+    todo = {}
+    for h, t in zip(hashes, texts):
+        if h not in found:
+            todo.setdefault(h, t)
+    metrics.CACHE_REQUESTS.inc(len(texts) - len(todo), cache="embedding", result="hit")
+    metrics.CACHE_REQUESTS.inc(len(todo), cache="embedding", result="miss")
+    if todo:
+        fresh = dict(zip(todo.keys(), await _aembed_remote(list(todo.values()), task_type, model)))
+        await sync_to_async(embedding_cache.set_many)(model, task_type, fresh)
+        found.update(fresh)
+
+    return [found[h] for h in hashes]
+
+
+async def aembed_text(text: str, task_type: str = "retrieval_document", model: str = None, timeout: float = 60):
+    """
+    async 版 embed_text：與同步呼叫共用合併佇列，並行的問題仍會合併成同一批次
+    """
+    model = model or embedding_model()
+    vec = embedding_cache.get_memory((model, task_type, text_hash(text)))
+    if vec is not None:
+        metrics.CACHE_REQUESTS.inc(cache="embedding", result="hit")
+        return vec
+    if _setting("PROJECT_EMBEDDING_COALESCE_MS", DEFAULT_COALESCE_MS) <= 0:
+        return (await aembed_texts([text], task_type=task_type, model=model))[0]
+    fut = asyncio.wrap_future(_coalescer.submit(text, task_type, model))
+    # shield：呼叫端逾時或斷線時只取消這裡的等待，不取消合併佇列中的共用 Future
+    return await asyncio.wait_for(asyncio.shield(fut), timeout)
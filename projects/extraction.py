@@ -0,0 +1,260 @@
+"""
+檔案內容解析：依副檔名抽出文字；網頁 HTML 轉 Markdown
+
+iter_text_segments() 邊讀邊產生文字段落（PDF 每頁、試算表每批列、Word 每組段落），
+呼叫端可以一面解析一面切段、向量化，不必先把整份檔案轉成一個大字串。
+頁數多的 PDF 交給 process pool 平行解析，產生順序仍與頁碼相同。
+
+設定（settings.py，皆可省略）：
+  PROJECT_EXTRACT_PROCESSES       PDF 平行解析的 process 數，預設 min(4, CPU 數)；1 表示不開 process
+  PROJECT_PDF_PARALLEL_MIN_PAGES  超過幾頁才平行解析，預設 16
+  PROJECT_PDF_PAGES_PER_TASK      每個 process 工作負責幾頁，預設 8
+  PROJECT_EXTRACT_ROW_BATCH       試算表 / CSV 每段幾列，預設 500
+  PROJECT_EXTRACT_PARAGRAPH_GROUP Word 每段幾個段落，預設 50
+"""
+import codecs
+import csv
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+
+DEFAULT_PDF_PARALLEL_MIN_PAGES = 16
+DEFAULT_PDF_PAGES_PER_TASK = 8
+DEFAULT_ROW_BATCH = 500
+DEFAULT_PARAGRAPH_GROUP = 50
+TEXT_READ_SIZE = 1024 * 1024
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def html_to_markdown(html):
+    """解析 HTML，抽取主要文字（標題、段落）成簡化的 Markdown"""
+    soup = BeautifulSoup(html, 'html.parser')
+    # 移除 script/style
+    for tag in soup(['script', 'style', 'noscript']):
+        tag.decompose()
+    # 嘗試抓主體
+    main = soup.find('main') or soup.find('article') or soup
+    text_parts = []
+    # 標題
+    if soup.title and soup.title.string:
+        text_parts.append(f"# {soup.title.string.strip()}")
+    # 轉為 Markdown-ish（簡化版）
+    for h in main.find_all(['h1','h2','h3','h4','h5','h6']):
+        prefix = '#' * int(h.name[1])
+        text_parts.append(f"\n{prefix} {h.get_text(strip=True)}\n")
+    # 段落
+    for p in main.find_all('p'):
+        content = p.get_text(" ", strip=True)
+        if content:
+            text_parts.append(content)
+    # 清理多重空白
+    md_text = '\n\n'.join(text_parts)
+    md_text = re.sub(r'\n{3,}', '\n\n', md_text).strip()
+    if not md_text:
+        md_text = soup.get_text("\n", strip=True)
+    return md_text
+
+
+def extract_text_from_file(file_obj, filename):
+    """根據副檔名抽出整份文字（iter_text_segments 的結果以換行串接）。
+    需要的第三方套件：PyPDF2, python-docx, openpyxl（.xls 另需 pandas + xlrd）
+    若缺少套件，會 raise ImportError，請按照錯誤安裝。
+    """
+    return '\n'.join(iter_text_segments(file_obj, filename))
+
+
+def iter_text_segments(file_obj, filename):
+    """依副檔名逐段 yield 文字；段落之間以換行串接即為全文"""
+    ext = os.path.splitext(filename)[1].lower()
+    file_obj.seek(0)
+
+    if ext == '.pdf':
+        yield from _iter_pdf(file_obj)
+    elif ext in ('.docx', '.doc'):
+        yield from _iter_docx(file_obj, ext)
+    elif ext == '.xlsx':
+        yield from _iter_xlsx(file_obj)
+    elif ext == '.xls':
+        yield from _iter_xls(file_obj)
+    elif ext == '.csv':
+        yield from _iter_csv(file_obj)
+    else:
+        # 預設當成純文字
+        yield from _iter_plain(file_obj)
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _row_text(values):
+    return '\t'.join('' if v is None else str(v) for v in values)
+
+
+# ---- PDF ----
+def _pdf_reader_class():
+    try:
+        from PyPDF2 import PdfReader
+    except Exception:
+        raise ImportError('請安裝 PyPDF2 (pip install PyPDF2)')
+    return PdfReader
+
+
+def _pdf_pages_text(path, start, stop):
+    """process pool 的工作：解析 [start, stop) 頁，回傳各頁文字"""
+    reader = _pdf_reader_class()(path)
+    return [(reader.pages[i].extract_text() or '') for i in range(start, stop)]
+
+
+def _pdf_processes():
+    default = min(4, os.cpu_count() or 1)
+    return max(1, _setting('PROJECT_EXTRACT_PROCESSES', default))
+
+
+def _iter_pdf(file_obj):
+    reader = _pdf_reader_class()(file_obj)
+    n = len(reader.pages)
+    processes = _pdf_processes()
+    if processes <= 1 or n < _setting('PROJECT_PDF_PARALLEL_MIN_PAGES', DEFAULT_PDF_PARALLEL_MIN_PAGES):
+        for page in reader.pages:
+            yield page.extract_text() or ''
+        return
+    del reader
+
+    # 子 process 各自開檔解析；上傳檔不一定在本機磁碟上，先複製到暫存檔
+    path = getattr(file_obj, 'name', None)
+    tmp = None
+    if not (isinstance(path, str) and os.path.isfile(path)):
+        file_obj.seek(0)
+        tmp = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+        with tmp:
+            shutil.copyfileobj(file_obj, tmp)
+        path = tmp.name
+    try:
+        step = max(1, _setting('PROJECT_PDF_PAGES_PER_TASK', DEFAULT_PDF_PAGES_PER_TASK))
+        ranges = [(start, min(start + step, n)) for start in range(0, n, step)]
+        # spawn：web / run_jobs process 可能有其他執行緒，fork 容易卡死
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(processes, len(ranges)), mp_context=ctx) as pool:
+            futures = [pool.submit(_pdf_pages_text, path, start, stop) for start, stop in ranges]
+            for future in futures:
+                yield from future.result()
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+
+# ---- Word ----
+def _iter_docx(file_obj, ext):
+    try:
+        import docx
+    except Exception:
+        raise ImportError('請安裝 python-docx (pip install python-docx)')
+    # docx (python-docx) 只支援 .docx
+    if ext != '.docx':
+        # .doc 的處理可用 textract 或 antiword — 這裡不回傳內容並提醒安裝對應工具
+        return
+    doc = docx.Document(file_obj)
+    size = _setting('PROJECT_EXTRACT_PARAGRAPH_GROUP', DEFAULT_PARAGRAPH_GROUP)
+    for group in _batches((p.text for p in doc.paragraphs), size):
+        yield '\n'.join(group)
+
+
+# ---- 試算表 ----
+def _iter_xlsx(file_obj):
+    try:
+        import openpyxl
+    except Exception:
+        raise ImportError('請安裝 openpyxl (pip install openpyxl)')
+    try:
+        # read_only：逐列讀取 XML，不建立整本活頁簿的儲存格物件
+        wb = openpyxl.load_workbook(file_obj, read_only=True, data_only=True)
+    except Exception:
+        file_obj.seek(0)
+        return
+    size = _setting('PROJECT_EXTRACT_ROW_BATCH', DEFAULT_ROW_BATCH)
+    try:
+        for ws in wb.worksheets:
+            yield f'-- Sheet: {ws.title} --'
+            rows = (_row_text(values) for values in ws.iter_rows(values_only=True) if any(v is not None for v in values))
+            for batch in _batches(rows, size):
+                yield '\n'.join(batch)
+    finally:
+        wb.close()
+
+
+def _iter_xls(file_obj):
+    # 舊版 .xls 不是 XML 格式，openpyxl 無法讀取，仍交給 pandas + xlrd
+    try:
+        import pandas as pd
+    except Exception:
+        raise ImportError('請安裝 pandas 與 xlrd (pip install pandas xlrd)')
+    try:
+        xls = pd.read_excel(file_obj, sheet_name=None)
+    except Exception:
+        file_obj.seek(0)
+        return
+    size = _setting('PROJECT_EXTRACT_ROW_BATCH', DEFAULT_ROW_BATCH)
+    for sheet_name, df in xls.items():
+        yield f'-- Sheet: {sheet_name} --'
+        rows = (_row_text(values) for values in df.itertuples(index=False, name=None))
+        for batch in _batches(rows, size):
+            yield '\n'.join(batch)
+
+
+def _text_stream(file_obj):
+    """bytes 檔案包成 UTF-8 文字串流（無法解碼的位元組略過）"""
+    if isinstance(file_obj, io.TextIOBase):
+        return file_obj
+    return io.TextIOWrapper(file_obj, encoding='utf-8', errors='ignore', newline='')
+
+
+def _iter_csv(file_obj):
+    stream = _text_stream(file_obj)
+    size = _setting('PROJECT_EXTRACT_ROW_BATCH', DEFAULT_ROW_BATCH)
+    try:
+        rows = (_row_text(row) for row in csv.reader(stream) if row)
+        for batch in _batches(rows, size):
+            yield '\n'.join(batch)
+    finally:
+        if stream is not file_obj:
+            stream.detach()  # 不要連帶關閉呼叫端的檔案
+
+
+def _iter_plain(file_obj):
+    try:
+        file_obj.seek(0)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        pending = ''
+        while True:
+            raw = file_obj.read(TEXT_READ_SIZE)
+            if not raw:
+                break
+            # file_obj.read() 可能回傳 bytes
+            pending += decoder.decode(raw) if isinstance(raw, bytes) else raw
+            # 在最後一個換行處切開，段落之間以換行串接後與原文相同
+            cut = pending.rfind('\n')
+            if cut >= 0:
+                yield pending[:cut]
+                pending = pending[cut + 1:]
+        pending += decoder.decode(b'', final=True)
+        yield pending
+    except Exception:
+        return
@@ -0,0 +1,262 @@
+"""
+生成圖片的磁碟快取
+
+    image = get_or_generate(prompt, model, params)   # 命中快取直接回傳，否則呼叫 Imagen 後存檔
+    image.url                                         # /project/images/<key>.png（由 project_image 提供下載）
+
+- key：(model, prompt, 實際送出的 parameters) 的 SHA-256；同一組條件只生成一次
+- 檔案：<PROJECT_IMAGE_CACHE_DIR>/<key 前兩碼>/<key>.<副檔名>，先寫暫存檔再 rename，讀取端不會看到半個檔案
+- 淘汰：總大小超過上限時，依最後使用時間（命中時更新 mtime）刪到上限的 90%；
+  總大小由每個 process 自己累計（啟動後第一次寫入時掃描一次目錄），超過上限、
+  或距上次掃描超過 RESCAN_SECONDS（其他 process 也會寫入）時才再掃描整個目錄
+- 同一個 process 內同時要求同一張圖，只送出一次生成請求，其餘等待同一個結果
+
+設定（settings.py，皆可省略）：
+  PROJECT_IMAGE_CACHE_DIR      快取目錄，預設 BASE_DIR / "image_cache"
+  PROJECT_IMAGE_CACHE_MAX_MB   快取總大小上限（MB），預設 1024
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+
+from . import metrics
+from .llm import DEFAULT_IMAGE_MODEL, acall_gemini_image, call_gemini_image, image_params
+
+DEFAULT_MAX_MB = 1024
+# 等待其他執行緒生成同一張圖的上限：讀取逾時 120 秒再加一些餘裕
+DEFAULT_WAIT_SECONDS = 150
+RESCAN_SECONDS = 600
+EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+CONTENT_TYPES = {ext: mime for mime, ext in EXTENSIONS.items()}
+FILENAME_RE = re.compile(r"^([0-9a-f]{64})(\.[a-z]+)$")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def cache_dir() -> Path:
+    return Path(_setting("PROJECT_IMAGE_CACHE_DIR", Path(settings.BASE_DIR) / "image_cache"))
+
+
+def make_key(prompt: str, model: str = None, params: dict = None) -> str:
+    raw = json.dumps(
+        {"model": model or DEFAULT_IMAGE_MODEL, "prompt": prompt, "params": image_params(params)},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CachedImage:
+    key: str
+    path: Path
+    content_type: str
+    cached: bool  # True：取自快取；False：剛生成
+
+    @property
+    def filename(self) -> str:
+        return self.path.name
+
+    @property
+    def size(self) -> int:
+        return self.path.stat().st_size
+
+    @property
+    def url(self) -> str:
+        return reverse("project_image", args=[self.filename])
+
+
+def _path(key: str, ext: str) -> Path:
+    return cache_dir() / key[:2] / f"{key}{ext}"
+
+
+def resolve(filename: str):
+    """URL 中的檔名 → (path, content_type)；格式不符或檔案不存在回傳 None"""
+    m = FILENAME_RE.match(filename or "")
+    if not m or m.group(2) not in CONTENT_TYPES:
+        return None
+    path = _path(m.group(1), m.group(2))
+    if not path.is_file():
+        return None
+    return path, CONTENT_TYPES[m.group(2)]
+
+
+def get(key: str):
+    """命中時回傳 CachedImage（並更新最後使用時間），否則 None"""
+    for ext, mime in CONTENT_TYPES.items():
+        path = _path(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            continue
+        metrics.CACHE_REQUESTS.inc(cache="image", result="hit")
+        return CachedImage(key, path, mime, cached=True)
+    metrics.CACHE_REQUESTS.inc(cache="image", result="miss")
+    return None
+
+
+def put(key: str, data: bytes, content_type: str) -> CachedImage:
+    content_type = (content_type or "image/png").split(";")[0].strip().lower()
+    ext = EXTENSIONS.get(content_type, ".png")
+    path = _path(key, ext)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    _track(len(data))
+    return CachedImage(key, path, CONTENT_TYPES[ext], cached=False)
+
+
+def _max_bytes() -> int:
+    return int(_setting("PROJECT_IMAGE_CACHE_MAX_MB", DEFAULT_MAX_MB) * 1024 * 1024)
+
+
+# 本 process 所知的快取總大小：{"dir": 掃描的目錄, "bytes": 總大小, "scanned_at": 掃描時間}
+_usage = {"dir": None, "bytes": 0, "scanned_at": 0.0}
+_usage_lock = threading.Lock()
+
+
+def _track(size: int):
+    """寫入一張圖後呼叫：累加總大小，超過上限或太久沒掃描才掃描目錄淘汰"""
+    directory = cache_dir()
+    with _usage_lock:
+        fresh = _usage["dir"] == directory and time.monotonic() - _usage["scanned_at"] < RESCAN_SECONDS
+        if fresh:
+            _usage["bytes"] += size
+            if _usage["bytes"] <= _max_bytes():
+                return
+    evict()
+
+
+def evict(max_bytes: int = None) -> int:
+    """總大小超過上限時刪除最久沒用到的圖片，直到上限的 90%；回傳刪除的檔案數"""
+    if max_bytes is None:
+        max_bytes = _max_bytes()
+    directory = cache_dir()
+    scanned_at = time.monotonic()
+    files, total = [], 0
+    for path in directory.glob("*/*"):
+        if not FILENAME_RE.match(path.name):
+            continue
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    removed = 0
+    if total > max_bytes:
+        target = max_bytes * 0.9
+        for _, size, path in sorted(files, key=lambda f: f[0]):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            total -= size
+            removed += 1
+    with _usage_lock:
+        _usage.update(dir=directory, bytes=total, scanned_at=scanned_at)
+    return removed
+
+
+# ---- 生成（同 key 同時只生成一次）----
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _claim(key: str):
+    """回傳 (future, owner)；owner 為 True 表示由呼叫端負責生成並設定結果"""
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is not None:
+            return fut, False
+        fut = _inflight[key] = Future()
+        return fut, True
+
+
+def _release(key: str, fut: Future, result=None, error=None):
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    if fut.done():
+        return
+    try:
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+    except InvalidStateError:
+        # 等待端已取消；圖片已存進快取，生成端照常回傳
+        pass
+
+
+def get_or_generate(prompt: str, model: str = None, params: dict = None, timeout: float = DEFAULT_WAIT_SECONDS) -> CachedImage:
+    """
+    取快取的圖片，沒有時呼叫 call_gemini_image 生成並存檔；失敗會 raise
+    timeout：等待同一張圖由其他執行緒生成的秒數，逾時 raise TimeoutError
+    """
+    model = model or DEFAULT_IMAGE_MODEL
+    key = make_key(prompt, model, params)
+    image = get(key)
+    if image is not None:
+        return image
+    fut, owner = _claim(key)
+    if not owner:
+        image = fut.result(timeout=timeout)
+        return CachedImage(image.key, image.path, image.content_type, cached=True)
+    try:
+        data, content_type = call_gemini_image(prompt, model=model, params=params)
+        image = put(key, data, content_type)
+    except BaseException as e:
+        _release(key, fut, error=e)
+        raise
+    _release(key, fut, result=image)
+    return image
+
+
+async def aget_or_generate(prompt: str, model: str = None, params: dict = None) -> CachedImage:
+    """async 版 get_or_generate"""
+    model = model or DEFAULT_IMAGE_MODEL
+    key = make_key(prompt, model, params)
+    image = await asyncio.to_thread(get, key)
+    if image is not None:
+        return image
+    fut, owner = _claim(key)
+    if not owner:
+        # shield：這個請求被取消時不能連帶取消共用的 Future，否則生成端設定結果時會出錯
+        image = await asyncio.shield(asyncio.wrap_future(fut))
+        return CachedImage(image.key, image.path, image.content_type, cached=True)
+    try:
+        data, content_type = await acall_gemini_image(prompt, model=model, params=params)
+        image = await asyncio.to_thread(put, key, data, content_type)
+    except BaseException as e:
+        _release(key, fut, error=e)
+        raise
+    _release(key, fut, result=image)
+    return image
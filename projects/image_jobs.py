@@ -0,0 +1,90 @@
+"""
+非同步圖片生成：送出提示詞立即拿到工作 id，圖片由背景 worker 生成，前端輪詢或以 SSE 接收結果
+
+    jobs = submit(["海邊日落", "森林小屋"], user_id=request.user.id, params={"aspectRatio": "16:9"})
+    states(user_id, [j.pk for j in jobs])   # [{"id", "prompt", "status", "image_url", "error", ...}]
+
+- 每個提示詞是一個 BackgroundJob（kind="generate_image"），由 `manage.py run_jobs` 執行；
+  失敗時沿用佇列的指數退避重試，多張圖同時生成，整批的等待時間約等於最慢的一張
+- 已在 image_cache 中的圖片直接建立為已完成的工作，不必排隊
+- 同時生成的張數由 PROJECT_JOB_CONCURRENCY["generate_image"] 限制（所有 worker 合計）；
+  可另開專用 worker：manage.py run_jobs --kind generate_image --workers 4
+- 工作只有送出的使用者查得到（payload.user_id）
+
+設定（settings.py，皆可省略）：
+  PROJECT_IMAGE_JOB_MAX_PROMPTS    一次最多送出幾個提示詞，預設 8
+  PROJECT_IMAGE_JOB_MAX_ATTEMPTS   每張圖的嘗試次數上限，預設同 PROJECT_JOB_MAX_ATTEMPTS
+  PROJECT_IMAGE_JOB_POLL_SECONDS   SSE 端點檢查工作狀態的間隔（秒），預設 0.5
+  PROJECT_IMAGE_JOB_STREAM_TIMEOUT SSE 連線最長秒數，預設 300
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import image_cache
+from .jobs import enqueue
+from .llm import DEFAULT_IMAGE_MODEL
+from .models import BackgroundJob
+
+KIND = "generate_image"
+DEFAULT_MAX_PROMPTS = 8
+DEFAULT_POLL_SECONDS = 0.5
+DEFAULT_STREAM_TIMEOUT = 300
+FINISHED = (BackgroundJob.STATUS_DONE, BackgroundJob.STATUS_FAILED)
+
+
+def max_prompts() -> int:
+    return getattr(settings, "PROJECT_IMAGE_JOB_MAX_PROMPTS", DEFAULT_MAX_PROMPTS)
+
+
+def _result(prompt: str, image) -> dict:
+    return {"prompt": prompt, "image_url": image.url, "content_type": image.content_type, "cached": image.cached}
+
+
+def submit(prompts, user_id: int, params: dict = None, model: str = None):
+    """每個提示詞建立一個工作，回傳 BackgroundJob list（順序同 prompts）"""
+    model = model or DEFAULT_IMAGE_MODEL
+    max_attempts = getattr(settings, "PROJECT_IMAGE_JOB_MAX_ATTEMPTS", None)
+    jobs = []
+    with transaction.atomic():
+        for prompt in prompts:
+            payload = {"prompt": prompt, "model": model, "params": params, "user_id": user_id}
+            image = image_cache.get(image_cache.make_key(prompt, model, params))
+            if image is not None:
+                jobs.append(BackgroundJob.objects.create(
+                    kind=KIND, payload=payload, status=BackgroundJob.STATUS_DONE,
+                    max_attempts=0, run_after=timezone.now(), result=_result(prompt, image),
+                ))
+            else:
+                jobs.append(enqueue(KIND, payload, max_attempts=max_attempts))
+    return jobs
+
+
+def run_image_job(payload: dict) -> dict:
+    """worker 端：生成（或取快取）一張圖片，回傳存進 job.result 的內容"""
+    prompt = payload["prompt"]
+    image = image_cache.get_or_generate(prompt, model=payload.get("model"), params=payload.get("params"))
+    return _result(prompt, image)
+
+
+def job_state(job: BackgroundJob) -> dict:
+    result = job.result or {}
+    error = ""
+    if job.status == BackgroundJob.STATUS_FAILED and job.last_error:
+        error = job.last_error.strip().splitlines()[-1][:500]
+    return {
+        "id": job.pk,
+        "prompt": job.payload.get("prompt", ""),
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "image_url": result.get("image_url", ""),
+        "cached": result.get("cached", False),
+        "error": error,
+    }
+
+
+def states(user_id: int, ids):
+    """使用者自己的圖片工作狀態，順序同 ids；查不到（或不屬於此使用者）的 id 略過"""
+    jobs = BackgroundJob.objects.filter(pk__in=ids, kind=KIND, payload__user_id=user_id).in_bulk()
+    return [job_state(jobs[pk]) for pk in ids if pk in jobs]
@@ -0,0 +1,202 @@
+"""
+文件索引：切段 → 批次向量化 → 寫入 DocumentChunk 與 BM25 詞頻（ChunkTerm）
+
+所有匯入路徑（上傳、手動輸入、編輯、爬蟲）存好 ProjectDocument 後呼叫 index_document()。
+上傳檔案則用 index_document_segments()：一面解析一面切段，向量化與後續解析同時進行。
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from . import metrics
+from .ann import add_to_index, remove_from_index
+from .chunking import DEFAULT_CHUNK_SIZE, split_text
+from .embeddings import embed_texts
+from .lexical import build_terms, tokenize
+from .models import ChunkTerm, DocumentChunk, ProjectDocument
+from .vector_cache import invalidate_project
+
+logger = logging.getLogger(__name__)
+
+
+def build_chunks(doc, strict: bool = False):
+    """
+    依 doc.content 產生尚未存檔的 DocumentChunk（含向量）
+    整份文件的片段一次批次送出向量化；失敗時片段仍保留，只是沒有向量
+    strict=True 時向量化失敗直接 raise（背景工作用，交給佇列重試）
+    """
+    return build_chunks_many([doc], strict=strict)[0]
+
+
+def build_chunks_many(docs, strict: bool = False):
+    """
+    build_chunks 的多文件版本：所有文件的片段合併成一次 embed_texts 呼叫
+    回傳與 docs 等長的 [[DocumentChunk, ...], ...]
+    """
+    pieces_per_doc = [split_text(doc.content or "") for doc in docs]
+    texts = [p.full_text for pieces in pieces_per_doc for p in pieces]
+    try:
+        vectors = embed_texts(texts)
+    except Exception as e:
+        if strict:
+            raise
+        logger.warning("向量化失敗：%s", e)
+        metrics.ERRORS.inc(component="indexing")
+        vectors = [None] * len(texts)
+
+    result, offset = [], 0
+    for doc, pieces in zip(docs, pieces_per_doc):
+        chunks = []
+        for i, (piece, vec) in enumerate(zip(pieces, vectors[offset:offset + len(pieces)])):
+            chunk = DocumentChunk(
+                document=doc,
+                project_id=doc.project_id,
+                chunk_index=i,
+                heading=piece.heading[:255],
+                content=piece.text,
+                token_count=len(tokenize(piece.full_text)),
+            )
+            chunk.embedding = vec
+            chunks.append(chunk)
+        offset += len(pieces)
+        result.append(chunks)
+    return result
+
+
+def index_document(doc, strict: bool = False):
+    """
+    重建單一文件的所有片段；回傳片段數
+    向量化在交易外進行，避免長時間鎖住 SQLite
+    """
+    return index_documents([doc], strict=strict)
+
+
+def index_documents(docs, strict: bool = False):
+    """
+    一次重建多份（同專案或不同專案）文件的片段；回傳片段總數
+    向量化合併成批次請求，寫入在同一個交易內完成
+    """
+    docs = list(docs)
+    if not docs:
+        return 0
+    chunks = [c for doc_chunks in build_chunks_many(docs, strict=strict) for c in doc_chunks]
+    _replace_chunks(docs, chunks)
+    return len(chunks)
+
+
+def _replace_chunks(docs, chunks):
+    """在同一個交易內以 chunks 取代 docs 的舊片段，之後更新向量快取與 ANN 索引"""
+    doc_ids = [doc.pk for doc in docs]
+    with transaction.atomic():
+        old = list(DocumentChunk.objects.filter(document_id__in=doc_ids).values_list("project_id", "id"))
+        DocumentChunk.objects.filter(document_id__in=doc_ids).delete()
+        DocumentChunk.objects.bulk_create(chunks, batch_size=500)
+        ChunkTerm.objects.bulk_create(build_terms(chunks), batch_size=1000)
+    _refresh_indexes(docs, old, chunks)
+
+
+def create_indexed_documents(docs, chunks):
+    """
+    docs 為尚未存檔的 ProjectDocument，chunks 為 build_chunks_many 產生的片段（已含向量）
+    文件、片段、詞頻在同一個交易內 bulk_create，之後更新向量快取與 ANN 索引
+    """
+    with transaction.atomic():
+        ProjectDocument.objects.bulk_create(docs, batch_size=500)
+        # 片段建立時文件還沒有 id；bulk_create 會依 chunk.document 補上 document_id
+        DocumentChunk.objects.bulk_create(chunks, batch_size=500)
+        ChunkTerm.objects.bulk_create(build_terms(chunks), batch_size=1000)
+    _refresh_indexes(docs, [], chunks)
+
+
+def _refresh_indexes(docs, old, chunks):
+    """old 為被取代的 [(project_id, chunk_id), ...]"""
+    for project_id in {doc.project_id for doc in docs}:
+        # bulk_create 不會送 post_save，手動清掉向量快取
+        invalidate_project(project_id)
+
+        # ANN 索引增量更新（專案尚無索引時不做事）
+        remove_from_index(project_id, [chunk_id for pid, chunk_id in old if pid == project_id])
+        embedded = [c for c in chunks if c.project_id == project_id and c.embedding_vector is not None]
+        if embedded:
+            add_to_index(project_id, [c.id for c in embedded], [c.embedding for c in embedded])
+
+
+def _embed_pieces(pieces):
+    return embed_texts([p.full_text for p in pieces])
+
+
+def index_document_segments(doc, segments, strict: bool = False, on_extracted=None):
+    """
+    segments 為 extraction.iter_text_segments() 之類的文字段落 iterable（以換行串接即為全文）
+    累積到一定字數就先切段、交給背景執行緒向量化，同時繼續讀取下一批段落
+    全部讀完後呼叫 on_extracted(content)（例如寫回 doc.content、更新狀態），再等向量化完成寫入片段
+    回傳 (content, 片段數)
+
+    每批在段落邊界切開，批與批之間不重疊；批次開頭沒有標題時沿用上一批最後的標題
+    """
+    chunk_size = getattr(settings, "PROJECT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    flush_chars = chunk_size * 20
+
+    parts, buffer, buffered = [], [], 0
+    batches = []  # [(pieces, future), ...]
+    heading = ""
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-embed")
+    try:
+        def flush():
+            nonlocal heading, buffer, buffered
+            pieces = split_text("\n".join(buffer))
+            buffer, buffered = [], 0
+            if not pieces:
+                return
+            for piece in pieces:
+                if piece.heading:
+                    break
+                piece.heading = heading
+            heading = pieces[-1].heading
+            batches.append((pieces, pool.submit(_embed_pieces, pieces)))
+
+        for segment in segments:
+            parts.append(segment)
+            buffer.append(segment)
+            buffered += len(segment)
+            if buffered >= flush_chars:
+                flush()
+        if buffer:
+            flush()
+
+        content = "\n".join(parts)
+        del parts, buffer
+        if on_extracted is not None:
+            on_extracted(content)
+
+        chunks = []
+        for pieces, future in batches:
+            try:
+                vectors = future.result()
+            except Exception as e:
+                if strict:
+                    raise
+                logger.warning("向量化失敗：%s", e)
+                metrics.ERRORS.inc(component="indexing")
+                vectors = [None] * len(pieces)
+            for piece, vec in zip(pieces, vectors):
+                chunk = DocumentChunk(
+                    document=doc,
+                    project_id=doc.project_id,
+                    chunk_index=len(chunks),
+                    heading=piece.heading[:255],
+                    content=piece.text,
+                    token_count=len(tokenize(piece.full_text)),
+                )
+                chunk.embedding = vec
+                chunks.append(chunk)
+    finally:
+        # 向量化執行緒用過的資料庫連線（embedding_cache）在同一條執行緒上關閉
+        pool.submit(connections.close_all)
+        pool.shutdown(wait=True)
+
+    _replace_chunks([doc], chunks)
+    return content, len(chunks)
@@ -0,0 +1,180 @@
+"""
+資料庫佇列（BackgroundJob）
+
+    @register("import_document")
+    def import_document(job): ...
+
+    enqueue("import_document", {"document_id": doc.id})
+
+`manage.py run_jobs` 會不斷取出到期的工作，丟進 thread pool 執行：
+- handler 正常結束 → done（回傳值存進 job.result）
+- handler raise → 依 attempts / max_attempts 以指數退避重試，用完次數才標為 failed，
+  並呼叫註冊時提供的 on_failure(job, exc)
+
+設定（settings.py，皆可省略）：
+  PROJECT_JOB_MAX_ATTEMPTS   預設重試次數上限，預設 3
+  PROJECT_JOB_STALE_SECONDS  running 超過此秒數沒有更新 locked_at（心跳）視為 worker 已中斷，重新排隊，預設 900
+  PROJECT_JOB_HEARTBEAT_SECONDS  執行中每隔幾秒更新一次 locked_at，預設 60（須小於 STALE_SECONDS）
+  PROJECT_JOB_CONCURRENCY    各類型同時執行的上限（所有 worker 合計），例如 {"generate_image": 4}；
+                             未列出的類型只受 worker 的執行緒數限制。上限以 running 筆數判斷，
+                             多個 worker 同時搶工作時可能短暫多出一兩個
+"""
+import datetime
+import logging
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Count
+from django.utils import timezone
+
+from . import metrics
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_STALE_SECONDS = 900
+DEFAULT_HEARTBEAT_SECONDS = 60
+
+_handlers = {}
+
+
+def register(kind: str, on_failure=None):
+    def decorator(func):
+        _handlers[kind] = (func, on_failure)
+        return func
+    return decorator
+
+
+def registered_kinds():
+    return sorted(_handlers)
+
+
+def enqueue(kind: str, payload: dict = None, max_attempts: int = None, delay: float = 0) -> BackgroundJob:
+    if max_attempts is None:
+        max_attempts = getattr(settings, "PROJECT_JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+    return BackgroundJob.objects.create(
+        kind=kind,
+        payload=payload or {},
+        max_attempts=max_attempts,
+        run_after=timezone.now() + datetime.timedelta(seconds=delay),
+    )
+
+
+def heartbeat(job: BackgroundJob):
+    """更新 locked_at，表示 worker 仍在執行（長時間的爬蟲、批次匯入不會被當成中斷而重複執行）"""
+    return (
+        BackgroundJob.objects
+        .filter(pk=job.pk, status=BackgroundJob.STATUS_RUNNING, locked_by=job.locked_by)
+        .update(locked_at=timezone.now())
+    )
+
+
+def _heartbeat_loop(job: BackgroundJob, stop: threading.Event):
+    interval = getattr(settings, "PROJECT_JOB_HEARTBEAT_SECONDS", DEFAULT_HEARTBEAT_SECONDS)
+    try:
+        while not stop.wait(interval):
+            try:
+                heartbeat(job)
+            except Exception:
+                logger.warning("工作 %s 心跳更新失敗", job.pk, exc_info=True)
+                metrics.ERRORS.inc(component="job_heartbeat")
+    finally:
+        connection.close()
+
+
+def requeue_stale():
+    """把太久沒有心跳（worker 被砍掉）的 running 工作放回佇列"""
+    seconds = getattr(settings, "PROJECT_JOB_STALE_SECONDS", DEFAULT_STALE_SECONDS)
+    cutoff = timezone.now() - datetime.timedelta(seconds=seconds)
+    return (
+        BackgroundJob.objects
+        .filter(status=BackgroundJob.STATUS_RUNNING, locked_at__lt=cutoff)
+        .update(status=BackgroundJob.STATUS_QUEUED, locked_at=None, locked_by="")
+    )
+
+
+def _kinds_at_limit():
+    """已達 PROJECT_JOB_CONCURRENCY 上限、暫時不能再取的類型"""
+    limits = getattr(settings, "PROJECT_JOB_CONCURRENCY", None) or {}
+    if not limits:
+        return []
+    running = dict(
+        BackgroundJob.objects
+        .filter(status=BackgroundJob.STATUS_RUNNING, kind__in=list(limits))
+        .values("kind")
+        .annotate(n=Count("id"))
+        .values_list("kind", "n")
+    )
+    return [kind for kind, limit in limits.items() if running.get(kind, 0) >= limit]
+
+
+def claim_next(worker_id: str, kinds=None):
+    """
+    取出一個到期的工作並標為 running；沒有可做的工作回傳 None
+    以「WHERE status='queued'」的條件式 UPDATE 搶鎖，多個 worker 同時跑也不會重複執行
+    """
+    now = timezone.now()
+    qs = BackgroundJob.objects.filter(status=BackgroundJob.STATUS_QUEUED, run_after__lte=now)
+    if kinds:
+        qs = qs.filter(kind__in=kinds)
+    full = _kinds_at_limit()
+    if full:
+        qs = qs.exclude(kind__in=full)
+    for job_id in qs.order_by("run_after", "id").values_list("id", flat=True)[:10]:
+        claimed = (
+            BackgroundJob.objects
+            .filter(id=job_id, status=BackgroundJob.STATUS_QUEUED)
+            .update(status=BackgroundJob.STATUS_RUNNING, locked_at=now, locked_by=worker_id)
+        )
+        if claimed:
+            return BackgroundJob.objects.get(id=job_id)
+    return None
+
+
+def run_job(job: BackgroundJob):
+    """執行單一工作並更新狀態；給 worker thread 呼叫"""
+    try:
+        func, on_failure = _handlers[job.kind]
+    except KeyError:
+        job.status = BackgroundJob.STATUS_FAILED
+        job.last_error = f"未註冊的工作類型：{job.kind}"
+        job.save(update_fields=["status", "last_error", "updated_at"])
+        return
+
+    job.attempts += 1
+    job.save(update_fields=["attempts", "updated_at"])
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat_loop, args=(job, stop), name=f"job-heartbeat-{job.pk}", daemon=True)
+    beat.start()
+    try:
+        result = func(job)
+    except Exception as e:
+        job.last_error = traceback.format_exc()[-4000:]
+        if job.attempts < job.max_attempts:
+            # 指數退避：10s、20s、40s…
+            job.status = BackgroundJob.STATUS_QUEUED
+            job.run_after = timezone.now() + datetime.timedelta(seconds=10 * 2 ** (job.attempts - 1))
+        else:
+            job.status = BackgroundJob.STATUS_FAILED
+            if on_failure is not None:
+                try:
+                    on_failure(job, e)
+                except Exception:
+                    logger.exception("工作 %s（%s）的失敗處理發生錯誤", job.pk, job.kind)
+                    metrics.ERRORS.inc(component="job_failure_hook")
+        job.locked_at = None
+        job.locked_by = ""
+        job.save(update_fields=["status", "run_after", "last_error", "locked_at", "locked_by", "updated_at"])
+    else:
+        job.status = BackgroundJob.STATUS_DONE
+        job.result = result
+        job.locked_at = None
+        job.locked_by = ""
+        job.save(update_fields=["status", "result", "locked_at", "locked_by", "updated_at"])
+    finally:
+        stop.set()
+        beat.join()
+        close_old_connections()
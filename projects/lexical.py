@@ -0,0 +1,109 @@
+"""
+BM25 關鍵字檢索（倒排索引存在 ChunkTerm 資料表）
+
+斷詞方式：
+- 中日韓文字：連續字串切成相鄰兩字（bigram），單一字則保留單字
+- 英數字：整個字（轉小寫），分機號碼、員工編號、英文姓名都能精確命中
+
+index_document() 寫入片段時同步寫入詞頻，因此索引隨匯入即時更新。
+
+設定（settings.py，皆可省略）：
+  PROJECT_BM25_K1 / PROJECT_BM25_B   BM25 參數，預設 1.2 / 0.75
+"""
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Avg, Count
+
+MAX_TERM_LENGTH = 64
+# 出現在超過此比例片段中的詞幾乎沒有鑑別度，查詢時略過（除非只剩它）
+COMMON_TERM_RATIO = 0.6
+
+_TOKEN_RE = re.compile(
+    r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]+"  # CJK / 假名 / 韓文
+    r"|[0-9a-z]+(?:[._\-@][0-9a-z]+)*"  # 英數字（含 email、版本號、a-b 這類）
+)
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+
+
+def tokenize(text: str):
+    terms = []
+    for m in _TOKEN_RE.finditer((text or "").lower()):
+        token = m.group()
+        if _CJK_RE.match(token):
+            if len(token) == 1:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            terms.append(token[:MAX_TERM_LENGTH])
+    return terms
+
+
+def term_frequencies(text: str):
+    """回傳 (Counter{term: tf}, 詞數)"""
+    terms = tokenize(text)
+    return Counter(terms), len(terms)
+
+
+def build_terms(chunks):
+    """
+    已存檔（有 id）的 DocumentChunk → 尚未存檔的 ChunkTerm 列表
+    片段的 token_count 需已在 build_chunks 時算好
+    """
+    from .models import ChunkTerm
+
+    rows = []
+    for chunk in chunks:
+        tf, _ = term_frequencies(chunk.full_text)
+        rows.extend(
+            ChunkTerm(project_id=chunk.project_id, chunk_id=chunk.id, term=term, tf=n)
+            for term, n in tf.items()
+        )
+    return rows
+
+
+def search(project_id: int, query: str, k: int = 10):
+    """
+    BM25 排名，回傳 [(chunk_id, score), ...]
+    """
+    from .models import ChunkTerm, DocumentChunk
+
+    q_terms = Counter(tokenize(query))
+    if not q_terms:
+        return []
+
+    stats = DocumentChunk.objects.filter(project_id=project_id).aggregate(n=Count("id"), avgdl=Avg("token_count"))
+    n_chunks, avgdl = stats["n"], stats["avgdl"] or 1.0
+    if not n_chunks:
+        return []
+
+    df = dict(
+        ChunkTerm.objects
+        .filter(project_id=project_id, term__in=list(q_terms))
+        .values("term")
+        .annotate(df=Count("id"))
+        .values_list("term", "df")
+    )
+    if not df:
+        return []
+    useful = [t for t, d in df.items() if d <= n_chunks * COMMON_TERM_RATIO] or list(df)
+
+    k1 = getattr(settings, "PROJECT_BM25_K1", 1.2)
+    b = getattr(settings, "PROJECT_BM25_B", 0.75)
+    idf = {t: math.log((n_chunks - df[t] + 0.5) / (df[t] + 0.5) + 1.0) for t in useful}
+
+    scores = {}
+    postings = (
+        ChunkTerm.objects
+        .filter(project_id=project_id, term__in=useful)
+        .values_list("chunk_id", "term", "tf", "chunk__token_count")
+    )
+    for chunk_id, term, tf, dl in postings.iterator():
+        norm = tf * (k1 + 1) / (tf + k1 * (1 - b + b * (dl or 0) / avgdl))
+        scores[chunk_id] = scores.get(chunk_id, 0.0) + idf[term] * norm * q_terms[term]
+
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return ranked[:k]
@@ -1,26 +1,122 @@
 # yourapp/llm.py
 import google.generativeai as genai
+import asyncio
+import logging
 import os
+import threading
+import time
+import weakref
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
 import json
 import re
 from typing import Tuple, Optional
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
 
 # Helper: 檢查是否像 base64 字串
 _base64_re = re.compile(r'^[A-Za-z0-9+/=\s]+$')
 
-def call_gemini(role_prompt: str, question: str, context: str = "") -> str:
+DEFAULT_LLM_MODEL = "gemini-1.5-pro"
+DEFAULT_LLM_TIMEOUT = 60
+DEFAULT_IMAGE_TIMEOUT = (5, 120)  # (連線, 讀取) 秒
+DEFAULT_IMAGE_MODEL = "imagen-3.0-generate-002"
+# Imagen predict 的 parameters；呼叫端傳入的 params 覆蓋這些預設值
+DEFAULT_IMAGE_PARAMS = {
+    # sampleCount 或 numberOfImages 依 API 與 model 而異，這裡示範常見參數
+    "sampleCount": 1,
+    "numberOfImages": 1,
+    "aspectRatio": "9:16",
+}
+# call_gemini 失敗時的回覆（呼叫端可據此判斷不要快取）
+FALLBACK_ANSWER = "很抱歉，無法處理您的請求，請稍後再試。"
+
+# ---- process 共用的 client 層 ----
+# genai.configure 只做一次、GenerativeModel 依模型名稱重用、REST 呼叫共用有連線池的 Session
+_lock = threading.Lock()
+_configured = False
+_models = {}
+_session = None
+
+
+def ensure_configured():
+    global _configured
+    if _configured:
+        return
+    with _lock:
+        if not _configured:
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+            _configured = True
+
+
+def resolve_model_name(llm_model: Optional[str] = None) -> str:
     """
-    呼叫 Gemini 模型並取得回答（可選擇傳入 context）
+    LLMProject.llm_model → 實際的 Gemini 模型名稱
+    先查 settings.PROJECT_LLM_MODELS 對照表；本身就是 gemini-* 名稱則直接使用；其餘用預設模型
     """
-    try:
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        model = genai.GenerativeModel('gemini-1.5-pro')
+    mapping = getattr(settings, "PROJECT_LLM_MODELS", {})
+    default = mapping.get("gemini", DEFAULT_LLM_MODEL)
+    if not llm_model:
+        return default
+    if llm_model in mapping:
+        return mapping[llm_model]
+    if llm_model.startswith("gemini-"):
+        return llm_model
+    return default
+
+
+def get_model(model_name: str = None) -> "genai.GenerativeModel":
+    model_name = model_name or resolve_model_name()
+    model = _models.get(model_name)
+    if model is None:
+        ensure_configured()
+        with _lock:
+            model = _models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                _models[model_name] = model
+    return model
+
+
+def http_session() -> requests.Session:
+    """
+    keep-alive + 連線池的 Session；只重試「請求還沒送出」的連線錯誤
+    predict 是計費且不具冪等性的 POST：讀取逾時、429/5xx 不在這裡重試（可能已生成並計費），
+    由呼叫端或工作佇列（generate_image 的 max_attempts）決定是否重來
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                retry = Retry(
+                    total=2,
+                    connect=2,
+                    read=0,
+                    status=0,
+                    other=0,
+                    backoff_factor=0.5,
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def llm_timeout() -> float:
+    return getattr(settings, "PROJECT_LLM_TIMEOUT", DEFAULT_LLM_TIMEOUT)
 
-        # 建 Prompt：明確要求「先用 context，再回答；沒有就說不知道」
-        full_prompt = f"""{role_prompt}
+
+def build_prompt(role_prompt: str, question: str, context: str = "") -> str:
+    # 建 Prompt：明確要求「先用 context，再回答；沒有就說不知道」
+    return f"""{role_prompt}
 
 你會依據「已知資料」回答，並避免臆測。
 
@@ -31,14 +127,60 @@ def call_gemini(role_prompt: str, question: str, context: str = "") -> str:
 {question}
 """
 
-        response = model.generate_content(full_prompt)
-        return response.text
+
+def call_gemini(role_prompt: str, question: str, context: str = "", llm_model: Optional[str] = None) -> str:
+    """
+    呼叫 Gemini 模型並取得回答（可選擇傳入 context）
+    llm_model：LLMProject.llm_model，經 resolve_model_name 對應到實際模型
+    """
+    name = resolve_model_name(llm_model)
+    try:
+        model = get_model(name)
+        full_prompt = build_prompt(role_prompt, question, context)
+        with metrics.span("llm"):
+            response = model.generate_content(full_prompt, request_options={"timeout": llm_timeout()})
+        metrics.record_llm_usage(name, response)
+        text = response.text
 
     except Exception as e:
+        metrics.LLM_CALLS.inc(model=name, result="error")
         print(f"呼叫 Gemini 發生錯誤: {e}")
-        return "很抱歉，無法處理您的請求，請稍後再試。"
+        return FALLBACK_ANSWER
+    metrics.LLM_CALLS.inc(model=name, result="ok")
+    return text
 
 
+def stream_gemini(role_prompt: str, question: str, context: str = "", llm_model: Optional[str] = None):
+    """
+    串流版 call_gemini：逐段 yield 模型產生的文字
+    錯誤直接 raise，由呼叫端（SSE view）轉成 error 事件
+    """
+    name = resolve_model_name(llm_model)
+    model = get_model(name)
+    full_prompt = build_prompt(role_prompt, question, context)
+    started = time.perf_counter()
+    first = True
+    try:
+        response = model.generate_content(full_prompt, stream=True, request_options={"timeout": llm_timeout()})
+        for chunk in response:
+            if first:
+                # 第一段文字的等待時間（使用者感受到的延遲）
+                metrics.record_span("llm_first_token", time.perf_counter() - started)
+                first = False
+            try:
+                text = chunk.text
+            except ValueError:
+                # 被安全過濾或沒有文字內容的片段
+                continue
+            if text:
+                yield text
+    except Exception:
+        metrics.LLM_CALLS.inc(model=name, result="error")
+        raise
+    metrics.record_span("llm", time.perf_counter() - started)
+    metrics.record_llm_usage(name, response)
+    metrics.LLM_CALLS.inc(model=name, result="ok")
+
 
 def _looks_like_base64(s: str) -> bool:
     if not isinstance(s, str):
@@ -80,12 +222,13 @@ def _extract_base64(obj) -> Optional[Tuple[str, Optional[str]]]:
 
 
 
-def call_gemini_image(prompt: str, model: str = "imagen-3.0-generate-002") -> Tuple[bytes, str]:
-    """
-    使用 REST 呼叫 Imagen (Gemini) 產生圖片。
-    回傳 (image_bytes, mime_type)；失敗會 raise Exception。
-    註：model 可改成 "imagen-3.0-fast-generate-001" 或其他你有權限的版本。
-    """
+def image_params(params: Optional[dict] = None) -> dict:
+    """實際送出的 parameters（預設值 + params）；圖片快取也以此為 key 的一部分"""
+    return {**DEFAULT_IMAGE_PARAMS, **(params or {})}
+
+
+def _image_request(prompt: str, model: str, params: Optional[dict] = None):
+    """回傳 Imagen REST 呼叫的 (url, headers, payload)"""
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise RuntimeError("GOOGLE_API_KEY not set in environment")
@@ -104,24 +247,30 @@ def call_gemini_image(prompt: str, model: str = "imagen-3.0-generate-002") -> Tu
                 "prompt": prompt
             }
         ],
-        "parameters": {
-            # sampleCount 或 numberOfImages 依 API 與 model 而異，這裡示範常見參數
-            "sampleCount": 1,
-            "numberOfImages": 1,
-            "aspectRatio": "9:16"
-        }
+        "parameters": image_params(params),
     }
+    return url, headers, payload
 
-    resp = requests.post(url, headers=headers, json=payload, timeout=120)
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError as e:
-        # 加一點除錯資訊
-        raise RuntimeError(f"HTTP error: {e}, body: {resp.text}")
 
-    data = resp.json()
+def _known_image_fields(data) -> Optional[Tuple[str, Optional[str]]]:
+    """已知的回應格式直接取值，不必遞迴掃描整個 JSON（圖片字串動輒數 MB）"""
+    if not isinstance(data, dict):
+        return None
+    # Imagen predict：{"predictions": [{"bytesBase64Encoded": ..., "mimeType": ...}]}
+    for item in data.get("predictions") or ():
+        if isinstance(item, dict) and isinstance(item.get("bytesBase64Encoded"), str):
+            return item["bytesBase64Encoded"], item.get("mimeType")
+    # generateContent：{"candidates": [{"content": {"parts": [{"inlineData": {"data": ..., "mimeType": ...}}]}}]}
+    for candidate in data.get("candidates") or ():
+        for part in ((candidate or {}).get("content") or {}).get("parts") or ():
+            inline = (part or {}).get("inlineData") or (part or {}).get("inline_data")
+            if isinstance(inline, dict) and isinstance(inline.get("data"), str):
+                return inline["data"], inline.get("mimeType") or inline.get("mime_type")
+    return None
+
 
-    found = _extract_base64(data)
+def _image_from_response(data) -> Tuple[bytes, str]:
+    found = _known_image_fields(data) or _extract_base64(data)
     if not found:
         # 如果沒有找到，直接把整個回應存成檔案方便除錯
         raise RuntimeError(f"No image found in response: {json.dumps(data)[:2000]}")
@@ -135,4 +284,86 @@ def call_gemini_image(prompt: str, model: str = "imagen-3.0-generate-002") -> Tu
     # 預設 mime type
     if not mime:
         mime = "image/png"
-    return img_bytes, mime
\ No newline at end of file
+    return img_bytes, mime
+
+
+def call_gemini_image(prompt: str, model: str = DEFAULT_IMAGE_MODEL, params: Optional[dict] = None) -> Tuple[bytes, str]:
+    """
+    使用 REST 呼叫 Imagen (Gemini) 產生圖片。
+    回傳 (image_bytes, mime_type)；失敗會 raise Exception。
+    註：model 可改成 "imagen-3.0-fast-generate-001" 或其他你有權限的版本。
+    params：覆蓋 DEFAULT_IMAGE_PARAMS（例如 {"aspectRatio": "1:1"}）
+    重複的提示詞請改用 image_cache.get_or_generate，不必再等一次生成
+    """
+    url, headers, payload = _image_request(prompt, model, params)
+    timeout = getattr(settings, "PROJECT_IMAGE_TIMEOUT", DEFAULT_IMAGE_TIMEOUT)
+    with metrics.span("image"):
+        resp = http_session().post(url, headers=headers, json=payload, timeout=timeout)
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError as e:
+        metrics.LLM_CALLS.inc(model=model, result="error")
+        # 加一點除錯資訊
+        raise RuntimeError(f"HTTP error: {e}, body: {resp.text}")
+
+    metrics.LLM_CALLS.inc(model=model, result="ok")
+    return _image_from_response(resp.json())
+
+
+# ---- async 版本（ASGI view 使用）----
+# httpx.AsyncClient 綁定 event loop，每個 loop 各自一個（uvicorn 單一 process 只有一個 loop）
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def async_http_client():
+    try:
+        import httpx
+    except ImportError:
+        raise ImportError('請安裝 httpx (pip install httpx)')
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        connect, read = getattr(settings, "PROJECT_IMAGE_TIMEOUT", DEFAULT_IMAGE_TIMEOUT)
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(
+                max_connections=getattr(settings, "PROJECT_ASYNC_HTTP_MAX_CONNECTIONS", 100),
+                max_keepalive_connections=20,
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=2),  # 連線層錯誤重試
+            follow_redirects=True,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def acall_gemini(role_prompt: str, question: str, context: str = "", llm_model: Optional[str] = None) -> str:
+    """async 版 call_gemini：不佔用 worker thread 等待模型回應"""
+    name = resolve_model_name(llm_model)
+    try:
+        model = get_model(name)
+        full_prompt = build_prompt(role_prompt, question, context)
+        with metrics.span("llm"):
+            response = await model.generate_content_async(full_prompt, request_options={"timeout": llm_timeout()})
+        metrics.record_llm_usage(name, response)
+        text = response.text
+
+    except Exception as e:
+        metrics.LLM_CALLS.inc(model=name, result="error")
+        logger.warning("呼叫 Gemini 發生錯誤：%s", e)
+        return FALLBACK_ANSWER
+    metrics.LLM_CALLS.inc(model=name, result="ok")
+    return text
+
+
+async def acall_gemini_image(prompt: str, model: str = DEFAULT_IMAGE_MODEL, params: Optional[dict] = None) -> Tuple[bytes, str]:
+    """async 版 call_gemini_image"""
+    url, headers, payload = _image_request(prompt, model, params)
+    with metrics.span("image"):
+        resp = await async_http_client().post(url, headers=headers, json=payload)
+    if resp.is_error:
+        metrics.LLM_CALLS.inc(model=model, result="error")
+        raise RuntimeError(f"HTTP error: {resp.status_code}, body: {resp.text}")
+    metrics.LLM_CALLS.inc(model=model, result="ok")
+    return _image_from_response(resp.json())
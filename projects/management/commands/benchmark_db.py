@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from projects.benchmark import write_json
+from projects.db_benchmark import PROFILES, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "SQLite 並行負載測試：在暫存資料庫上同時執行聊天（project_test_api）與文件匯入，"
+        "比較內建後端與 csw.sqlite_backend（WAL、連線重用）的吞吐量、延遲與鎖定錯誤；"
+        "不使用 settings 中的正式資料庫"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", action="append", dest="profiles", choices=sorted(PROFILES),
+                            help="要測的設定，可重複指定；預設 plain 與 tuned")
+        parser.add_argument("--seconds", type=float, default=20, help="每種設定的測試秒數，預設 20")
+        parser.add_argument("--chat-workers", type=int, default=8, help="聊天執行緒數，預設 8")
+        parser.add_argument("--import-workers", type=int, default=2, help="匯入執行緒數，預設 2")
+        parser.add_argument("--import-batch", type=int, default=10, help="每次匯入的文件數，預設 10")
+        parser.add_argument("--docs", type=int, default=200, help="種子文件數，預設 200")
+        parser.add_argument("--questions", type=int, default=50, help="不同問題數（重複的問題會命中回答快取），預設 50")
+        parser.add_argument("--dim", type=int, default=256, help="替身 embedding 維度，預設 256")
+        parser.add_argument("--llm-latency-ms", type=float, default=0, help="替身 LLM 的固定延遲（毫秒）")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="結果 JSON 檔路徑；省略時輸出到 stdout")
+        parser.add_argument("--keep", action="store_true", help="保留暫存資料庫")
+
+    def handle(self, *args, **options):
+        result = run_benchmark(
+            profiles=options["profiles"] or ("plain", "tuned"),
+            keep=options["keep"],
+            llm_latency=options["llm_latency_ms"] / 1000,
+            dim=options["dim"],
+            seed=options["seed"],
+            log=lambda msg: self.stderr.write(msg),
+            docs=options["docs"],
+            seconds=options["seconds"],
+            chat_workers=options["chat_workers"],
+            import_workers=options["import_workers"],
+            import_batch=options["import_batch"],
+            questions=options["questions"],
+        )
+
+        for name, r in result["profiles"].items():
+            chat, imports = r["chat"], r["import"]
+            self.stderr.write(
+                f"{name:<6} 聊天 {chat['requests_per_second']} req/s（p50 {chat['latency'].get('p50_ms')} ms，"
+                f"p99 {chat['latency'].get('p99_ms')} ms，錯誤 {chat['errors']}，locked {chat['locked_errors']}）；"
+                f"匯入 {imports['documents_per_second']} 文件/s（錯誤 {imports['errors']}，locked {imports['locked_errors']}）"
+            )
+
+        if options["output"]:
+            write_json(result, options["output"])
+            self.stderr.write(self.style.SUCCESS(f"結果已寫入 {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
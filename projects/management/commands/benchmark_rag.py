@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.benchmark import compare_results, run_benchmark, write_json
+
+
+class Command(BaseCommand):
+    help = (
+        "以離線替身（不呼叫 Gemini）建立合成專案，量測匯入吞吐量、檢索延遲 p50/p99、"
+        "記憶體用量與 ANN 召回率，結果輸出為 JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--docs", type=int, default=200, help="文件數，預設 200")
+        parser.add_argument("--paragraphs", type=int, default=5, help="每份文件的段落（約等於片段）數，預設 5")
+        parser.add_argument("--dim", type=int, default=768, help="向量維度，預設 768")
+        parser.add_argument("--queries", type=int, default=200, help="查詢數，預設 200")
+        parser.add_argument("--top-k", type=int, default=3)
+        parser.add_argument("--nprobe", type=int, help="ANN 掃描群數，預設用 PROJECT_ANN_NPROBE")
+        parser.add_argument("--nlist", type=int, help="ANN 分群數，預設依筆數決定")
+        parser.add_argument("--batch", type=int, default=100, help="每批匯入幾份文件，預設 100")
+        parser.add_argument("--llm-latency-ms", type=float, default=0, help="替身 LLM 的固定延遲（毫秒）")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="結果 JSON 檔路徑；省略時輸出到 stdout")
+        parser.add_argument("--compare", help="與先前的結果 JSON 比較")
+        parser.add_argument("--keep", action="store_true", help="保留暫存目錄（資料庫與 ANN 索引，預設結束後刪除）")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"], encoding="utf-8") as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"無法讀取 {options['compare']}：{e}")
+
+        result = run_benchmark(
+            docs=options["docs"],
+            paragraphs=options["paragraphs"],
+            dim=options["dim"],
+            queries=options["queries"],
+            top_k=options["top_k"],
+            nprobe=options["nprobe"],
+            nlist=options["nlist"],
+            batch=options["batch"],
+            llm_latency=options["llm_latency_ms"] / 1000,
+            seed=options["seed"],
+            keep=options["keep"],
+            log=lambda msg: self.stderr.write(msg),
+        )
+
+        if options["output"]:
+            write_json(result, options["output"])
+            self.stderr.write(self.style.SUCCESS(f"結果已寫入 {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+
+        if baseline is not None:
+            self.stderr.write(f"與 {options['compare']} 比較：")
+            for name, old, new, change, better in compare_results(baseline, result):
+                change_text = "—" if change is None else f"{change:+.1f}%"
+                line = f"  {name:<32} {old:>10} → {new:<10} {change_text}"
+                if better is None or abs(change) < 5:
+                    self.stderr.write(line)
+                else:
+                    self.stderr.write(self.style.SUCCESS(line) if better else self.style.WARNING(line))
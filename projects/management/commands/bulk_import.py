@@ -0,0 +1,54 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.bulk_import import is_archive, run_bulk_import
+from projects.models import LLMProject
+
+
+class Command(BaseCommand):
+    help = "批次匯入伺服器上的檔案、ZIP 壓縮檔或資料夾到專案（解析並行、內容去重、批次向量化），結束後輸出摘要"
+
+    def add_arguments(self, parser):
+        parser.add_argument("project", type=int, help="專案 id")
+        parser.add_argument("paths", nargs="+", help="檔案、ZIP 或資料夾路徑")
+        parser.add_argument("--user", type=int, help="記錄為匯入人的使用者 id")
+
+    def handle(self, *args, **options):
+        if not LLMProject.objects.filter(pk=options["project"]).exists():
+            raise CommandError(f"找不到專案 {options['project']}")
+
+        files, archives, directories = [], [], []
+        for path in options["paths"]:
+            if os.path.isdir(path):
+                directories.append(path)
+            elif os.path.isfile(path):
+                item = {"name": os.path.basename(path), "path": os.path.abspath(path)}
+                (archives if is_archive(path) else files).append(item)
+            else:
+                raise CommandError(f"找不到 {path}")
+
+        def on_progress(progress):
+            self.stdout.write(f"\r解析 {progress['extracted']}/{progress['files']}，向量化 {progress['embedded']}", ending="")
+
+        # 多個資料夾逐一匯入；去重仍會比對先前已寫入的文件
+        runs = [(files, archives, None)] + [((), (), d) for d in directories]
+        for run_files, run_archives, directory in runs:
+            if not (run_files or run_archives or directory):
+                continue
+            report = run_bulk_import(
+                options["project"], files=run_files, archives=run_archives, directory=directory,
+                user_id=options["user"], on_progress=on_progress,
+            )
+            self.stdout.write("")
+            self.stdout.write(self.style.SUCCESS(
+                f"{directory or '檔案'}：{report['files']} 個檔案，新增 {report['created']} 份（{report['chunks']} 個片段），"
+                f"重複 {len(report['duplicates'])}、略過 {len(report['skipped'])}、失敗 {len(report['failed'])}，"
+                f"耗時 {report['seconds']} 秒"
+            ))
+            for d in report["duplicates"]:
+                self.stdout.write(f"  重複：{d['name']}（同 {d['duplicate_of']}）")
+            for d in report["skipped"]:
+                self.stdout.write(f"  略過：{d['name']}（{d['reason']}）")
+            for d in report["failed"]:
+                self.stdout.write(self.style.WARNING(f"  失敗：{d['name']}：{d['error']}"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.bundle import export_stream
+from projects.models import LLMProject
+
+
+class Command(BaseCommand):
+    help = "將專案（設定、文件、片段、向量）匯出成專案包 ZIP"
+
+    def add_arguments(self, parser):
+        parser.add_argument("project", type=int, help="專案 id")
+        parser.add_argument("output", help="輸出的 ZIP 路徑")
+
+    def handle(self, *args, **options):
+        try:
+            project = LLMProject.objects.get(pk=options["project"])
+        except LLMProject.DoesNotExist:
+            raise CommandError(f"找不到專案 {options['project']}")
+
+        size = 0
+        with open(options["output"], "wb") as f:
+            for data in export_stream(project):
+                f.write(data)
+                size += len(data)
+        self.stdout.write(self.style.SUCCESS(f"已匯出 {options['output']}（{size / 1024 / 1024:.1f} MB）"))
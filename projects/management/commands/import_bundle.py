@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.bundle import BundleError, import_bundle
+
+
+class Command(BaseCommand):
+    help = "從專案包 ZIP 建立新專案；片段向量直接沿用，不重新呼叫向量化 API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="專案包 ZIP 路徑")
+        parser.add_argument("--project-code", help="新的專案代碼；省略則沿用專案包內的代碼")
+        parser.add_argument("--name", help="新的專案名稱")
+        parser.add_argument(
+            "--allow-model-mismatch", action="store_true",
+            help="專案包的向量模型與目前設定不同時仍然匯入",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], "rb") as f:
+                project, counts = import_bundle(
+                    f,
+                    project_code=options["project_code"],
+                    name=options["name"],
+                    allow_model_mismatch=options["allow_model_mismatch"],
+                )
+        except (OSError, BundleError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"已建立專案 {project.pk}（{project.project_code}）："
+            f"文件 {counts['documents']}、片段 {counts['chunks']}、向量 {counts['vectors']}"
+        ))
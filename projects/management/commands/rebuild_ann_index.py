@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from projects.ann import build_index
+from projects.models import LLMProject
+
+
+class Command(BaseCommand):
+    help = "重建專案的 ANN 向量索引（存於 settings.PROJECT_ANN_DIR）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project", type=int, action="append", dest="projects", help="專案 id，可重複指定；省略則全部重建")
+        parser.add_argument("--nlist", type=int, help="分群數，預設 √片段數")
+
+    def handle(self, *args, **options):
+        ids = options["projects"] or list(LLMProject.objects.order_by("id").values_list("id", flat=True))
+        for project_id in ids:
+            index = build_index(project_id, nlist=options["nlist"])
+            if index is None:
+                self.stdout.write(f"專案 {project_id}：沒有向量，略過")
+            else:
+                self.stdout.write(f"專案 {project_id}：{len(index.ids)} 筆，{index.nlist} 群")
+        self.stdout.write(self.style.SUCCESS("完成"))
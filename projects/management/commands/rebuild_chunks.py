@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from projects.indexing import index_document
+from projects.models import ProjectDocument
+
+
+class Command(BaseCommand):
+    help = "重新切段並向量化文件（舊資料補建 DocumentChunk，或調整切段設定後重建）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project", type=int, help="只處理此專案 id")
+        parser.add_argument("--missing-only", action="store_true", help="只處理尚未有任何片段的文件")
+
+    def handle(self, *args, **options):
+        qs = ProjectDocument.objects.order_by("id")
+        if options["project"]:
+            qs = qs.filter(project_id=options["project"])
+        if options["missing_only"]:
+            qs = qs.filter(chunks__isnull=True)
+
+        total_docs = total_chunks = 0
+        for doc in qs.iterator():
+            n = index_document(doc)
+            total_docs += 1
+            total_chunks += n
+            self.stdout.write(f"#{doc.id} {doc.filename}: {n} 段")
+
+        self.stdout.write(self.style.SUCCESS(f"完成：{total_docs} 份文件，共 {total_chunks} 段"))
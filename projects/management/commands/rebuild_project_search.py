@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projects import project_search
+from projects.models import LLMProject
+
+
+class Command(BaseCommand):
+    help = "重建專案搜尋的全文索引（SQLite FTS5）"
+
+    def handle(self, *args, **options):
+        if not project_search.fts_available():
+            raise CommandError("資料庫沒有全文索引資料表（非 SQLite 或未編入 FTS5），搜尋使用 icontains，不需重建")
+        n = project_search.rebuild(LLMProject.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"完成：{n} 個專案"))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.crawler import known_sources, run_crawl
+from projects.models import LLMProject
+
+
+class Command(BaseCommand):
+    help = "重新抓取專案中所有爬蟲文件的來源網址；未變動的頁面不重新下載或向量化（可排入 cron 定期執行）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project", type=int, action="append", help="專案 id，可重複指定；省略則處理所有有爬蟲文件的專案")
+
+    def handle(self, *args, **options):
+        project_ids = options["project"] or list(
+            LLMProject.objects.filter(documents__source_url__gt="").distinct().values_list("id", flat=True)
+        )
+        if not project_ids:
+            raise CommandError("沒有可重新抓取的專案")
+
+        for project_id in project_ids:
+            urls = sorted(known_sources(project_id))
+            if not urls:
+                self.stdout.write(f"專案 {project_id}：沒有爬蟲來源，略過")
+                continue
+            # 只刷新既有來源，不往下跟隨連結（新頁面請從爬蟲頁面重新送出起點網址）
+            progress = run_crawl(project_id, urls, max_depth=0, max_pages=len(urls))
+            self.stdout.write(
+                f"專案 {project_id}：{len(urls)} 個來源，"
+                f"更新 {progress['updated']}、未變動 {progress['unchanged']}、"
+                f"新增 {progress['created']}、失敗 {progress['failed']}，重建 {progress['chunks']} 段"
+            )
+            for error in progress["errors"]:
+                self.stdout.write(self.style.WARNING(f"  {error}"))
+
+        self.stdout.write(self.style.SUCCESS("完成"))
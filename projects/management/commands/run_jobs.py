@@ -0,0 +1,62 @@
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from projects.jobs import claim_next, registered_kinds, requeue_stale, run_job
+
+
+class Command(BaseCommand):
+    help = "背景工作 worker：取出 BackgroundJob（文件解析、切段、向量化…）並以 thread pool 執行"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=getattr(settings, "PROJECT_JOB_WORKERS", 2),
+            help="同時執行的工作數（預設 settings.PROJECT_JOB_WORKERS）",
+        )
+        parser.add_argument("--poll", type=float, default=1.0, help="佇列空時的輪詢間隔（秒）")
+        parser.add_argument("--kind", action="append", dest="kinds", help="只處理指定類型，可重複指定")
+        parser.add_argument("--once", action="store_true", help="處理完目前佇列中的工作就結束")
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"])
+        kinds = options["kinds"]
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(
+            f"worker {worker_id} 啟動：{workers} 個執行緒，處理 {', '.join(kinds or registered_kinds())}"
+        )
+
+        running = set()
+        last_requeue = 0.0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job") as pool:
+            try:
+                while True:
+                    if time.monotonic() - last_requeue > 60:
+                        requeue_stale()
+                        last_requeue = time.monotonic()
+
+                    claimed_any = False
+                    while len(running) < workers:
+                        job = claim_next(worker_id, kinds)
+                        if job is None:
+                            break
+                        claimed_any = True
+                        self.stdout.write(f"執行 {job}")
+                        running.add(pool.submit(run_job, job))
+
+                    if options["once"] and not running and not claimed_any:
+                        break
+                    if running:
+                        done, running = wait(running, timeout=options["poll"], return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            if fut.exception() is not None:
+                                self.stderr.write(f"工作執行錯誤：{fut.exception()}")
+                    else:
+                        time.sleep(options["poll"])
+            except KeyboardInterrupt:
+                self.stdout.write("收到中斷，等待執行中的工作結束…")
+
+        self.stdout.write(self.style.SUCCESS("worker 結束"))
@@ -0,0 +1,240 @@
+"""
+計時與指標：各階段 span、計數器、直方圖
+
+    with metrics.span("embed"):
+        q_vec = embed_text(question)
+
+    metrics.CACHE_REQUESTS.inc(cache="answer", result="hit")
+
+- span：記錄到 csw_stage_seconds 直方圖；在請求中（MetricsMiddleware）同時記進該請求的
+  耗時清單，回應時輸出成 Server-Timing header（瀏覽器開發者工具 Network → Timing 可看到）
+- 請求內的耗時清單以 contextvars 傳遞，sync_to_async / async view 中一樣有效；
+  自行開的 thread（例如 embedding 合併執行緒）不屬於任何請求，只記進直方圖
+- 指標存在各 process 的記憶體中；多 worker 部署時每個 worker 各自累計
+- 記錄後略過的錯誤（例如向量化失敗改存沒有向量的片段）寫進 logging，並記入 csw_errors_total{component}
+- render_prometheus() 輸出 Prometheus text format（/project/metrics，限 staff）
+
+設定（settings.py，皆可省略）：
+  PROJECT_SERVER_TIMING   是否輸出 Server-Timing header，預設 True
+  PROJECT_METRICS_TOKEN   Prometheus 抓取用的 Bearer token；未設定時只有 staff 登入可看
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_items(items))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _render_items(self, items):
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各 bucket 的（非累計）次數..., 總和, 次數]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self, **labels):
+        """(總和, 次數)；沒有資料時為 (0.0, 0)"""
+        state = self._values.get(self._key(labels))
+        return (state[-2], state[-1]) if state else (0.0, 0)
+
+    def _render_items(self, items):
+        for key, state in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, state):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, [("le", _format_number(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            yield f"{self.name}_bucket{labels} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(state[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # 模組重新載入時沿用既有的指標
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+
+registry = Registry()
+
+
+def counter(name: str, help_text: str, labelnames=()) -> Counter:
+    return registry.register(Counter(name, help_text, labelnames))
+
+
+def histogram(name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def render_prometheus() -> str:
+    return registry.render()
+
+
+# ---- 本專案的指標 ----
+STAGE_SECONDS = histogram("csw_stage_seconds", "各處理階段耗時（秒）", ["stage"])
+VIEW_SECONDS = histogram("csw_view_seconds", "view 回應時間（秒，串流回應只計到開始送出）", ["view", "method", "status"])
+CACHE_REQUESTS = counter("csw_cache_requests_total", "快取查詢次數（embedding 以文字段數計）", ["cache", "result"])
+EMBEDDING_CALLS = counter("csw_embedding_calls_total", "embedding API 請求數", ["model"])
+EMBEDDING_TEXTS = counter("csw_embedding_texts_total", "送進 embedding API 的文字段數", ["model"])
+LLM_CALLS = counter("csw_llm_calls_total", "LLM 呼叫次數", ["model", "result"])
+LLM_TOKENS = counter("csw_llm_tokens_total", "LLM token 用量（prompt / completion）", ["model", "kind"])
+ERRORS = counter("csw_errors_total", "已記錄並略過的錯誤次數（詳細內容見 log）", ["component"])
+
+
+# ---- 請求內的 span ----
+_request_timings = contextvars.ContextVar("csw_request_timings", default=None)
+
+
+def begin_request():
+    """開始收集本請求的 span；回傳 (timings, token)，結束時以 token 呼叫 end_request"""
+    timings = []
+    return timings, _request_timings.set(timings)
+
+
+def end_request(token):
+    _request_timings.reset(token)
+
+
+def record_span(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def span(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+async def timed(name: str, awaitable):
+    """await 並記錄耗時；給 asyncio.gather 中的個別工作使用"""
+    with span(name):
+        return await awaitable
+
+
+def server_timing(timings, total: float = None) -> str:
+    """[(name, 秒), ...] → Server-Timing header；同名 span 合併加總，依首次出現順序"""
+    merged = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in merged.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def record_llm_usage(model: str, response):
+    """由 Gemini 回應的 usage_metadata 累計 token 數（串流回應需在讀完後呼叫）"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    completion = getattr(usage, "candidates_token_count", 0) or 0
+    if prompt:
+        LLM_TOKENS.inc(prompt, model=model, kind="prompt")
+    if completion:
+        LLM_TOKENS.inc(completion, model=model, kind="completion")
@@ -0,0 +1,57 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+# method 標籤只用固定的值，避免任意的 request method 造成無限多個時間序列
+KNOWN_METHODS = frozenset({"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"})
+
+
+class MetricsMiddleware:
+    """
+    記錄每個 view 的回應時間（csw_view_seconds），並把請求中的 span 輸出成 Server-Timing header
+    WSGI / ASGI 皆可使用；view 標籤為 URL name，沒有對應路由的請求記為 "unmatched"
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings, token = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings, token = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, timings, started)
+
+    def _finish(self, request, response, timings, started):
+        total = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        metrics.VIEW_SECONDS.observe(
+            total,
+            view=(match.view_name if match else "") or "unmatched",
+            method=request.method if request.method in KNOWN_METHODS else "other",
+            status=f"{response.status_code // 100}xx",
+        )
+        if getattr(settings, "PROJECT_SERVER_TIMING", True):
+            response["Server-Timing"] = metrics.server_timing(timings, total)
+        return response
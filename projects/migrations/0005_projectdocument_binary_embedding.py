@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+from django.db import migrations, models
+
+# 與 projects.vectors 當時的格式相同（little-endian float32 原始 bytes）；
+# migration 不引用執行期模組，之後修改 vectors.py 不會影響這裡
+_FLOAT32 = np.dtype('float32').newbyteorder('<')
+
+
+def pack_vector(vec):
+    arr = np.asarray(vec)
+    if arr.ndim != 1:
+        raise ValueError(f"向量必須是一維，收到 shape={arr.shape}")
+    return arr.astype(_FLOAT32, copy=False).tobytes(), int(arr.shape[0]), 'float32'
+
+
+def unpack_vector(data, dtype):
+    return np.frombuffer(data, dtype=np.dtype(dtype or 'float32').newbyteorder('<'))
+
+
+def json_to_binary(apps, schema_editor):
+    ProjectDocument = apps.get_model('projects', 'ProjectDocument')
+    batch = []
+    for doc in ProjectDocument.objects.exclude(embedding__isnull=True).only('id', 'embedding').iterator():
+        emb = doc.embedding
+        if isinstance(emb, str):
+            try:
+                emb = json.loads(emb)
+            except ValueError:
+                continue
+        if not isinstance(emb, list) or not emb:
+            continue
+        try:
+            doc.embedding_vector, doc.embedding_dim, doc.embedding_dtype = pack_vector(emb)
+        except (TypeError, ValueError):
+            continue
+        batch.append(doc)
+        if len(batch) >= 500:
+            ProjectDocument.objects.bulk_update(batch, ['embedding_vector', 'embedding_dim', 'embedding_dtype'])
+            batch = []
+    if batch:
+        ProjectDocument.objects.bulk_update(batch, ['embedding_vector', 'embedding_dim', 'embedding_dtype'])
+
+
+def binary_to_json(apps, schema_editor):
+    ProjectDocument = apps.get_model('projects', 'ProjectDocument')
+    batch = []
+    for doc in ProjectDocument.objects.exclude(embedding_vector__isnull=True).iterator():
+        vec = unpack_vector(doc.embedding_vector, doc.embedding_dtype)
+        doc.embedding = vec.astype(float).tolist()
+        batch.append(doc)
+        if len(batch) >= 500:
+            ProjectDocument.objects.bulk_update(batch, ['embedding'])
+            batch = []
+    if batch:
+        ProjectDocument.objects.bulk_update(batch, ['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0004_projectdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectdocument',
+            name='embedding_vector',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='projectdocument',
+            name='embedding_dim',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='projectdocument',
+            name='embedding_dtype',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='projectdocument',
+            name='embedding',
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_projectdocument_binary_embedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding_vector', models.BinaryField(blank=True, null=True)),
+                ('embedding_dim', models.PositiveIntegerField(blank=True, null=True)),
+                ('embedding_dtype', models.CharField(blank=True, default='', max_length=16)),
+                ('chunk_index', models.PositiveIntegerField(verbose_name='段落序號')),
+                ('heading', models.CharField(blank=True, default='', max_length=255, verbose_name='所屬標題')),
+                ('content', models.TextField(verbose_name='內容')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='projects.projectdocument')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='projects.llmproject')),
+            ],
+            options={
+                'ordering': ['document_id', 'chunk_index'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'chunk_index'), name='uniq_document_chunk_index')],
+            },
+        ),
+    ]
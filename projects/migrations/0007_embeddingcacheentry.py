@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0006_documentchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding_vector', models.BinaryField(blank=True, null=True)),
+                ('embedding_dim', models.PositiveIntegerField(blank=True, null=True)),
+                ('embedding_dtype', models.CharField(blank=True, default='', max_length=16)),
+                ('model', models.CharField(max_length=100)),
+                ('task_type', models.CharField(blank=True, default='', max_length=50)),
+                ('text_hash', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model', 'task_type', 'text_hash'), name='uniq_embedding_cache_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0007_embeddingcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectdocument',
+            name='status',
+            field=models.CharField(choices=[('pending', '排隊中'), ('extracting', '解析中'), ('embedding', '向量化中'), ('ready', '完成'), ('failed', '失敗')], default='ready', max_length=16, verbose_name='處理狀態'),
+        ),
+        migrations.AddField(
+            model_name='projectdocument',
+            name='status_message',
+            field=models.TextField(blank=True, default='', verbose_name='狀態訊息'),
+        ),
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', '排隊中'), ('running', '執行中'), ('done', '完成'), ('failed', '失敗')], default='queued', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('run_after', models.DateTimeField()),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('locked_by', models.CharField(blank=True, default='', max_length=100)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='projects_job_status_run_idx')],
+            },
+        ),
+    ]
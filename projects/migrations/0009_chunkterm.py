@@ -0,0 +1,77 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:23
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# 建立當時的 lexical.tokenize / chunking.with_heading；migration 不引用執行期模組，
+# 之後斷詞方式改變時，舊資料請以 manage.py rebuild_chunks 重建
+MAX_TERM_LENGTH = 64
+_TOKEN_RE = re.compile(
+    r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]+"
+    r"|[0-9a-z]+(?:[._\-@][0-9a-z]+)*"
+)
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+
+
+def with_heading(heading, text):
+    if heading and not text.startswith(heading):
+        return f"{heading}\n{text}"
+    return text
+
+
+def term_frequencies(text):
+    terms = []
+    for m in _TOKEN_RE.finditer((text or "").lower()):
+        token = m.group()
+        if _CJK_RE.match(token):
+            if len(token) == 1:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            terms.append(token[:MAX_TERM_LENGTH])
+    return Counter(terms), len(terms)
+
+
+def index_existing_chunks(apps, schema_editor):
+    DocumentChunk = apps.get_model('projects', 'DocumentChunk')
+    ChunkTerm = apps.get_model('projects', 'ChunkTerm')
+    for chunk in DocumentChunk.objects.only('id', 'project_id', 'heading', 'content').iterator():
+        tf, count = term_frequencies(with_heading(chunk.heading, chunk.content))
+        DocumentChunk.objects.filter(pk=chunk.pk).update(token_count=count)
+        ChunkTerm.objects.bulk_create(
+            [ChunkTerm(project_id=chunk.project_id, chunk_id=chunk.id, term=t, tf=n) for t, n in tf.items()],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0008_backgroundjob_document_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='token_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='詞數'),
+        ),
+        migrations.CreateModel(
+            name='ChunkTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('tf', models.PositiveIntegerField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='projects.documentchunk')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='projects.llmproject')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['project', 'term'], name='projects_chunkterm_lookup')],
+            },
+        ),
+        migrations.RunPython(index_existing_chunks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_chunkterm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding_vector', models.BinaryField(blank=True, null=True)),
+                ('embedding_dim', models.PositiveIntegerField(blank=True, null=True)),
+                ('embedding_dtype', models.CharField(blank=True, default='', max_length=16)),
+                ('prompt_hash', models.CharField(max_length=64)),
+                ('question_hash', models.CharField(max_length=64)),
+                ('question', models.TextField()),
+                ('corpus_version', models.CharField(max_length=64)),
+                ('answer', models.TextField()),
+                ('sources', models.JSONField(blank=True, default=list)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='projects.llmproject')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['project', 'prompt_hash', 'question_hash'], name='projects_answer_cache_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0010_answercacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectdocument',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='projectdocument',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='projectdocument',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最後抓取時間'),
+        ),
+        migrations.AddField(
+            model_name='projectdocument',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='projectdocument',
+            name='source_url',
+            field=models.URLField(blank=True, db_index=True, default='', max_length=2000, verbose_name='來源網址'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+import re
+
+from django.db import migrations
+
+# 建立當時的 project_search 索引格式（資料表、欄位、斷詞）；migration 不引用執行期模組，
+# 之後斷詞方式改變時，請以 manage.py rebuild_project_search 重建索引
+FTS_TABLE = 'projects_llmproject_fts'
+FIELDS = ('project_code', 'name', 'description', 'role_prompt')
+MAX_TERM_LENGTH = 64
+_TOKEN_RE = re.compile(
+    r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]+"
+    r"|[0-9a-z]+(?:[._\-@][0-9a-z]+)*"
+)
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+
+
+def index_terms(text):
+    """lexical.tokenize 的詞加上中文單字，以空白分隔"""
+    text = (text or "").lower()
+    terms = []
+    for m in _TOKEN_RE.finditer(text):
+        token = m.group()
+        if _CJK_RE.match(token):
+            if len(token) == 1:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            terms.append(token[:MAX_TERM_LENGTH])
+    terms.extend(ch for ch in text if _CJK_RE.match(ch))
+    return " ".join(terms)
+
+
+def create_fts_table(apps, schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return  # 未編入 FTS5：搜尋改用 icontains
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{', '.join(FIELDS)}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        LLMProject = apps.get_model('projects', 'LLMProject')
+        rows = [
+            [pk, *(index_terms(v) for v in values)]
+            for pk, *values in LLMProject.objects.values_list('pk', *FIELDS).iterator()
+        ]
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FIELDS)}) VALUES (%s, %s, %s, %s, %s)", rows
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    conn._project_fts_available = False
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0011_projectdocument_crawl_source'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
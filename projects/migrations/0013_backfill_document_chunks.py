@@ -0,0 +1,53 @@
+"""
+補建舊文件的片段：migrate 只負責排入 import_document 工作，不會在 migrate 中呼叫 embedding API
+
+部署時 migrate 之後必須有 worker 處理佇列，文件才會回到 ready、檢索得到：
+  - 有常駐 worker（manage.py run_jobs）：不必另外處理
+  - 沒有常駐 worker：migrate 後執行一次 manage.py run_jobs --kind import_document --once
+處理完之前，這些文件的狀態為「排隊中」，status_message 為「等待補建片段」。
+"""
+from django.db import migrations
+from django.utils import timezone
+
+
+def enqueue_missing_chunks(apps, schema_editor):
+    """
+    0006 之後檢索只讀 DocumentChunk：還沒有片段的舊文件排入 import_document 工作，
+    由 manage.py run_jobs 以 doc.content 補建片段與向量
+    """
+    ProjectDocument = apps.get_model('projects', 'ProjectDocument')
+    BackgroundJob = apps.get_model('projects', 'BackgroundJob')
+
+    queued = set(
+        BackgroundJob.objects
+        .filter(kind='import_document', status__in=['queued', 'running'])
+        .values_list('payload__document_id', flat=True)
+    )
+    doc_ids = [
+        pk for pk in
+        ProjectDocument.objects.filter(chunks__isnull=True).exclude(content='').values_list('pk', flat=True)
+        if pk not in queued
+    ]
+    now = timezone.now()
+    BackgroundJob.objects.bulk_create(
+        [
+            BackgroundJob(kind='import_document', payload={'document_id': pk, 'reindex': True}, run_after=now)
+            for pk in doc_ids
+        ],
+        batch_size=500,
+    )
+    for start in range(0, len(doc_ids), 500):
+        ProjectDocument.objects.filter(pk__in=doc_ids[start:start + 500]).update(
+            status='pending', status_message='等待補建片段',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0012_project_search_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(enqueue_missing_chunks, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
 from django.conf import settings
 
+from .chunking import with_heading
+from .vectors import pack_vector, unpack_vector
+
 class LLMProject(models.Model):
     project_code = models.CharField("專案代碼",max_length=20, unique=True, null=True, blank=True)
     name = models.CharField("專案名稱", max_length=100)
@@ -35,15 +38,180 @@ class LLMProject(models.Model):
         return f"{self.project_code} - {self.name}"
     
 
-class ProjectDocument(models.Model):
+class EmbeddingMixin(models.Model):
+    """
+    向量欄位：以 float32/float16 原始 bytes 存放，透過 embedding 屬性存取
+    """
+    embedding_vector = models.BinaryField(blank=True, null=True)
+    embedding_dim = models.PositiveIntegerField(blank=True, null=True)
+    embedding_dtype = models.CharField(max_length=16, blank=True, default="")
+
+    class Meta:
+        abstract = True
+
+    @property
+    def embedding(self):
+        """向量（唯讀 np.ndarray），沒有向量時為 None"""
+        return unpack_vector(self.embedding_vector, self.embedding_dim, self.embedding_dtype)
+
+    @embedding.setter
+    def embedding(self, vec):
+        """可指定 list / np.ndarray / None"""
+        self.embedding_vector, self.embedding_dim, self.embedding_dtype = pack_vector(vec)
+
+
+class ProjectDocument(EmbeddingMixin):
+    STATUS_PENDING = "pending"
+    STATUS_EXTRACTING = "extracting"
+    STATUS_EMBEDDING = "embedding"
+    STATUS_READY = "ready"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "排隊中"),
+        (STATUS_EXTRACTING, "解析中"),
+        (STATUS_EMBEDDING, "向量化中"),
+        (STATUS_READY, "完成"),
+        (STATUS_FAILED, "失敗"),
+    ]
+
     project = models.ForeignKey('LLMProject', on_delete=models.CASCADE, related_name='documents')
     filename = models.CharField(max_length=512)
     uploaded_file = models.FileField(upload_to='project_imports/%Y/%m/%d', blank=True, null=True)
     content = models.TextField(blank=True, null=True)
-    embedding = models.JSONField(blank=True, null=True) # 存向量 (list) 或 metadata
     imported_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
     imported_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField("處理狀態", max_length=16, choices=STATUS_CHOICES, default=STATUS_READY)
+    status_message = models.TextField("狀態訊息", blank=True, default="")
+    # 爬蟲文件：來源網址與條件式請求（ETag / Last-Modified）資訊，重爬時據此判斷是否需要更新
+    source_url = models.URLField("來源網址", max_length=2000, blank=True, default="", db_index=True)
+    etag = models.CharField(max_length=255, blank=True, default="")
+    last_modified = models.CharField(max_length=64, blank=True, default="")
+    content_hash = models.CharField(max_length=64, blank=True, default="")  # sha256(文字內容)；爬蟲判斷變動、批次匯入去重
+    fetched_at = models.DateTimeField("最後抓取時間", blank=True, null=True)
+
+
+    def __str__(self):
+        return f"{self.project} - {self.filename}"
+
+
+class DocumentChunk(EmbeddingMixin):
+    """
+    文件切段後的片段；檢索以片段為單位
+    """
+    document = models.ForeignKey('ProjectDocument', on_delete=models.CASCADE, related_name='chunks')
+    project = models.ForeignKey('LLMProject', on_delete=models.CASCADE, related_name='chunks')
+    chunk_index = models.PositiveIntegerField("段落序號")
+    heading = models.CharField("所屬標題", max_length=255, blank=True, default="")
+    content = models.TextField("內容")
+    token_count = models.PositiveIntegerField("詞數", default=0)  # BM25 的片段長度
+
+    class Meta:
+        ordering = ['document_id', 'chunk_index']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'chunk_index'], name='uniq_document_chunk_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.document.filename} #{self.chunk_index}"
+
+    @property
+    def full_text(self):
+        """帶上章節標題的片段文字（向量化、關鍵字索引、LLM context 都用這個）"""
+        return with_heading(self.heading, self.content)
+
+
+class ChunkTerm(models.Model):
+    """
+    BM25 倒排索引：片段中每個詞的詞頻
+    """
+    project = models.ForeignKey('LLMProject', on_delete=models.CASCADE, related_name='+')
+    chunk = models.ForeignKey('DocumentChunk', on_delete=models.CASCADE, related_name='terms')
+    term = models.CharField(max_length=64)
+    tf = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'term'], name='projects_chunkterm_lookup'),
+        ]
+
+
+class EmbeddingCacheEntry(EmbeddingMixin):
+    """
+    內容定址的向量快取：同一段文字（同模型、同 task_type）只向 API 要一次向量
+    """
+    model = models.CharField(max_length=100)
+    task_type = models.CharField(max_length=50, blank=True, default="")
+    text_hash = models.CharField(max_length=64)  # sha256(text) hex
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'task_type', 'text_hash'], name='uniq_embedding_cache_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.model}/{self.task_type}/{self.text_hash[:12]}"
+
+
+class AnswerCacheEntry(EmbeddingMixin):
+    """
+    project_test_api 的回答快取
+    key = (專案, 提示詞設定雜湊, 正規化問題雜湊)；corpus_version 為片段指紋，文件異動後自然失效
+    embedding 只有開啟語意快取時才會寫入（問題的向量）
+    """
+    project = models.ForeignKey('LLMProject', on_delete=models.CASCADE, related_name='+')
+    prompt_hash = models.CharField(max_length=64)
+    question_hash = models.CharField(max_length=64)
+    question = models.TextField()
+    corpus_version = models.CharField(max_length=64)
+    answer = models.TextField()
+    sources = models.JSONField(default=list, blank=True)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'prompt_hash', 'question_hash'], name='projects_answer_cache_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.project_id}/{self.question[:30]}"
+
+
+class BackgroundJob(models.Model):
+    """
+    資料庫佇列中的背景工作；由 `manage.py run_jobs` 取出執行
+    kind 對應 projects.jobs 註冊的 handler，payload 為其參數
+    """
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "排隊中"),
+        (STATUS_RUNNING, "執行中"),
+        (STATUS_DONE, "完成"),
+        (STATUS_FAILED, "失敗"),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField()
+    locked_at = models.DateTimeField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True, default="")
+    last_error = models.TextField(blank=True, default="")
+    result = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='projects_job_status_run_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.project} - {self.filename}"
\ No newline at end of file
+        return f"{self.kind}#{self.pk} ({self.status})"
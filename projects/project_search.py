@@ -0,0 +1,215 @@
+"""
+專案搜尋（編輯 / 發布頁的搜尋框、自動完成）
+
+SQLite 以 FTS5 全文索引（資料表 projects_llmproject_fts，rowid = 專案 id）：
+- 索引欄位：專案代碼、名稱、說明、角色指令；LLMProject 儲存 / 刪除時由 signals 同步
+- 斷詞沿用 lexical.tokenize（中文相鄰兩字、英數字整個字），另外加上中文單字，單一字的查詢也能命中；
+  存進 FTS5 的是以空白分隔的詞，FTS5 本身只需用空白切開
+- 查詢的每個詞都必須出現（AND）；英數字以前綴比對（輸入 "hr" 可找到 "hr01"）
+- 排名：bm25，代碼與名稱的權重高於說明與角色指令
+- 分頁：keyset（以上一頁最後一筆的 (分數, id) 或 (代碼, id) 為游標），翻到後面的頁面不會變慢
+
+其他資料庫（或 SQLite 未編入 FTS5）改用 icontains 篩選，分頁方式相同。
+索引與資料不一致時（例如以 QuerySet.update 直接改資料）可執行 manage.py rebuild_project_search。
+"""
+import base64
+import json
+import re
+
+from django.db import DatabaseError, connection
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce
+
+from .lexical import tokenize
+
+FTS_TABLE = "projects_llmproject_fts"
+FIELDS = ("project_code", "name", "description", "role_prompt")
+# bm25 欄位權重，順序同 FIELDS
+WEIGHTS = (10.0, 5.0, 1.0, 0.5)
+PAGE_SIZE = 50
+SUGGEST_LIMIT = 10
+
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+
+
+# ---- 索引 ----
+def index_terms(text: str) -> str:
+    """要寫進 FTS5 的內容：tokenize 的詞加上中文單字，以空白分隔"""
+    terms = tokenize(text)
+    terms.extend(ch for ch in (text or "").lower() if _CJK_RE.match(ch))
+    return " ".join(terms)
+
+
+def create_table_sql() -> str:
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{', '.join(FIELDS)}, tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def fts_available(conn=None) -> bool:
+    conn = conn or connection
+    if conn.vendor != "sqlite":
+        return False
+    # 找到後記在連線上；找不到不記，migrate 建表後立即生效
+    if getattr(conn, "_project_fts_available", False):
+        return True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        found = cursor.fetchone() is not None
+    if found:
+        conn._project_fts_available = True
+    return found
+
+
+def _row(values) -> list:
+    return [index_terms(v or "") for v in values]
+
+
+def index_project(project, conn=None):
+    conn = conn or connection
+    if not fts_available(conn):
+        return
+    values = _row(getattr(project, f) for f in FIELDS)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [project.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FIELDS)}) VALUES (%s, %s, %s, %s, %s)",
+            [project.pk, *values],
+        )
+
+
+def remove_project(project_id: int, conn=None):
+    conn = conn or connection
+    if not fts_available(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [project_id])
+
+
+def rebuild(queryset, conn=None) -> int:
+    """以 queryset（LLMProject，可為 migration 中的歷史 model）重建整個索引；回傳筆數"""
+    conn = conn or connection
+    if not fts_available(conn):
+        return 0
+    rows = [[pk, *_row(values)] for pk, *values in queryset.values_list("pk", *FIELDS).iterator()]
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FIELDS)}) VALUES (%s, %s, %s, %s, %s)", rows
+        )
+    return len(rows)
+
+
+# ---- 查詢 ----
+def match_expression(q: str, prefix: bool = True):
+    """使用者輸入 → FTS5 MATCH 語法；沒有可用的詞時回傳 None"""
+    terms = tokenize(q)
+    if not terms:
+        return None
+    parts = []
+    for term in dict.fromkeys(terms):
+        quoted = '"' + term.replace('"', '""') + '"'
+        # 中文詞已是完整的單字 / 兩字詞；英數字允許只打前半段
+        parts.append(quoted + "*" if prefix and not _CJK_RE.match(term) else quoted)
+    return " ".join(parts)
+
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """無效的游標視為第一頁"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) and len(values) == 2 else None
+
+
+def _ranked_ids(match: str, after, limit: int):
+    weights = ", ".join(str(w) for w in WEIGHTS)
+    sql = (
+        f"SELECT id, score FROM ("
+        f"  SELECT rowid AS id, bm25({FTS_TABLE}, {weights}) AS score"
+        f"  FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        f")"
+    )
+    params = [match]
+    if after is not None:
+        sql += " WHERE score > %s OR (score = %s AND id > %s)"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY score, id LIMIT %s"
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _count_matches(match: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+        return cursor.fetchone()[0]
+
+
+def _ordered_queryset(q: str):
+    """沒有關鍵字（或沒有 FTS5）時：依代碼、id 排序，游標為 (代碼, id)"""
+    from .models import LLMProject
+
+    qs = LLMProject.objects.annotate(sort_code=Coalesce("project_code", Value("")))
+    if q:
+        cond = Q()
+        for f in FIELDS:
+            cond |= Q(**{f"{f}__icontains": q})
+        qs = qs.filter(cond)
+    return qs.order_by("sort_code", "id")
+
+
+def search_projects(q: str = "", cursor: str = None, limit: int = PAGE_SIZE):
+    """
+    回傳 (projects, total, next_cursor)
+    有關鍵字時依相關度排序；沒有關鍵字時列出全部（依專案代碼）
+    next_cursor 為 None 表示已是最後一頁
+    """
+    from .models import LLMProject
+
+    q = (q or "").strip()
+    after = decode_cursor(cursor)
+    match = match_expression(q) if q else None
+
+    if match and fts_available():
+        try:
+            rows = _ranked_ids(match, after, limit + 1)
+            total = _count_matches(match)
+        except DatabaseError:
+            # 特殊字元組出 FTS5 無法解析的語法時改用一般篩選
+            rows = None
+        if rows is not None:
+            page = rows[:limit]  # [(id, 分數)]
+            by_id = LLMProject.objects.in_bulk([pk for pk, _ in page])
+            projects = [by_id[pk] for pk, _ in page if pk in by_id]
+            next_cursor = encode_cursor([page[-1][1], page[-1][0]]) if len(rows) > limit else None
+            return projects, total, next_cursor
+
+    qs = _ordered_queryset(q)
+    total = qs.count()
+    if after is not None:
+        code, pk = after
+        qs = qs.filter(Q(sort_code__gt=code) | Q(sort_code=code, id__gt=pk))
+    projects = list(qs[: limit + 1])
+    next_cursor = None
+    if len(projects) > limit:
+        projects = projects[:limit]
+        next_cursor = encode_cursor([projects[-1].sort_code, projects[-1].pk])
+    return projects, total, next_cursor
+
+
+def suggest(q: str, limit: int = SUGGEST_LIMIT):
+    """自動完成：[{"id", "project_code", "name"}, ...]"""
+    if not (q or "").strip():
+        return []
+    projects, _, _ = search_projects(q, limit=limit)
+    return [{"id": p.pk, "project_code": p.project_code or "", "name": p.name} for p in projects]
@@ -1,8 +1,21 @@
-import os
+import asyncio
+import logging
 import math
+import re
 import numpy as np
-import google.generativeai as genai
-from .models import ProjectDocument 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import ann, lexical, metrics
+from .chunking import with_heading
+from .embeddings import aembed_text, embed_text
+from .models import DocumentChunk
+from .vector_cache import get_project_matrix
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+RRF_K = 60
 
 def _cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     denom = (np.linalg.norm(a) * np.linalg.norm(b))
@@ -12,56 +25,189 @@ def _cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
 
 def embed_text_gemini(text: str) -> np.ndarray:
     """
-    取得文字的 embedding（使用 Google text-embedding-004）
+    取得查詢文字的 embedding（使用 Google text-embedding-004）
+    並行的查詢會由 embeddings 服務合併成批次請求
     """
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    res = genai.embed_content(
-        model="text-embedding-004",
-        content=text,
-    )
-    vec = np.array(res["embedding"], dtype=float)
-    return vec
+    return embed_text(text, task_type="retrieval_query")
+
+def compute_embedding(text):
+    """
+    文件（片段）向量化；失敗回傳 []
+    大量文字請改用 embeddings.embed_texts 一次送出
+    """
+    try:
+        return embed_text(text, task_type="retrieval_document")
+    except Exception as e:
+        logger.warning("向量化失敗：%s", e)
+        metrics.ERRORS.inc(component="retriever")
+        # 如果發生錯誤，返回一個空列表或你設定的預設值
+        return []
+
+def _fuse_rrf(rankings, k: int = RRF_K):
+    """
+    Reciprocal Rank Fusion：score = Σ 1 / (k + 名次)
+    rankings: [[(chunk_id, score), ...], ...]，各自已由高到低排序
+    """
+    fused = {}
+    for ranked in rankings:
+        for rank, (chunk_id, _) in enumerate(ranked, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+# 代號、分機、Email、版本號之類的單一詞（英數字加少數連接符號）
+_TOKEN_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.@#/+-]*$")
+# 人名、專有名詞：全中文、最多 4 字
+_CJK_NAME_RE = re.compile(r"^[一-鿿]{1,4}$")
+# 出現疑問詞就當成一般問句，即使很短（「分機多少」、「誰負責」）
+_QUESTION_WORDS = ("什麼", "甚麼", "怎麼", "怎樣", "如何", "多少", "哪", "嗎", "呢", "誰", "幾", "為何", "是否")
+
+
+def is_keyword_query(question: str) -> bool:
+    """
+    像關鍵字的短查詢（姓名、分機、代號…）：hybrid 模式下 BM25 有命中就不做向量檢索
+    只認單一詞：英數字代號，或不含疑問詞的短中文名詞；有空白、標點或疑問詞的一律當成問句，照常融合
+    """
+    q = question.strip()
+    limit = getattr(settings, "PROJECT_KEYWORD_QUERY_MAX_CHARS", 8)
+    if not q or len(q) > limit:
+        return False
+    if _TOKEN_RE.match(q):
+        return True
+    return bool(_CJK_NAME_RE.match(q)) and not any(w in q for w in _QUESTION_WORDS)
+
+
+def _load_hits(ranked, extra=None):
+    """[(chunk_id, score)] → 完整的命中資料；extra 為 {chunk_id: {...}} 附加欄位"""
+    with metrics.span("db"):
+        rows = {
+            row[0]: row
+            for row in DocumentChunk.objects
+            .filter(id__in=[chunk_id for chunk_id, _ in ranked])
+            .values_list("id", "document_id", "document__filename", "heading", "content")
+        }
+    hits = []
+    for chunk_id, score in ranked:
+        if chunk_id not in rows:
+            continue
+        _, document_id, filename, heading, content = rows[chunk_id]
+        hit = {
+            "id": chunk_id,
+            "document_id": document_id,
+            "filename": filename,
+            "text": with_heading(heading, content),
+            "score": score,
+        }
+        if extra:
+            hit.update(extra.get(chunk_id, {}))
+        hits.append(hit)
+    return hits
+
+
+def _vector_ranked(project_id, question, k, min_score, nprobe):
+    with metrics.span("embed"):
+        q_vec = embed_text_gemini(question)
+    # 專案的片段向量矩陣（process 內快取；片段異動時由 signals 清除）
+    with metrics.span("matrix"):
+        matrix = get_project_matrix(project_id)
+    # 小專案精確搜尋；大專案走 ANN 索引
+    with metrics.span("score"):
+        return ann.search(project_id, matrix, q_vec, k=k, min_score=min_score, nprobe=nprobe)
+
 
-def search_similar_docs(project_id: int, question: str, top_k: int = 3, min_score: float = 0.2):
+def _lexical_search(project_id, question, k):
+    with metrics.span("bm25"):
+        return lexical.search(project_id, question, k=k)
+
+
+def search_similar_docs(project_id: int, question: str, top_k: int = 3, min_score: float = 0.2,
+                        nprobe: int = None, mode: str = None):
     """
     回傳最相近的文件片段清單：
     [
-      {"id": 123, "text": "...", "score": 0.87},
+      {"id": 456, "document_id": 123, "filename": "...", "text": "...", "score": 0.87},
       ...
     ]
+    id 為 DocumentChunk.id；text 已帶上片段所屬的章節標題
+
+    mode（None 用 settings.PROJECT_RETRIEVAL_MODE，預設 "hybrid"）：
+      "vector"  ：只用向量 cosine，score 為相似度，低於 min_score 的捨棄
+      "lexical" ：只用 BM25 關鍵字，score 為 BM25 分數，不呼叫 embedding API
+      "hybrid"  ：兩者以 RRF 融合，score 為融合分數，另附 vector_score / lexical_score；
+                  短的關鍵字查詢若 BM25 已有命中，直接回傳 BM25 結果，省下 embedding 呼叫
+    nprobe：ANN 索引掃描的群數（越大召回越高、越慢），None 用 settings.PROJECT_ANN_NPROBE
     """
-    q_vec = embed_text_gemini(question)
+    mode = mode or getattr(settings, "PROJECT_RETRIEVAL_MODE", "hybrid")
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"未知的檢索模式：{mode}（可用：{', '.join(RETRIEVAL_MODES)}）")
 
-    # 取出該專案下的所有向量與文本
-    qs = ProjectDocument.objects.filter(project_id=project_id).values("id", "content", "embedding")
-    #qs = Document.objects.filter(project_id=project_id).values("id", "text", "embedding")
-    # ↑ 如果你的欄位不是 text / embedding，請改成你的欄位名
+    if mode == "vector":
+        return _load_hits(_vector_ranked(project_id, question, top_k, min_score, nprobe))
 
-    hits = []
-    for row in qs:
-        emb = row["embedding"]
-        if not emb:
-            continue
-        # embedding 可能是 list[float] 或字串(JSON)；確保變成 np.ndarray
-        vec = np.array(emb, dtype=float)
-        if vec.ndim != 1:
-            continue
+    # 候選數多取幾倍，融合後再截斷
+    pool = max(top_k * 4, 20)
+    lexical_ranked = _lexical_search(project_id, question, pool)
+    if mode == "lexical" or (lexical_ranked and is_keyword_query(question)):
+        return _load_hits(lexical_ranked[:top_k])
+
+    vector_ranked = _vector_ranked(project_id, question, pool, min_score, nprobe)
+    return _load_hits(*_fuse_hybrid(vector_ranked, lexical_ranked, top_k))
 
-        if isinstance(emb, str):
-            try:
-                emb = json.loads(emb)
-            except Exception:
-                continue
 
+def _fuse_hybrid(vector_ranked, lexical_ranked, top_k):
+    """回傳 (融合後的 [(chunk_id, score)], 各片段的 vector_score / lexical_score)"""
+    fused = _fuse_rrf([vector_ranked, lexical_ranked])[:top_k]
+    extra = {}
+    for chunk_id, score in vector_ranked:
+        extra.setdefault(chunk_id, {})["vector_score"] = score
+    for chunk_id, score in lexical_ranked:
+        extra.setdefault(chunk_id, {})["lexical_score"] = score
+    return fused, extra
 
 
-        score = _cosine_similarity(q_vec, vec)
-        if score >= min_score:
-         
-            hits.append({"id": row["id"], "text": row["content"], "score": score})
-        
-            
+async def _avector_ranked(project_id, question, k, min_score, nprobe):
+    # 查詢向量化（網路）與載入向量矩陣（DB，通常命中 process 內快取）同時進行
+    q_vec, matrix = await asyncio.gather(
+        metrics.timed("embed", aembed_text(question, task_type="retrieval_query")),
+        metrics.timed("matrix", sync_to_async(get_project_matrix)(project_id)),
+    )
+    # 純 NumPy 計算，丟到一般 thread pool，不佔用 ORM 專用的 thread；
+    # 需要重建索引時只先記下，排程（查 DB）回到 ORM thread 再做
+    stale = []
+    with metrics.span("score"):
+        ranked = await sync_to_async(ann.search, thread_sensitive=False)(
+            project_id, matrix, q_vec, k=k, min_score=min_score, nprobe=nprobe, on_stale=stale.append
+        )
+    if stale:
+        await sync_to_async(ann.schedule_rebuild)(project_id)
+    return ranked
+
+
+async def asearch_similar_docs(project_id: int, question: str, top_k: int = 3, min_score: float = 0.2,
+                               nprobe: int = None, mode: str = None):
+    """
+    async 版 search_similar_docs，參數與回傳相同
+    hybrid 模式下 BM25、查詢向量化、載入矩陣三者同時進行
+    """
+    mode = mode or getattr(settings, "PROJECT_RETRIEVAL_MODE", "hybrid")
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"未知的檢索模式：{mode}（可用：{', '.join(RETRIEVAL_MODES)}）")
+    load_hits = sync_to_async(_load_hits)
+
+    if mode == "vector":
+        return await load_hits(await _avector_ranked(project_id, question, top_k, min_score, nprobe))
 
-    # 依相似度排序、取前 top_k
-    hits.sort(key=lambda x: x["score"], reverse=True)
-    return hits[:top_k]
\ No newline at end of file
+    pool = max(top_k * 4, 20)
+    lexical_search = sync_to_async(_lexical_search)
+    if mode == "lexical" or is_keyword_query(question):
+        # 關鍵字查詢先看 BM25，有命中就不必向量化
+        lexical_ranked = await lexical_search(project_id, question, pool)
+        if mode == "lexical" or lexical_ranked:
+            return await load_hits(lexical_ranked[:top_k])
+        vector_ranked = await _avector_ranked(project_id, question, pool, min_score, nprobe)
+    else:
+        vector_ranked, lexical_ranked = await asyncio.gather(
+            _avector_ranked(project_id, question, pool, min_score, nprobe),
+            lexical_search(project_id, question, pool),
+        )
+    return await load_hits(*_fuse_hybrid(vector_ranked, lexical_ranked, top_k))
@@ -0,0 +1,36 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import answer_cache, project_search
+from .ann import registry as ann_registry, remove_from_index
+from .models import DocumentChunk, LLMProject, ProjectDocument
+from .vector_cache import invalidate_project
+
+
+@receiver(post_save, sender=DocumentChunk)
+@receiver(post_delete, sender=DocumentChunk)
+def _chunk_changed(sender, instance, **kwargs):
+    # 片段有異動（含文件刪除時連帶刪除的片段）→ 丟掉該專案的向量矩陣快取，下次查詢時重建
+    invalidate_project(instance.project_id)
+
+
+@receiver(pre_delete, sender=ProjectDocument)
+def _document_deleting(sender, instance, **kwargs):
+    # 文件刪除前先把它的片段移出 ANN 索引
+    ids = list(instance.chunks.values_list("id", flat=True))
+    remove_from_index(instance.project_id, ids)
+
+
+@receiver(post_delete, sender=LLMProject)
+def _project_deleted(sender, instance, **kwargs):
+    ann_registry.drop(instance.pk)
+    project_search.remove_project(instance.pk)
+
+
+@receiver(post_save, sender=LLMProject)
+def _project_saved(sender, instance, created, **kwargs):
+    # 專案搜尋的全文索引與資料列在同一個交易內更新
+    project_search.index_project(instance)
+    # 提示詞或模型改了 → 舊設定下的回答不再適用
+    if not created:
+        answer_cache.invalidate_project(instance, keep_current_prompt=True)
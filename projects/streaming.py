@@ -0,0 +1,59 @@
+"""
+邊產生邊下載的 ZIP（給 StreamingHttpResponse 使用）
+
+    entries = [("a.sql", generate_lines()), ("b.json", [b"{...}"])]
+    StreamingHttpResponse(stream_zip(entries), content_type="application/zip")
+
+每個檔案的內容是 str / bytes 的 iterable；壓縮後的資料一產生就 yield 出去，
+不會把整個檔案或整個 ZIP 放進記憶體。檔案大小未知，一律寫成 ZIP64 + data descriptor。
+"""
+import time
+import zipfile
+
+
+class _ChunkBuffer:
+    """zipfile 的輸出目標：只接受 write()，由 stream_zip 定期取走已寫入的資料"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED, flush_bytes: int = 64 * 1024):
+    """
+    entries: [(檔名, iterable of str/bytes), ...]；也可寫成 (檔名, iterable, 壓縮方式) 個別指定
+    累積超過 flush_bytes 的壓縮資料就 yield 一次
+    """
+    buf = _ChunkBuffer()
+    pending = 0
+    with zipfile.ZipFile(buf, mode="w", compression=compression) as zf:
+        for entry_spec in entries:
+            name, parts = entry_spec[:2]
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = entry_spec[2] if len(entry_spec) > 2 else compression
+            with zf.open(info, mode="w", force_zip64=True) as entry:
+                for part in parts:
+                    if isinstance(part, str):
+                        part = part.encode("utf-8")
+                    entry.write(part)
+                    pending += len(part)
+                    if pending >= flush_bytes:
+                        pending = 0
+                        data = buf.take()
+                        if data:
+                            yield data
+    # 中央目錄（central directory）在 ZipFile 關閉時寫入
+    data = buf.take()
+    if data:
+        yield data
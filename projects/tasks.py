@@ -0,0 +1,129 @@
+"""
+背景工作 handler（由 `manage.py run_jobs` 執行）
+"""
+from django.utils import timezone
+
+from .ann import build_index
+from .bulk_import import discard_uploads, run_bulk_import
+from .crawler import run_crawl
+from .embedding_cache import text_hash
+from .extraction import iter_text_segments
+from .image_jobs import KIND as IMAGE_JOB_KIND, run_image_job
+from .indexing import index_document, index_document_segments
+from .jobs import register
+from .models import BackgroundJob, ProjectDocument
+
+
+def _set_status(doc, status, message=""):
+    doc.status = status
+    doc.status_message = message
+    ProjectDocument.objects.filter(pk=doc.pk).update(status=status, status_message=message)
+
+
+def _import_failed(job, exc):
+    ProjectDocument.objects.filter(pk=job.payload.get("document_id")).update(
+        status=ProjectDocument.STATUS_FAILED,
+        status_message=str(exc)[:2000],
+    )
+
+
+@register("import_document", on_failure=_import_failed)
+def import_document(job):
+    """
+    payload: {"document_id": int, "path": 伺服器路徑（選填）, "reindex": bool（選填）}
+    有上傳檔或路徑 → 邊解析邊切段、向量化；否則（或 reindex 為 True）直接以 doc.content 切段、批次向量化
+    """
+    doc = ProjectDocument.objects.filter(pk=job.payload["document_id"]).first()
+    if doc is None:
+        # 排隊期間文件已被刪除
+        return {"skipped": True}
+
+    try:
+        path = job.payload.get("path")
+        if (doc.uploaded_file or path) and not job.payload.get("reindex"):
+            _set_status(doc, ProjectDocument.STATUS_EXTRACTING)
+
+            def extracted(content):
+                # 解析完畢；剩下還在進行的向量化
+                doc.content = content
+                ProjectDocument.objects.filter(pk=doc.pk).update(content=content)
+                _set_status(doc, ProjectDocument.STATUS_EMBEDDING)
+
+            f = doc.uploaded_file.open("rb") if doc.uploaded_file else open(path, "rb")
+            with f:
+                _, n = index_document_segments(
+                    doc, iter_text_segments(f, doc.filename), strict=True, on_extracted=extracted,
+                )
+        else:
+            _set_status(doc, ProjectDocument.STATUS_EMBEDDING)
+            n = index_document(doc, strict=True)
+    except Exception as e:
+        if job.attempts < job.max_attempts:
+            _set_status(doc, ProjectDocument.STATUS_PENDING, f"第 {job.attempts} 次處理失敗，稍後重試：{e}")
+        raise
+
+    # 記下內容雜湊，批次匯入才認得出與這份文件重複的檔案
+    doc.content_hash = text_hash(doc.content or "")
+    ProjectDocument.objects.filter(pk=doc.pk).update(content_hash=doc.content_hash)
+    _set_status(doc, ProjectDocument.STATUS_READY)
+    return {"chunks": n}
+
+
+@register("rebuild_ann_index")
+def rebuild_ann_index(job):
+    """payload: {"project_id": int}"""
+    index = build_index(job.payload["project_id"])
+    return {"nlist": index.nlist if index else 0, "rows": len(index.ids) if index else 0}
+
+
+def _report(job, progress):
+    """執行中更新 job.result，讓爬蟲頁面輪詢顯示進度（順便更新心跳 locked_at）"""
+    BackgroundJob.objects.filter(pk=job.pk).update(result=progress, locked_at=timezone.now())
+
+
+@register("crawl_site")
+def crawl_site(job):
+    """
+    payload: {"project_id": int, "url": 起點網址或 sitemap.xml, "max_depth": int, "max_pages": int, "user_id": int}
+    已爬過的網址就地更新（內容沒變則略過），不會重複建立文件
+    """
+    payload = job.payload
+    return run_crawl(
+        payload["project_id"],
+        payload["url"],
+        max_depth=payload.get("max_depth"),
+        max_pages=payload.get("max_pages"),
+        user_id=payload.get("user_id"),
+        on_progress=lambda progress: _report(job, progress),
+    )
+
+
+def _bulk_import_failed(job, exc):
+    # 重試次數用完：上傳的檔案都沒有成為文件，不必保留
+    discard_uploads(job.payload.get("files") or [], job.payload.get("archives") or [])
+
+
+@register("bulk_import", on_failure=_bulk_import_failed)
+def bulk_import(job):
+    """
+    payload: {"project_id": int, "files": [...], "archives": [...], "directory": 伺服器資料夾（選填）, "user_id": int}
+    files / archives 的格式見 bulk_import 模組說明；回傳摘要報告
+    """
+    payload = job.payload
+    return run_bulk_import(
+        payload["project_id"],
+        files=payload.get("files") or [],
+        archives=payload.get("archives") or [],
+        directory=payload.get("directory"),
+        user_id=payload.get("user_id"),
+        on_progress=lambda progress: _report(job, progress),
+    )
+
+
+@register(IMAGE_JOB_KIND)
+def generate_image(job):
+    """
+    payload: {"prompt": str, "model": str, "params": dict | None, "user_id": int}
+    回傳 {"prompt", "image_url", "content_type", "cached"}；失敗依 max_attempts 重試
+    """
+    return run_image_job(job.payload)
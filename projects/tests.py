@@ -0,0 +1,660 @@
+"""
+projects 測試：embedding / LLM 一律使用 benchmark.offline_backends 的離線替身，不連網
+"""
+import asyncio
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Future
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import embeddings, image_cache, jobs, lexical, project_search
+from .benchmark import offline_backends
+from .bulk_import import run_bulk_import
+from .bundle import export_stream, import_bundle
+from .chunking import split_text
+from .crawler import Page, save_pages
+from .embedding_cache import embedding_cache
+from .indexing import build_chunks_many, create_indexed_documents
+from .models import BackgroundJob, DocumentChunk, LLMProject, ProjectDocument
+from .retriever import _fuse_rrf, is_keyword_query, search_similar_docs
+from .streaming import stream_zip
+from .vector_cache import ProjectMatrix, ProjectMatrixCache, matrix_cache
+
+DIM = 64
+
+
+class _OfflineTestCase(TestCase):
+    """離線 embedding、獨立的 ANN 目錄，並清掉 process 內的向量快取（測試間 id 會重複使用）"""
+
+    def setUp(self):
+        self.ann_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.ann_dir, True)
+        stack = offline_backends(DIM)
+        stack.enter_context(override_settings(
+            PROJECT_ANN_DIR=self.ann_dir,
+            PROJECT_ANN_MIN_ROWS=10 ** 12,
+            PROJECT_EMBEDDING_COALESCE_MS=0,
+        ))
+        stack.__enter__()
+        self.addCleanup(stack.__exit__, None, None, None)
+        embedding_cache.clear_memory()
+        matrix_cache.clear()
+        self.addCleanup(matrix_cache.clear)
+        self.addCleanup(embedding_cache.clear_memory)
+
+    def make_project(self, code="t", texts=()):
+        project = LLMProject.objects.create(project_code=code, name=f"測試 {code}", llm_model="gemini")
+        docs = [
+            ProjectDocument(project=project, filename=f"{i}.txt", content=text, status=ProjectDocument.STATUS_READY)
+            for i, text in enumerate(texts)
+        ]
+        chunks = [c for doc_chunks in build_chunks_many(docs, strict=True) for c in doc_chunks]
+        create_indexed_documents(docs, chunks)
+        return project
+
+
+# ---- 專案向量矩陣快取 ----
+class MatrixCacheTests(SimpleTestCase):
+    def _cache(self, max_bytes=None):
+        loads = []
+
+        def loader(project_id):
+            loads.append(project_id)
+            return ProjectMatrix.from_rows([(1, [1.0, 0.0]), (2, [0.6, 0.8]), (3, [0.0, 0.0])])
+
+        return ProjectMatrixCache(loader, max_bytes=max_bytes), loads
+
+    def test_top_k_skips_zero_vectors(self):
+        pm = ProjectMatrix.from_rows([(1, [1.0, 0.0]), (2, "[0.6, 0.8]"), (3, [0.0, 0.0]), (4, [1.0])])
+        self.assertEqual(list(pm.ids), [1, 2])
+        hits = pm.top_k([2.0, 0.0], k=5)
+        self.assertEqual([i for i, _ in hits], [1, 2])
+        self.assertAlmostEqual(hits[1][1], 0.6, places=5)
+        self.assertEqual(pm.top_k([0.0, 1.0], k=5, min_score=0.7), [(2, mock.ANY)])
+
+    def test_cached_until_invalidated(self):
+        cache, loads = self._cache()
+        first = cache.get(7)
+        self.assertIs(cache.get(7), first)
+        cache.invalidate(7)
+        self.assertIsNot(cache.get(7), first)
+        self.assertEqual(loads, [7, 7])
+
+    def test_fingerprint_checked_at_most_once_per_interval(self):
+        calls = []
+
+        def fingerprint(project_id):
+            calls.append(project_id)
+            return (len(calls), 1)
+
+        cache = ProjectMatrixCache(lambda pk: ProjectMatrix.from_rows([(1, [1.0])]), fingerprint=fingerprint,
+                                   check_seconds=60)
+        first = cache.get(7)
+        self.assertIs(cache.get(7), first)
+        self.assertEqual(cache.fingerprint(7), (1, 1))
+        self.assertEqual(calls, [7])
+        cache.invalidate(7)  # 同 process 的異動由 signals 通知，立即重查
+        self.assertIsNot(cache.get(7), first)
+        self.assertEqual(calls, [7, 7])
+        cache._check_seconds = 0
+        cache.get(7)
+        self.assertEqual(calls, [7, 7, 7])
+
+    def test_lru_eviction_by_bytes(self):
+        cache, loads = self._cache()
+        one = cache.get(1).nbytes
+        cache._max_bytes = one * 2
+        cache.get(2)
+        cache.get(1)  # 1 變成最近使用
+        cache.get(3)
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertEqual(cache.current_bytes, one * 2)
+
+
+# ---- 切段 ----
+class ChunkingTests(SimpleTestCase):
+    def test_chunks_respect_size_and_overlap(self):
+        text = "。".join(f"第{i}句內容比較長一點" for i in range(200))
+        chunks = split_text(text, chunk_size=100, chunk_overlap=20)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(c.text) <= 100 for c in chunks))
+        # 相鄰片段有重疊
+        self.assertIn(chunks[1].text[:10], chunks[0].text)
+
+    def test_headings_are_kept(self):
+        text = "# 請假規定\n" + "員工請假需事先申請。" * 30 + "\n# 加班規定\n" + "加班需主管核准。" * 30
+        chunks = split_text(text, chunk_size=120, chunk_overlap=10)
+        self.assertEqual({c.heading for c in chunks}, {"請假規定", "加班規定"})
+
+    def test_overlap_must_be_smaller_than_size(self):
+        with self.assertRaises(ValueError):
+            split_text("abc", chunk_size=10, chunk_overlap=10)
+
+
+# ---- 背景工作佇列 ----
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.failures = []
+        self.addCleanup(jobs._handlers.pop, "test_ok", None)
+        self.addCleanup(jobs._handlers.pop, "test_fail", None)
+        jobs.register("test_ok")(lambda job: self.calls.append(job.pk) or {"ok": True})
+
+        def fail(job):
+            raise RuntimeError("boom")
+
+        jobs.register("test_fail", on_failure=lambda job, exc: self.failures.append(str(exc)))(fail)
+
+    def test_claim_respects_kind_and_run_after(self):
+        later = jobs.enqueue("test_ok", delay=3600)
+        job = jobs.enqueue("test_ok")
+        jobs.enqueue("test_fail")
+        claimed = jobs.claim_next("w1", kinds=["test_ok"])
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, BackgroundJob.STATUS_RUNNING)
+        self.assertIsNone(jobs.claim_next("w2", kinds=["test_ok"]))
+        later.refresh_from_db()
+        self.assertEqual(later.status, BackgroundJob.STATUS_QUEUED)
+
+    def test_job_claimed_only_once(self):
+        jobs.enqueue("test_ok")
+        self.assertIsNotNone(jobs.claim_next("w1"))
+        self.assertIsNone(jobs.claim_next("w2"))
+
+    def test_concurrency_limit(self):
+        for _ in range(3):
+            jobs.enqueue("test_ok")
+        with override_settings(PROJECT_JOB_CONCURRENCY={"test_ok": 2}):
+            self.assertIsNotNone(jobs.claim_next("w"))
+            self.assertIsNotNone(jobs.claim_next("w"))
+            self.assertIsNone(jobs.claim_next("w"))
+
+    def test_success(self):
+        job = jobs.enqueue("test_ok")
+        jobs.run_job(jobs.claim_next("w"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_DONE)
+        self.assertEqual(job.result, {"ok": True})
+        self.assertEqual(self.calls, [job.pk])
+
+    def test_retry_with_backoff_then_fail(self):
+        job = jobs.enqueue("test_fail", max_attempts=2)
+        jobs.run_job(jobs.claim_next("w"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now() + datetime.timedelta(seconds=5))
+        self.assertIsNone(jobs.claim_next("w"))  # 還沒到重試時間
+
+        BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.run_job(jobs.claim_next("w"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_FAILED)
+        self.assertIn("boom", job.last_error)
+        self.assertEqual(self.failures, ["boom"])
+
+    def test_requeue_only_jobs_without_heartbeat(self):
+        stale = jobs.enqueue("test_ok")
+        alive = jobs.enqueue("test_ok")
+        stale = jobs.claim_next("w-dead")
+        alive = jobs.claim_next("w-alive")
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        BackgroundJob.objects.filter(pk__in=[stale.pk, alive.pk]).update(locked_at=long_ago)
+
+        # 仍在執行的工作定期送出心跳，不會被另一個 worker 重複執行
+        self.assertEqual(jobs.heartbeat(alive), 1)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        stale.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual(stale.status, BackgroundJob.STATUS_QUEUED)
+        self.assertEqual(alive.status, BackgroundJob.STATUS_RUNNING)
+
+    def test_heartbeat_ignores_job_taken_over_by_another_worker(self):
+        jobs.enqueue("test_ok")
+        job = jobs.claim_next("w1")
+        BackgroundJob.objects.filter(pk=job.pk).update(locked_by="w2")
+        self.assertEqual(jobs.heartbeat(job), 0)
+
+    def test_progress_report_bumps_heartbeat(self):
+        from .tasks import _report
+
+        jobs.enqueue("test_ok")
+        job = jobs.claim_next("w")
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        BackgroundJob.objects.filter(pk=job.pk).update(locked_at=long_ago)
+        _report(job, {"pages": 1})
+        job.refresh_from_db()
+        self.assertGreater(job.locked_at, long_ago)
+        self.assertEqual(jobs.requeue_stale(), 0)
+
+
+# ---- 檢索：BM25、RRF、關鍵字捷徑 ----
+class RetrievalTests(_OfflineTestCase):
+    def test_rrf_fuses_rankings(self):
+        fused = _fuse_rrf([[(1, 0.9), (2, 0.8)], [(2, 5.0), (3, 4.0)]], k=60)
+        self.assertEqual(fused[0][0], 2)
+        self.assertEqual({cid for cid, _ in fused}, {1, 2, 3})
+
+    def test_keyword_query_detection(self):
+        for q in ("HR-01", "1234", "王小明"):
+            self.assertTrue(is_keyword_query(q), q)
+        for q in ("請假規定？", "分機多少？", "分機多少", "誰負責", "how to apply"):
+            self.assertFalse(is_keyword_query(q), q)
+
+    def test_bm25_ranks_matching_chunk_first(self):
+        project = self.make_project(texts=["請假需要事先填寫假單", "加班費依照勞基法計算", "分機號碼 8123"])
+        ranked = lexical.search(project.pk, "加班費", k=3)
+        top = DocumentChunk.objects.get(pk=ranked[0][0])
+        self.assertIn("加班費", top.content)
+
+    def test_short_question_still_uses_vector_search(self):
+        project = self.make_project(texts=["分機號碼 8123，總機多少都可以轉接", "請假需要事先填寫假單"])
+        with mock.patch("projects.retriever._vector_ranked", return_value=[]) as vector:
+            search_similar_docs(project.pk, "分機多少？", mode="hybrid")
+        vector.assert_called_once()
+
+    def test_keyword_query_skips_vector_search(self):
+        project = self.make_project(texts=["分機號碼 8123", "請假需要事先填寫假單"])
+        with mock.patch("projects.retriever._vector_ranked", return_value=[]) as vector:
+            hits = search_similar_docs(project.pk, "8123", mode="hybrid")
+        vector.assert_not_called()
+        self.assertIn("8123", hits[0]["text"])
+
+    def test_hybrid_returns_both_scores(self):
+        project = self.make_project(texts=["請假需要事先填寫假單並經主管核准", "加班費依照勞基法計算"])
+        hits = search_similar_docs(project.pk, "請假要怎麼申請才會核准", mode="hybrid", min_score=-1)
+        self.assertTrue(hits)
+        self.assertIn("請假", hits[0]["text"])
+        self.assertIn("lexical_score", hits[0])
+
+
+# ---- embedding 合併佇列 ----
+class CoalescerTests(SimpleTestCase):
+    def _slow_embed(self, texts, task_type=None, model=None):
+        time.sleep(0.05)
+        return [[float(len(t))] for t in texts]
+
+    def test_cancelled_waiter_does_not_kill_thread(self):
+        coalescer = embeddings._Coalescer()
+        with override_settings(PROJECT_EMBEDDING_COALESCE_MS=30), \
+                mock.patch("projects.embeddings.embed_texts", self._slow_embed):
+            cancelled = coalescer.submit("aa", "retrieval_query", "m")
+            kept = coalescer.submit("bbb", "retrieval_query", "m")
+            self.assertTrue(cancelled.cancel())
+            self.assertEqual(kept.result(timeout=2), [3.0])
+            self.assertTrue(coalescer._thread.is_alive())
+            self.assertEqual(coalescer.submit("c", "retrieval_query", "m").result(timeout=2), [1.0])
+
+    def test_async_timeout_does_not_cancel_shared_future(self):
+        coalescer = embeddings._Coalescer()
+
+        async def scenario():
+            with self.assertRaises(asyncio.TimeoutError):
+                await embeddings.aembed_text("slow", task_type="retrieval_query", model="m", timeout=0.001)
+            return await embeddings.aembed_text("next", task_type="retrieval_query", model="m", timeout=2)
+
+        with override_settings(PROJECT_EMBEDDING_COALESCE_MS=10), \
+                mock.patch("projects.embeddings._coalescer", coalescer), \
+                mock.patch("projects.embeddings.embed_texts", self._slow_embed), \
+                mock.patch("projects.embeddings.embedding_cache.get_memory", return_value=None):
+            self.assertEqual(asyncio.run(scenario()), [4.0])
+        self.assertTrue(coalescer._thread.is_alive())
+
+
+class AsyncRetrievalTests(_OfflineTestCase):
+    def test_stale_index_is_scheduled_on_orm_thread(self):
+        from asgiref.sync import async_to_sync
+
+        from .retriever import asearch_similar_docs
+
+        project = self.make_project(texts=["請假需要事先填寫假單", "加班費依照勞基法計算"])
+        threads = []
+        with override_settings(PROJECT_ANN_MIN_ROWS=1), \
+                mock.patch("projects.ann.schedule_rebuild", side_effect=lambda pk: threads.append(threading.get_ident())):
+            hits = async_to_sync(asearch_similar_docs)(project.pk, "請假", mode="vector", min_score=-1)
+        self.assertTrue(hits)
+        self.assertEqual(threads, [threading.get_ident()])
+
+
+class AsyncCrawlViewTests(TestCase):
+    def test_rejects_non_http_url(self):
+        project = LLMProject.objects.create(project_code="crawl", name="爬蟲", llm_model="gemini")
+        self.client.force_login(get_user_model().objects.create_user("crawler"))
+        with mock.patch("projects.views.async_http_client") as client:
+            response = self.client.post(
+                reverse("project_crawl_async", args=[project.pk]), {"url": "file:///etc/passwd"},
+            )
+        client.assert_not_called()
+        self.assertContains(response, "網址需以 http:// 或 https:// 開頭")
+        self.assertIn("default_depth", response.context)
+        self.assertIn("default_pages", response.context)
+
+
+# ---- 爬蟲：向量化失敗不能記下內容雜湊 ----
+class CrawlerSaveTests(_OfflineTestCase):
+    def test_failed_embedding_is_retried_on_next_crawl(self):
+        project = LLMProject.objects.create(project_code="crawl", name="爬蟲")
+        page = Page(url="https://example.com/a", final_url="https://example.com/a", depth=0,
+                    markdown="請假需要事先填寫假單", etag='"v1"', last_modified="")
+        with mock.patch("projects.embeddings._embed_remote", side_effect=RuntimeError("down")):
+            with self.assertRaises(RuntimeError):
+                save_pages(project.pk, [page])
+        doc = ProjectDocument.objects.get(project=project)
+        self.assertEqual(doc.content_hash, "")
+        self.assertEqual(doc.etag, "")
+
+        saved = save_pages(project.pk, [page])
+        doc.refresh_from_db()
+        self.assertEqual(len(saved["updated"]), 1)
+        self.assertEqual(doc.status, ProjectDocument.STATUS_READY)
+        self.assertTrue(doc.content_hash)
+        self.assertTrue(DocumentChunk.objects.filter(document=doc).exists())
+        self.assertEqual(len(save_pages(project.pk, [page])["unchanged"]), 1)
+
+
+# ---- 串流 ZIP ----
+class StreamZipTests(SimpleTestCase):
+    def test_round_trip_and_zip64_headers(self):
+        big = [b"x" * 1000 for _ in range(200)]
+        parts = list(stream_zip([("a.txt", ["哈囉", "world"]), ("b.bin", big)], flush_bytes=4096))
+        self.assertGreater(len(parts), 1)  # 邊壓縮邊送出
+        data = b"".join(parts)
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("a.txt").decode(), "哈囉world")
+            self.assertEqual(zf.read("b.bin"), b"".join(big))
+        # 大小未知：local header 一律為 ZIP64（解壓版本 4.5）
+        self.assertEqual(data[:4], b"PK\x03\x04")
+        self.assertEqual(int.from_bytes(data[4:6], "little"), 45)
+
+
+# ---- 專案包匯出／匯入 ----
+class BundleTests(_OfflineTestCase):
+    def test_round_trip_keeps_chunks_and_vectors(self):
+        project = self.make_project(code="src", texts=["請假需要事先填寫假單", "加班費依照勞基法計算"])
+        data = b"".join(export_stream(project))
+        copy, counts = import_bundle(io.BytesIO(data), project_code="dst")
+
+        def snapshot(p):
+            return sorted(
+                (c.document.filename, c.chunk_index, c.content, c.embedding.tobytes())
+                for c in DocumentChunk.objects.filter(project=p).select_related("document")
+            )
+
+        self.assertEqual(counts["chunks"], DocumentChunk.objects.filter(project=project).count())
+        self.assertEqual(snapshot(copy), snapshot(project))
+        self.assertTrue(lexical.search(copy.pk, "加班費"))
+
+    def test_duplicate_project_code_is_rejected(self):
+        from .bundle import BundleError
+
+        project = self.make_project(code="dup", texts=["內容"])
+        data = b"".join(export_stream(project))
+        with self.assertRaises(BundleError):
+            import_bundle(io.BytesIO(data))
+
+    def _rewrite(self, data, drop=(), replace=None):
+        """複製專案包，去掉 drop 內的檔案、以 replace 覆蓋檔案內容"""
+        out = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(data)) as src, zipfile.ZipFile(out, "w") as dst:
+            for name in src.namelist():
+                if name not in drop:
+                    dst.writestr(name, (replace or {}).get(name, src.read(name)))
+        out.seek(0)
+        return out
+
+    def test_missing_entry_is_rejected(self):
+        from .bundle import BundleError
+
+        data = b"".join(export_stream(self.make_project(code="src", texts=["內容"])))
+        with self.assertRaisesMessage(BundleError, "chunks.jsonl"):
+            import_bundle(self._rewrite(data, drop={"chunks.jsonl"}), project_code="dst")
+        self.assertFalse(LLMProject.objects.filter(project_code="dst").exists())
+
+    def test_chunk_of_missing_document_is_rejected(self):
+        from .bundle import BundleError
+
+        data = b"".join(export_stream(self.make_project(code="src", texts=["內容"])))
+        bad = self._rewrite(data, replace={"documents.jsonl": b""})
+        with self.assertRaisesMessage(BundleError, "不存在的文件"):
+            import_bundle(bad, project_code="dst")
+        self.assertFalse(LLMProject.objects.filter(project_code="dst").exists())
+
+    def test_malformed_json_is_rejected(self):
+        from .bundle import BundleError
+
+        data = b"".join(export_stream(self.make_project(code="src", texts=["內容"])))
+        with self.assertRaisesMessage(BundleError, "第 1 行"):
+            import_bundle(self._rewrite(data, replace={"documents.jsonl": b"{not json\n"}), project_code="dst")
+        with self.assertRaises(BundleError):
+            import_bundle(self._rewrite(data, replace={"project.json": b'{"format": "csw-project-bundle"}'}))
+
+
+# ---- 批次匯入：去重與上傳檔清理 ----
+class BulkImportTests(_OfflineTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, True)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_single_import_is_deduplicated_and_unused_uploads_removed(self):
+        project = LLMProject.objects.create(project_code="bulk", name="批次")
+        doc = ProjectDocument.objects.create(project=project, filename="one.txt", content="同樣的內容")
+        jobs.enqueue("import_document", {"document_id": doc.pk})
+        jobs.run_job(jobs.claim_next("w", ["import_document"]))
+        doc.refresh_from_db()
+        self.assertTrue(doc.content_hash)
+
+        names = [
+            default_storage.save(name, ContentFile(text.encode()))
+            for name, text in [("dup.txt", "同樣的內容"), ("new.txt", "新的內容"), ("empty.txt", " "), ("x.exe", "x")]
+        ]
+        report = run_bulk_import(project.pk, files=[{"name": n, "storage": n} for n in names])
+        self.assertEqual(report["created"], 1)
+        self.assertEqual([d["name"] for d in report["duplicates"]], ["dup.txt"])
+        self.assertEqual(
+            {n: default_storage.exists(n) for n in names},
+            {"dup.txt": False, "new.txt": True, "empty.txt": False, "x.exe": False},
+        )
+
+
+# ---- 指標 ----
+class MetricsTests(TestCase):
+    def test_unknown_methods_share_one_label(self):
+        from .metrics import VIEW_SECONDS
+
+        before = VIEW_SECONDS.snapshot(view="unmatched", method="other", status="4xx")[1]
+        Client().generic("BREW", "/no-such-page/")
+        Client().generic("PROPFIND", "/no-such-page/")
+        self.assertEqual(VIEW_SECONDS.snapshot(view="unmatched", method="other", status="4xx")[1], before + 2)
+
+    def test_swallowed_errors_are_logged_and_counted(self):
+        from .metrics import ERRORS
+        from .retriever import compute_embedding
+
+        before = ERRORS.value(component="retriever")
+        with mock.patch("projects.retriever.embed_text", side_effect=RuntimeError("quota")), \
+                self.assertLogs("projects.retriever", "WARNING") as logs:
+            self.assertEqual(compute_embedding("文字"), [])
+        self.assertIn("quota", logs.output[0])
+        self.assertEqual(ERRORS.value(component="retriever"), before + 1)
+
+
+# ---- 專案搜尋（FTS5 + keyset 分頁）----
+class ProjectSearchTests(TestCase):
+    def test_keyset_paging_covers_all_results_once(self):
+        for i in range(7):
+            LLMProject.objects.create(project_code=f"hr{i:02d}", name=f"人資助理 {i}")
+        LLMProject.objects.create(project_code="it01", name="資訊助理")
+        seen, cursor = [], None
+        while True:
+            projects, total, cursor = project_search.search_projects("人資", cursor=cursor, limit=3)
+            seen.extend(p.pk for p in projects)
+            if cursor is None:
+                break
+        self.assertEqual(total, 7)
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_prefix_match_and_index_follows_edits(self):
+        project = LLMProject.objects.create(project_code="abc123", name="舊名稱")
+        self.assertEqual([p.pk for p in project_search.search_projects("abc")[0]], [project.pk])
+        project.name = "新名稱"
+        project.save()
+        self.assertEqual(project_search.search_projects("新名稱")[1], 1)
+        project.delete()
+        self.assertEqual(project_search.search_projects("abc")[1], 0)
+
+
+# ---- 圖片快取 ----
+class ImageCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        override = override_settings(PROJECT_IMAGE_CACHE_DIR=self.cache_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_repeated_prompt_is_generated_once(self):
+        with mock.patch("projects.image_cache.call_gemini_image", return_value=(b"png", "image/png")) as gen:
+            first = image_cache.get_or_generate("貓")
+            second = image_cache.get_or_generate("貓")
+        self.assertEqual(gen.call_count, 1)
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(first.path, second.path)
+
+    def test_directory_scanned_only_when_over_budget(self):
+        # 上限 2500 bytes：前兩張只累加，第三張超過上限才掃描並淘汰最舊的
+        with override_settings(PROJECT_IMAGE_CACHE_MAX_MB=2500 / 1024 / 1024), \
+                mock.patch("projects.image_cache.evict", wraps=image_cache.evict) as evict:
+            first = image_cache.put("a" * 64, b"x" * 1000, "image/png")
+            os.utime(first.path, (1, 1))
+            image_cache.put("b" * 64, b"x" * 1000, "image/png")
+            self.assertEqual(evict.call_count, 1)  # 第一次寫入時掃描一次，之後只累加
+            image_cache.put("c" * 64, b"x" * 1000, "image/png")
+            self.assertEqual(evict.call_count, 2)
+        self.assertFalse(first.path.exists())
+        self.assertEqual(image_cache._usage["bytes"], 2000)
+
+    def test_cancelled_async_waiter_does_not_fail_owner(self):
+        async def slow(prompt, model=None, params=None):
+            await asyncio.sleep(0.1)
+            return b"png", "image/png"
+
+        async def scenario():
+            owner = asyncio.create_task(image_cache.aget_or_generate("狗"))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.create_task(image_cache.aget_or_generate("狗"))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            return await owner, waiter
+
+        with mock.patch("projects.image_cache.acall_gemini_image", slow):
+            image, waiter = asyncio.run(scenario())
+        self.assertTrue(waiter.cancelled())
+        self.assertTrue(image.path.is_file())
+
+    def test_sync_waiter_times_out(self):
+        key = image_cache.make_key("卡住")
+        fut, owner = image_cache._claim(key)
+        self.assertTrue(owner)
+        self.addCleanup(image_cache._release, key, fut, None, RuntimeError("cleanup"))
+        with self.assertRaises(TimeoutError):
+            image_cache.get_or_generate("卡住", timeout=0.01)
+
+    def test_release_ignores_cancelled_future(self):
+        fut = Future()
+        fut.cancel()
+        image_cache._release("k", fut, result="image")  # 不應 raise
+
+
+class ImageServingTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        override = override_settings(PROJECT_IMAGE_CACHE_DIR=cache_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.data = bytes(range(256)) * 4
+        self.image = image_cache.put(image_cache.make_key("p"), self.data, "image/png")
+        self.client = Client()
+        self.client.force_login(get_user_model().objects.create_user("viewer"))
+
+    def content(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_full_and_etag(self):
+        response = self.client.get(self.image.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), self.data)
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(self.image.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_ranges(self):
+        response = self.client.get(self.image.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.data)}")
+        self.assertEqual(self.content(response), self.data[10:20])
+
+        response = self.client.get(self.image.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(self.content(response), self.data[-5:])
+
+        response = self.client.get(self.image.url, HTTP_RANGE=f"bytes={len(self.data)}-")
+        self.assertEqual(response.status_code, 416)
+
+    def test_unknown_file(self):
+        self.assertEqual(self.client.get(reverse("project_image", args=["passwd.png"])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("project_image", args=["0" * 64 + ".png"])).status_code, 404)
+
+
+# ---- 非同步圖片工作 ----
+class ImageJobTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        override = override_settings(PROJECT_IMAGE_CACHE_DIR=cache_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = get_user_model().objects.create_user("painter")
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_submit_run_and_poll(self):
+        response = self.client.post(reverse("project_image_jobs"), {"img_prompt": ["海", "山", "海"]})
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        self.assertEqual([j["prompt"] for j in data["jobs"]], ["海", "山"])
+
+        with mock.patch("projects.image_cache.call_gemini_image", return_value=(b"png", "image/png")):
+            while (job := jobs.claim_next("w")) is not None:
+                jobs.run_job(job)
+        status = self.client.get(data["status_url"]).json()
+        self.assertTrue(status["finished"])
+        self.assertTrue(all(j["image_url"] for j in status["jobs"]))
+
+        # 其他使用者查不到
+        other = Client()
+        other.force_login(get_user_model().objects.create_user("other"))
+        self.assertEqual(other.get(data["status_url"]).json()["jobs"], [])
+
+        # 已快取的提示詞直接完成
+        again = self.client.post(reverse("project_image_jobs"), {"img_prompt": ["海"]}).json()
+        self.assertEqual(again["jobs"][0]["status"], BackgroundJob.STATUS_DONE)
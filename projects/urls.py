@@ -10,14 +10,30 @@ urlpatterns = [
     # 新增這兩條
     path("edit/<int:pk>/test", views.project_test, name="project_test"),         # popup HTML
     path("edit/<int:pk>/test_api", views.project_test_api, name="project_test_api"), # POST -> JSON
+    path("edit/<int:pk>/test_stream", views.project_test_stream_api, name="project_test_stream_api"), # POST -> SSE
     path("edit/<int:pk>/generate_image", views.project_generate_image_api, name="project_generate_image_api"),
+    path("images/<str:filename>", views.project_image, name="project_image"),  # 快取的生成圖片
+    path("image_jobs/", views.project_image_jobs, name="project_image_jobs"),  # 非同步圖片生成（可一次多張）
+    path("image_jobs/status/", views.project_image_jobs_status, name="project_image_jobs_status"),
+    path("image_jobs/events/", views.project_image_jobs_events, name="project_image_jobs_events"),
     path('edit/<int:pk>/import/', views.project_import, name='project_import'),
+    path('edit/<int:pk>/import/status/', views.project_import_status, name='project_import_status'),
+    path('edit/<int:pk>/import/bulk/<int:job_pk>/status/', views.project_import_bulk_status, name='project_import_bulk_status'),
     path('edit/<int:pk>/import/<int:doc_pk>/', views.project_import_detail, name='project_import_detail'),
     path('edit/<int:pk>/import/<int:doc_pk>/delete/', views.project_import_delete, name='project_import_delete'),
     path("publish/", views.project_publish, name="project_publish"),
+    path("search/suggest/", views.project_search_suggest, name="project_search_suggest"),  # 自動完成 JSON
+    path("metrics", views.project_metrics, name="project_metrics"),  # Prometheus（限 staff）
     path('edit/<int:pk>/export_sql/', views.project_export_sql, name='project_export_sql'),
     path('edit/<int:pk>/export_project_sql/', views.project_export_project_sql, name='project_export_project_sql'),
+    path('edit/<int:pk>/export_bundle/', views.project_export_bundle, name='project_export_bundle'),
+    path('publish/import_bundle/', views.project_import_bundle, name='project_import_bundle'),
     path('edit/<int:pk>/export_example_html/', views.project_export_example_html, name='project_export_example_html'),
     path('edit/<int:pk>/crawl/', views.project_crawl, name='project_crawl'),
+    path('edit/<int:pk>/crawl/<int:job_pk>/status/', views.project_crawl_status, name='project_crawl_status'),
+    # async 版本（ASGI 部署時使用）
+    path("edit/<int:pk>/test_api_async", views.project_test_api_async, name="project_test_api_async"),
+    path("edit/<int:pk>/generate_image_async", views.project_generate_image_api_async, name="project_generate_image_api_async"),
+    path('edit/<int:pk>/crawl_async/', views.project_crawl_async, name='project_crawl_async'),
 
 ]
\ No newline at end of file
@@ -0,0 +1,267 @@
+"""
+專案向量矩陣快取（每個 process 一份）
+
+把同一專案的所有向量整理成一個連續、已正規化的 float32 矩陣，
+查詢時只要做一次矩陣 × 向量即可得到所有 cosine 分數，
+不必每次都從 DB 撈出 JSON 再逐筆解析、逐筆計算。
+
+- 快取以 LRU 淘汰，總大小受 settings.PROJECT_VECTOR_CACHE_MAX_BYTES 限制
+- DocumentChunk 新增/修改/刪除時由 signals 呼叫 invalidate()
+- 片段可能由其他 process（背景 worker）寫入，signals 通知不到；
+  因此取用前會比對片段的 (筆數, 最大 id)，不同就重建。這個比對要查一次 DB，
+  同一專案每 settings.PROJECT_VECTOR_CACHE_CHECK_SECONDS 秒（預設 10）最多做一次，
+  其他 process 寫入的片段最晚這麼久之後才查得到；設為 0 則每次取用都比對
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .vectors import unpack_vector
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_CHECK_SECONDS = 10
+
+
+class ProjectMatrix:
+    """
+    單一專案的向量矩陣：
+      ids    : np.int64 陣列，第 i 列對應的 DocumentChunk.id
+      matrix : (n, dim) float32，每列已正規化成單位向量
+      row_of : {id: 列號}
+    """
+
+    def __init__(self, ids: np.ndarray, matrix: np.ndarray):
+        self.ids = ids
+        self.matrix = matrix
+        self.row_of = {int(i): r for r, i in enumerate(ids)}
+        self.fingerprint = None
+        # ANN 索引附加在此矩陣上的資料（見 ann.search）
+        self.ann_state = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.matrix.nbytes + self.ids.nbytes)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        rows: 可迭代的 (id, vector)，vector 可為 list / np.ndarray / JSON 字串
+        維度和第一筆不同、或長度為 0 的向量會被略過
+        """
+        ids, vecs = [], []
+        dim = None
+        for doc_id, emb in rows:
+            if isinstance(emb, str):
+                try:
+                    emb = json.loads(emb)
+                except Exception:
+                    continue
+            if emb is None or len(emb) == 0:
+                continue
+            vec = np.asarray(emb, dtype=np.float32)
+            if vec.ndim != 1:
+                continue
+            if dim is None:
+                dim = vec.shape[0]
+            elif vec.shape[0] != dim:
+                continue
+            ids.append(doc_id)
+            vecs.append(vec)
+
+        if not vecs:
+            return cls(np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32))
+
+        matrix = np.ascontiguousarray(np.vstack(vecs), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        keep = norms > 0
+        matrix = matrix[keep] / norms[keep, None]
+        ids = np.asarray(ids, dtype=np.int64)[keep]
+        return cls(ids, np.ascontiguousarray(matrix))
+
+    def top_k(self, q_vec, k: int = 3, min_score: float = 0.0, rows=None):
+        """
+        回傳 [(id, score), ...]，依分數由高到低
+        rows：只在這些列（np 索引陣列）中找，給 ANN 索引縮小候選範圍用；None 表示全部
+        """
+        if len(self) == 0 or k <= 0:
+            return []
+        q = np.asarray(q_vec, dtype=np.float32).ravel()
+        if q.shape[0] != self.dim:
+            return []
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return []
+
+        if rows is None:
+            rows = np.arange(len(self))
+            scores = self.matrix @ (q / q_norm)
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            scores = self.matrix[rows] @ (q / q_norm)
+
+        n = len(rows)
+        if n == 0:
+            return []
+        if k < n:
+            idx = np.argpartition(-scores, k - 1)[:k]
+        else:
+            idx = np.arange(n)
+        idx = idx[np.argsort(-scores[idx], kind="stable")]
+
+        return [
+            (int(self.ids[rows[i]]), float(scores[i]))
+            for i in idx
+            if scores[i] >= min_score
+        ]
+
+
+class ProjectMatrixCache:
+    """
+    以 project_id 為 key 的 LRU 快取；超過 max_bytes 時從最久未使用的專案開始淘汰
+    """
+
+    def __init__(self, loader, max_bytes: int = None, fingerprint=None, check_seconds: float = None):
+        self._loader = loader
+        self._fingerprint = fingerprint
+        self._max_bytes = max_bytes
+        self._check_seconds = check_seconds
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._generation = {}
+        self._checked = {}
+        self._lock = threading.RLock()
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return getattr(settings, "PROJECT_VECTOR_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+
+    @property
+    def check_seconds(self) -> float:
+        if self._check_seconds is not None:
+            return self._check_seconds
+        return getattr(settings, "PROJECT_VECTOR_CACHE_CHECK_SECONDS", DEFAULT_CHECK_SECONDS)
+
+    @property
+    def current_bytes(self) -> int:
+        return self._bytes
+
+    def __contains__(self, project_id):
+        return project_id in self._items
+
+    def fingerprint(self, project_id: int):
+        """片段指紋；同一專案在 check_seconds 內沿用上次的結果，不重查 DB"""
+        if self._fingerprint is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(project_id)
+            if checked is not None and now - checked[1] < self.check_seconds:
+                return checked[0]
+            generation = self._generation.get(project_id, 0)
+
+        fp = self._fingerprint(project_id)
+        with self._lock:
+            # 查詢期間被 invalidate 的話，這個指紋可能是異動前的，不記下來
+            if self._generation.get(project_id, 0) == generation:
+                self._checked[project_id] = (fp, now)
+        return fp
+
+    def get(self, project_id: int) -> ProjectMatrix:
+        fp = self.fingerprint(project_id)
+        with self._lock:
+            pm = self._items.get(project_id)
+            if pm is not None and pm.fingerprint == fp:
+                self._items.move_to_end(project_id)
+                return pm
+            generation = self._generation.get(project_id, 0)
+
+        # 在鎖外載入，避免一個大專案卡住其他專案的查詢
+        pm = self._loader(project_id)
+        pm.fingerprint = fp
+
+        with self._lock:
+            # 載入期間若被 invalidate，這份結果可能已過期，只回傳不快取
+            if self._generation.get(project_id, 0) != generation:
+                return pm
+            self._discard(project_id)
+            if pm.nbytes <= self.max_bytes:
+                self._items[project_id] = pm
+                self._bytes += pm.nbytes
+                self._evict()
+        return pm
+
+    def invalidate(self, project_id: int):
+        with self._lock:
+            self._generation[project_id] = self._generation.get(project_id, 0) + 1
+            self._checked.pop(project_id, None)
+            self._discard(project_id)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._checked.clear()
+            self._bytes = 0
+
+    def _discard(self, project_id):
+        old = self._items.pop(project_id, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._items:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= old.nbytes
+
+
+def load_project_matrix(project_id: int) -> ProjectMatrix:
+    from .models import DocumentChunk
+
+    rows = (
+        DocumentChunk.objects
+        .filter(project_id=project_id, embedding_vector__isnull=False)
+        .order_by("id")
+        .values_list("id", "embedding_vector", "embedding_dim", "embedding_dtype")
+        .iterator()
+    )
+    return ProjectMatrix.from_rows(
+        (doc_id, unpack_vector(data, dim, dtype or None))
+        for doc_id, data, dim, dtype in rows
+    )
+
+
+def project_fingerprint(project_id: int):
+    """片段的 (筆數, 最大 id)；重建片段一定會產生新 id，刪除會改變筆數"""
+    from django.db.models import Count, Max
+    from .models import DocumentChunk
+
+    agg = DocumentChunk.objects.filter(project_id=project_id).aggregate(n=Count("id"), last=Max("id"))
+    return agg["n"], agg["last"]
+
+
+matrix_cache = ProjectMatrixCache(load_project_matrix, fingerprint=project_fingerprint)
+
+
+def get_project_matrix(project_id: int) -> ProjectMatrix:
+    return matrix_cache.get(project_id)
+
+
+def corpus_fingerprint(project_id: int):
+    """目前的片段指紋（快取版，見 ProjectMatrixCache.fingerprint）"""
+    return matrix_cache.fingerprint(project_id)
+
+
+def invalidate_project(project_id: int):
+    matrix_cache.invalidate(project_id)
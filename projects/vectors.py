@@ -0,0 +1,49 @@
+"""
+向量的二進位存放格式
+
+ProjectDocument 的向量以 float32（或 float16）原始 bytes 存在 BinaryField，
+另外記錄維度與 dtype；讀回時用 np.frombuffer 直接包成 ndarray，不需複製或解析文字。
+"""
+import numpy as np
+from django.conf import settings
+
+SUPPORTED_DTYPES = ("float32", "float16")
+DEFAULT_DTYPE = "float32"
+
+
+def storage_dtype() -> str:
+    dtype = getattr(settings, "PROJECT_EMBEDDING_DTYPE", DEFAULT_DTYPE)
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"不支援的向量型別：{dtype}（可用：{', '.join(SUPPORTED_DTYPES)}）")
+    return dtype
+
+
+def pack_vector(vec, dtype: str = None):
+    """
+    list / ndarray → (bytes, dim, dtype)
+    空向量或 None 回傳 (None, None, "")
+    """
+    if vec is None:
+        return None, None, ""
+    arr = np.asarray(vec)
+    if arr.size == 0:
+        return None, None, ""
+    if arr.ndim != 1:
+        raise ValueError(f"向量必須是一維，收到 shape={arr.shape}")
+    dtype = dtype or storage_dtype()
+    # 固定以 little-endian 存放，不同機器讀回來結果一致
+    data = arr.astype(np.dtype(dtype).newbyteorder("<"), copy=False).tobytes()
+    return data, int(arr.shape[0]), dtype
+
+
+def unpack_vector(data, dim=None, dtype: str = None):
+    """
+    (bytes, dim, dtype) → 唯讀的一維 ndarray（zero-copy）；沒有資料回傳 None
+    """
+    if data is None:
+        return None
+    dtype = dtype or DEFAULT_DTYPE
+    arr = np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder("<"))
+    if dim is not None and arr.shape[0] != dim:
+        raise ValueError(f"向量長度 {arr.shape[0]} 與紀錄的維度 {dim} 不符")
+    return arr
@@ -1,24 +1,42 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from .forms import LLMProjectForm
-from .models import LLMProject, ProjectDocument
-from django.db.models import Q
-from django.http import JsonResponse, HttpResponse
+from .models import BackgroundJob, LLMProject, ProjectDocument
+from django.http import FileResponse, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.template.loader import render_to_string
 import re
-import requests
-from requests.exceptions import SSLError
-from bs4 import BeautifulSoup
 import os
+import logging
 import io
 import json
+import hmac
+import time
 import zipfile
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.shortcuts import aget_object_or_404
+from django.urls import reverse
 from django.utils import timezone
-import google.generativeai as genai
-from .llm import call_gemini, call_gemini_image
-from .retriever import search_similar_docs
-
+from urllib.parse import urlparse
+from .llm import (
+    call_gemini, stream_gemini, FALLBACK_ANSWER,
+    acall_gemini, async_http_client,
+)
+from . import answer_cache, image_cache, image_jobs, metrics
+from .retriever import search_similar_docs, asearch_similar_docs
+from .indexing import index_document
+from .jobs import enqueue
+from .chunking import split_text
+from .embeddings import aembed_texts
+from .extraction import html_to_markdown
+from .streaming import stream_zip
+from . import bundle, project_search
+from .bulk_import import is_archive
+from .crawler import CRAWL_HEADERS, DEFAULT_MAX_DEPTH, DEFAULT_MAX_PAGES, Page, normalize_url, save_pages
+
+logger = logging.getLogger(__name__)
 
 
 @login_required
@@ -32,21 +50,17 @@ def project_test(request, pk):
     examples = [line.strip() for line in examples_raw.splitlines() if line.strip()]
     return render(request, "projects/project_test.html", {"obj": obj, "examples": examples})
 
-@require_POST
-@login_required
-def project_test_api(request, pk):
+def _prepare_test(obj, question):
     """
-    AJAX endpoint：接收 question，回傳 JSON
-    先用向量檢索找出相關資料，再交給 Gemini 回答
+    project_test_api / project_test_stream_api 共用：檢索片段並組出 (hits, context_text, role_prompt)
     """
-    obj = get_object_or_404(LLMProject, pk=pk)
-    question = (request.POST.get("question") or "").strip()
-    if not question:
-        return JsonResponse({"error": "請輸入問題"}, status=400)
-
     # 1) 檢索最相近的知識片段
-    hits = search_similar_docs(project_id=obj.id, question=question, top_k=3)
+    with metrics.span("retrieve"):
+        hits = search_similar_docs(project_id=obj.id, question=question, top_k=3)
+    return (hits,) + _build_context(obj, hits)
+
 
+def _build_context(obj, hits):
     # 2) 把片段串成 context（可加上來源標號，方便你前端顯示）
     if hits:
         context_text = "\n\n".join([f"[{i+1}] {h['text']}" for i, h in enumerate(hits)])
@@ -56,9 +70,33 @@ def project_test_api(request, pk):
     # 3) 角色指令（維持你的設定，也可加上口吻/格式要求）
     # role_prompt = "你是一位專業的人事問答助理。請優先依據已知資料回答，必要時再補充一般常識。"
     role_prompt =  obj.role_prompt+' '+obj.response_template 
+    return context_text, role_prompt
+
+
+@require_POST
+@login_required
+def project_test_api(request, pk):
+    """
+    AJAX endpoint：接收 question，回傳 JSON
+    先用向量檢索找出相關資料，再交給 Gemini 回答
+    """
+    obj = get_object_or_404(LLMProject, pk=pk)
+    question = (request.POST.get("question") or "").strip()
+    if not question:
+        return JsonResponse({"error": "請輸入問題"}, status=400)
+
+    # 0) 同專案、同提示詞設定、同（或語意相近的）問題，直接用快取的回答
+    cache_key = answer_cache.make_key(obj, question)
+    cached = answer_cache.get(cache_key)
+    if cached is not None:
+        return JsonResponse({'answer': cached.answer, 'sources': cached.sources, 'cached': True})
+
+    hits, context_text, role_prompt = _prepare_test(obj, question)
 
     # 4) 呼叫 LLM
-    answer = call_gemini(role_prompt, question, context=context_text)
+    answer = call_gemini(role_prompt, question, context=context_text, llm_model=obj.llm_model)
+    if answer != FALLBACK_ANSWER:
+        answer_cache.put(cache_key, answer, hits)
 
     # 5) 回傳答案 +（可選）回傳命中的片段與分數，方便前端顯示/除錯
     return JsonResponse({
@@ -67,11 +105,59 @@ def project_test_api(request, pk):
     })
 
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@require_POST
+@login_required
+def project_test_stream_api(request, pk):
+    """
+    串流版 project_test_api（Server-Sent Events）
+    事件順序：sources（命中片段）→ token（逐段文字）… → done；失敗時送 error
+    """
+    obj = get_object_or_404(LLMProject, pk=pk)
+    question = (request.POST.get("question") or "").strip()
+    if not question:
+        return JsonResponse({"error": "請輸入問題"}, status=400)
+
+    def events():
+        try:
+            cache_key = answer_cache.make_key(obj, question)
+            cached = answer_cache.get(cache_key)
+            if cached is not None:
+                yield _sse("sources", cached.sources)
+                yield _sse("token", {"text": cached.answer})
+                yield _sse("done", {"cached": True})
+                return
+
+            hits, context_text, role_prompt = _prepare_test(obj, question)
+            yield _sse("sources", hits)
+            parts = []
+            for text in stream_gemini(role_prompt, question, context=context_text, llm_model=obj.llm_model):
+                parts.append(text)
+                yield _sse("token", {"text": text})
+        except Exception:
+            logger.exception("串流回答發生錯誤")
+            metrics.ERRORS.inc(component="stream_answer")
+            yield _sse("error", {"error": FALLBACK_ANSWER})
+            return
+        if parts:
+            answer_cache.put(cache_key, "".join(parts), hits)
+        yield _sse("done", {})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream; charset=utf-8")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # 關閉 nginx 緩衝，token 才能即時送達
+    return response
+
+
 @require_POST
 @login_required
 def project_generate_image_api(request, pk):
     """
-    依據前端送來的 img_prompt 產生一張圖片，回傳 base64（data URL）。
+    依據前端送來的 img_prompt 產生一張圖片，回傳圖片網址（{'image_url', 'content_type', 'cached'}）。
+    相同的提示詞與參數直接取用快取，不再重新生成。
     """
     _ = get_object_or_404(LLMProject, pk=pk)
     img_prompt = (request.POST.get('img_prompt') or '').strip()
@@ -79,20 +165,174 @@ def project_generate_image_api(request, pk):
         return JsonResponse({'error': '缺少 img_prompt'}, status=400)
 
     try:
-        img_bytes, mime_type = call_gemini_image(img_prompt)
-
-        import base64
-        b64 = base64.b64encode(img_bytes).decode('ascii')
-        return JsonResponse({'image_base64': b64, 'content_type': mime_type})
-
-        # 前端可直接使用 data:image/png;base64,<b64>
-        #return JsonResponse({'image_base64': b64, 'content_type': 'image/png'})
+        image = image_cache.get_or_generate(img_prompt, params=_image_params(request.POST))
     except Exception as e:
         return JsonResponse({'error': f'圖片生成失敗：{e}'}, status=500)
+    return JsonResponse({'image_url': image.url, 'content_type': image.content_type, 'cached': image.cached})
 
 
+IMAGE_ASPECT_RATIOS = ("1:1", "3:4", "4:3", "9:16", "16:9")
 
 
+def _image_params(data):
+    """前端可選的圖片參數（目前只有 aspect_ratio）；不在清單內的值忽略"""
+    aspect_ratio = str(data.get('aspect_ratio') or '').strip()
+    return {'aspectRatio': aspect_ratio} if aspect_ratio in IMAGE_ASPECT_RATIOS else None
+
+
+@require_POST
+@login_required
+def project_image_jobs(request):
+    """
+    送出一個或多個提示詞，立即回傳工作 id（HTTP 202），圖片由背景 worker 生成
+    表單：img_prompt（可重複）、aspect_ratio；或 JSON：{"prompts": [...], "aspect_ratio": "16:9"}
+    回傳 {'jobs': [...], 'status_url', 'events_url'}；之後輪詢 status_url 或以 EventSource 連 events_url
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'JSON 格式錯誤'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'JSON 格式錯誤'}, status=400)
+        prompts = data.get('prompts') or []
+        if isinstance(prompts, str):
+            prompts = [prompts]
+    else:
+        data = request.POST
+        prompts = data.getlist('img_prompt')
+    # 去掉空白與重複（相同條件只會得到同一張圖）
+    prompts = list(dict.fromkeys(str(p).strip() for p in prompts if str(p).strip()))
+    if not prompts:
+        return JsonResponse({'error': '缺少 img_prompt'}, status=400)
+    if len(prompts) > image_jobs.max_prompts():
+        return JsonResponse({'error': f'一次最多 {image_jobs.max_prompts()} 個提示詞'}, status=400)
+
+    jobs = image_jobs.submit(prompts, user_id=request.user.id, params=_image_params(data))
+    ids = ','.join(str(job.pk) for job in jobs)
+    return JsonResponse({
+        'jobs': [image_jobs.job_state(job) for job in jobs],
+        'status_url': f"{reverse('project_image_jobs_status')}?ids={ids}",
+        'events_url': f"{reverse('project_image_jobs_events')}?ids={ids}",
+    }, status=202)
+
+
+def _job_ids(request):
+    ids = []
+    for part in request.GET.get('ids', '').split(','):
+        part = part.strip()
+        if part.isdigit() and int(part) not in ids:
+            ids.append(int(part))
+    return ids[:100]
+
+
+@login_required
+def project_image_jobs_status(request):
+    """輪詢用：?ids=1,2,3 → {'jobs': [...], 'finished': 全部完成（或失敗）與否}"""
+    jobs = image_jobs.states(request.user.id, _job_ids(request))
+    return JsonResponse({
+        'jobs': jobs,
+        'finished': all(job['status'] in image_jobs.FINISHED for job in jobs),
+    })
+
+
+@login_required
+def project_image_jobs_events(request):
+    """
+    Server-Sent Events 版 project_image_jobs_status：每張圖完成（或失敗）時送出一個 image 事件，全部結束送 done
+    超過 PROJECT_IMAGE_JOB_STREAM_TIMEOUT 秒仍未完成時送 timeout（附上未完成的 id），前端可改用輪詢
+    每個連線在等待期間佔用一個 worker thread；以 WSGI 部署、同時使用者多時請改用 status 輪詢
+    """
+    user_id = request.user.id
+    ids = _job_ids(request)
+    poll = getattr(settings, 'PROJECT_IMAGE_JOB_POLL_SECONDS', image_jobs.DEFAULT_POLL_SECONDS)
+    timeout = getattr(settings, 'PROJECT_IMAGE_JOB_STREAM_TIMEOUT', image_jobs.DEFAULT_STREAM_TIMEOUT)
+
+    def events():
+        sent = set()
+        deadline = time.monotonic() + timeout
+        last_write = time.monotonic()
+        while True:
+            jobs = image_jobs.states(user_id, ids)
+            for job in jobs:
+                if job['status'] in image_jobs.FINISHED and job['id'] not in sent:
+                    sent.add(job['id'])
+                    last_write = time.monotonic()
+                    yield _sse("image", job)
+            pending = [job['id'] for job in jobs if job['id'] not in sent]
+            if not pending:
+                yield _sse("done", {})
+                return
+            if time.monotonic() >= deadline:
+                yield _sse("timeout", {"pending": pending})
+                return
+            if time.monotonic() - last_write > 15:
+                # 註解行當作 keep-alive，避免 proxy 把閒置連線切斷
+                last_write = time.monotonic()
+                yield ": keep-alive\n\n"
+            time.sleep(poll)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream; charset=utf-8")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+@login_required
+def project_image(request, filename):
+    """
+    快取的生成圖片（/project/images/<key>.png）
+    檔名由生成條件的雜湊決定、內容不會改變，因此可長期快取；支援 ETag（304）與單一 Range（206）
+    """
+    found = image_cache.resolve(filename)
+    if found is None:
+        return HttpResponse('not found', status=404, content_type='text/plain; charset=utf-8')
+    path, content_type = found
+    etag = f'"{filename.split(".")[0]}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Accept-Ranges': 'bytes',
+    }
+    if etag in [t.strip() for t in request.headers.get('If-None-Match', '').split(',')]:
+        return HttpResponse(status=304, headers=headers)
+
+    size = path.stat().st_size
+    start, end = 0, size - 1
+    m = _RANGE_RE.match(request.headers.get('Range', '').replace(' ', ''))
+    # If-Range 與目前 ETag 不同時忽略 Range，回傳完整檔案
+    if m and request.headers.get('If-Range', etag) == etag and (m.group(1) or m.group(2)):
+        if m.group(1):
+            start = int(m.group(1))
+            end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+        else:
+            start = max(size - int(m.group(2)), 0)
+        if start >= size or start > end:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    length = end - start + 1
+    if length == size:
+        # 完整檔案交給 FileResponse（伺服器支援時以 sendfile 傳送）
+        return FileResponse(open(path, 'rb'), content_type=content_type, headers=headers)
+    f = open(path, 'rb')
+    f.seek(start)
+    response = StreamingHttpResponse(_read_range(f, length), status=206, content_type=content_type, headers=headers)
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def _read_range(f, length, block_size=64 * 1024):
+    with f:
+        while length > 0:
+            data = f.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
 
 
 @login_required
@@ -114,41 +354,25 @@ def project_detail(request, pk):
 # ① 先搜尋頁（/project/edit?q=關鍵字）
 @login_required
 def project_edit_search(request):
-    q = (request.GET.get("q") or "").strip()
-    if q:
-        results = (
-            LLMProject.objects
-            .filter(Q(project_code__icontains=q) | Q(name__icontains=q))
-            .order_by("project_code", "name")
-        )
-    else:
-        # ✅ 如果沒輸入，顯示全部
-        results = LLMProject.objects.all().order_by("project_code", "name")
-
-    return render(
-        request,
-        "projects/project_edit_search.html",
-        {"q": q, "results": results},
-    )
+    return render(request, "projects/project_edit_search.html", _project_search_context(request))
 # ① 先搜尋頁（/project/edit?q=關鍵字）
 @login_required
 def project_publish(request):
+    return render(request, "projects/project_publish.html", _project_search_context(request))
+
+
+def _project_search_context(request):
+    """搜尋頁共用：全文檢索（依相關度）＋ keyset 分頁；沒輸入時列出全部"""
     q = (request.GET.get("q") or "").strip()
-    if q:
-        results = (
-            LLMProject.objects
-            .filter(Q(project_code__icontains=q) | Q(name__icontains=q))
-            .order_by("project_code", "name")
-        )
-    else:
-        # ✅ 如果沒輸入，顯示全部
-        results = LLMProject.objects.all().order_by("project_code", "name")
+    cursor = request.GET.get("after") or None
+    results, total, next_cursor = project_search.search_projects(q, cursor=cursor)
+    return {"q": q, "results": results, "total": total, "next_cursor": next_cursor, "paged": bool(cursor)}
 
-    return render(
-        request,
-        "projects/project_publish.html",
-        {"q": q, "results": results},
-    )
+
+@login_required
+def project_search_suggest(request):
+    """搜尋框自動完成（/project/search/suggest?q=）"""
+    return JsonResponse({"results": project_search.suggest(request.GET.get("q", ""))})
 
 # ② 編輯頁（/project/edit/<pk>）
 @login_required
@@ -180,106 +404,6 @@ def project_edit(request, pk):
 
 
 
-# 第一步：檔案內容解析 helper
-def extract_text_from_file(file_obj, filename):
-    """根據副檔名嘗試抽出文字（簡單實作）。
-    需要的第三方套件：PyPDF2, python-docx, pandas, openpyxl
-    若缺少套件，會 raise ImportError，請按照錯誤安裝。
-    """
-    ext = os.path.splitext(filename)[1].lower()
-    file_obj.seek(0)
-
-    if ext == '.pdf':
-        try:
-            from PyPDF2 import PdfReader
-        except Exception as e:
-            raise ImportError('請安裝 PyPDF2 (pip install PyPDF2)')
-        reader = PdfReader(file_obj)
-        texts = []
-        for page in reader.pages:
-            texts.append(page.extract_text() or '')
-        return '\n'.join(texts)
-
-    if ext in ('.docx', '.doc'):
-        try:
-            import docx
-        except Exception:
-            raise ImportError('請安裝 python-docx (pip install python-docx)')
-        # docx (python-docx) 只支援 .docx
-        if ext == '.docx':
-            doc = docx.Document(file_obj)
-            paragraphs = [p.text for p in doc.paragraphs]
-            return '\n'.join(paragraphs)
-        else:
-            # .doc 的處理可用 textract 或 antiword — 這裡回傳空字串並提醒安裝對應工具
-            return ''
-
-    if ext in ('.xls', '.xlsx'):
-        try:
-            import pandas as pd
-        except Exception:
-            raise ImportError('請安裝 pandas 與 openpyxl/xlrd (pip install pandas openpyxl xlrd)')
-        # 使用 pandas 讀取所有 sheet 並串接文字
-        try:
-            # pandas can read file-like for read_excel
-            xls = pd.read_excel(file_obj, sheet_name=None)
-            parts = []
-            for sheet_name, df in xls.items():
-                parts.append(f'-- Sheet: {sheet_name} --')
-                parts.append(df.astype(str).apply(lambda row: '\t'.join(row.values), axis=1).str.cat(sep='\n'))
-            return '\n'.join(parts)
-        except Exception:
-            file_obj.seek(0)
-            return ''
-
-    if ext == '.csv':
-        try:
-            import pandas as pd
-        except Exception:
-            raise ImportError('請安裝 pandas (pip install pandas)')
-        file_obj.seek(0)
-        df = pd.read_csv(file_obj)
-        return df.astype(str).apply(lambda row: '\t'.join(row.values), axis=1).str.cat(sep='\n')
-
-    # 預設當成純文字
-    try:
-        file_obj.seek(0)
-        raw = file_obj.read()
-        # file_obj.read() 可能回傳 bytes
-        if isinstance(raw, bytes):
-            return raw.decode('utf-8', errors='ignore')
-        return str(raw)
-    except Exception:
-        return ''
-
-
-# 第二步：向量化 helper（這裡放一個 placeholder）
-def compute_embedding(text):
-    try:
-        # 1. 設定 API 金鑰
-        # 如果你使用環境變數，將 settings.GOOGLE_API_KEY 改成 os.getenv("GOOGLE_API_KEY")
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        
-        # 2. 選擇向量化模型
-        # 'models/text-embedding-004' 是 Google 推薦的向量化模型
-        model = 'models/text-embedding-004'
-        
-        # 3. 呼叫向量化模型
-        response = genai.embed_content(
-            model=model,
-            content=text,
-            task_type="retrieval_document" # 這裡設定任務類型，可以提高準確性
-        )
-        
-        # 4. 從回應中取出向量值（通常是一個列表）
-        # 'embedding' 欄位包含了我們需要的向量
-        return response['embedding']
-
-    except Exception as e:
-        print(f"向量化失敗: {e}")
-        # 如果發生錯誤，返回一個空列表或你設定的預設值
-        return []
-
 # 第三步： import page（GET 顯示上傳表單與已匯入列表；POST 處理上傳）
 @login_required
 def project_import(request, pk):
@@ -287,7 +411,8 @@ def project_import(request, pk):
 
     if request.method == 'POST':
         # 可選擇上傳檔案、手動輸入，或（可選）伺服器路徑
-        uploaded = request.FILES.get('file')
+        uploads = request.FILES.getlist('file')
+        uploaded = uploads[0] if uploads else None
         path_text = request.POST.get('path')
         action = request.POST.get('action')
         manual_title = (request.POST.get('manual_title') or '').strip()
@@ -302,14 +427,12 @@ def project_import(request, pk):
         # 優先處理手動輸入
         if action == 'manual_save' and manual_content:
             filename = manual_title or (f"manual_{timezone.now().strftime('%Y%m%d_%H%M%S')}.txt")
-            doc = ProjectDocument(project=project, imported_by=request.user)
+            doc = ProjectDocument(project=project, imported_by=request.user, status=ProjectDocument.STATUS_PENDING)
             doc.filename = filename
             doc.content = manual_content
-            try:
-                doc.embedding = compute_embedding(manual_content)
-            except Exception:
-                doc.embedding = None
             doc.save()
+            # 切段、向量化交給背景工作（manage.py run_jobs）
+            enqueue('import_document', {'document_id': doc.id})
             return redirect('project_import', pk=project.pk)
 
         if not uploaded and not path_text and not manual_content:
@@ -318,51 +441,82 @@ def project_import(request, pk):
                 'documents': project.documents.all().order_by('-imported_at')
             })
 
-        # 儲存 model
-        doc = ProjectDocument(project=project, imported_by=request.user)
+        # 多個檔案、ZIP 壓縮檔或伺服器資料夾 → 批次匯入（背景工作 bulk_import），完成後顯示摘要
+        is_directory = bool(path_text) and not uploaded and os.path.isdir(path_text)
+        if len(uploads) > 1 or (uploaded and is_archive(uploaded.name)) or is_directory:
+            job = _enqueue_bulk_import(project, request.user, uploads, path_text if is_directory else None)
+            return redirect(f"{reverse('project_import', args=[project.pk])}?bulk={job.pk}")
+
+        # 先存檔案與 model，解析與向量化交給背景工作，頁面立即返回
+        doc = ProjectDocument(project=project, imported_by=request.user, status=ProjectDocument.STATUS_PENDING)
+        payload = {}
         if uploaded:
             doc.filename = uploaded.name
             doc.uploaded_file = uploaded
-            # 立即解析內容（檔案已存在 uploaded_file），但使用 Django 上傳的 file-like
-            file_like = uploaded.file if hasattr(uploaded, 'file') else uploaded
-            try:
-                content = extract_text_from_file(file_like, uploaded.name)
-            except ImportError as e:
-                # 缺套件
-                return render(request, 'projects/project_import.html', {
-                    'project': project, 'error': str(e),
-                    'documents': project.documents.all().order_by('-imported_at')
-                })
         else:
             # 若輸入伺服器路徑（例：/data/files/doc1.pdf）
             doc.filename = os.path.basename(path_text)
-            try:
-                with open(path_text, 'rb') as f:
-                    content = extract_text_from_file(f, doc.filename)
-            except Exception as e:
+            if not os.path.isfile(path_text):
                 return render(request, 'projects/project_import.html', {
-                    'project': project, 'error': f'讀取路徑失敗：{e}',
+                    'project': project, 'error': f'讀取路徑失敗：找不到檔案 {path_text}',
                     'documents': project.documents.all().order_by('-imported_at')
                 })
-
-        # 儲存文字與 embedding
-        doc.content = content
-        try:
-            doc.embedding = compute_embedding(content)
-        except Exception:
-            doc.embedding = None
+            payload['path'] = path_text
         doc.save()
+        payload['document_id'] = doc.id
+        enqueue('import_document', payload)
 
         return redirect('project_import', pk=project.pk)
 
     # GET 顯示
     documents = project.documents.all().order_by('-imported_at')
+    bulk_id = request.GET.get('bulk')
+    bulk_job = None
+    if bulk_id and bulk_id.isdigit():
+        bulk_job = BackgroundJob.objects.filter(pk=bulk_id, kind='bulk_import', payload__project_id=project.pk).first()
     return render(request, 'projects/project_import.html', {
         'project': project,
         'documents': documents,
+        'bulk_job': bulk_job,
+    })
+
+
+def _enqueue_bulk_import(project, user, uploads, directory=None):
+    """上傳檔先存進 storage（與單檔匯入相同目錄），解析、去重、向量化交給背景工作"""
+    folder = timezone.now().strftime('project_imports/%Y/%m/%d')
+    files, archives = [], []
+    for upload in uploads:
+        stored = default_storage.save(f"{folder}/{upload.name}", upload)
+        (archives if is_archive(upload.name) else files).append({'name': upload.name, 'storage': stored})
+    return enqueue('bulk_import', {
+        'project_id': project.pk,
+        'files': files,
+        'archives': archives,
+        'directory': directory,
+        'user_id': user.pk,
     })
 
 
+# 匯入頁輪詢用：回傳文件處理狀態
+@login_required
+def project_import_status(request, pk):
+    project = get_object_or_404(LLMProject, pk=pk)
+    qs = project.documents.all()
+    ids = [int(i) for i in (request.GET.get('ids') or '').split(',') if i.strip().isdigit()]
+    if ids:
+        qs = qs.filter(id__in=ids)
+    documents = [
+        {
+            'id': d.id,
+            'status': d.status,
+            'status_display': d.get_status_display(),
+            'message': d.status_message,
+        }
+        for d in qs.only('id', 'status', 'status_message')
+    ]
+    return JsonResponse({'documents': documents})
+
+
 # 第四步： 檢視已匯入資料
 @login_required
 def project_import_detail(request, pk, doc_pk):
@@ -374,11 +528,8 @@ def project_import_detail(request, pk, doc_pk):
 
         doc.filename = new_filename or doc.filename
         doc.content = new_content
-        try:
-            doc.embedding = compute_embedding(new_content)
-        except Exception:
-            doc.embedding = None
         doc.save()
+        index_document(doc)
 
         return redirect('project_import_detail', pk=project.pk, doc_pk=doc.pk)
 
@@ -413,6 +564,9 @@ def project_export_sql(request, pk):
             return 'NULL'
         if isinstance(v, (int, float)):
             return str(v)
+        if isinstance(v, (bytes, memoryview)):
+            # 向量等二進位欄位 → BLOB 常值 X'..'
+            return f"X'{bytes(v).hex()}'"
         # 其他型別一律當成字串，做基本跳脫：單引號→兩個單引號，換行→\n
         s = v
         if not isinstance(s, str):
@@ -420,53 +574,46 @@ def project_export_sql(request, pk):
         s = s.replace("'", "''").replace("\\", "\\\\").replace("\n", r"\n").replace("\r", r"\r")
         return f"'{s}'"
 
-    rows = (
-        ProjectDocument.objects
-        .filter(project=project)
-        .order_by('id')
-        .values(
-            'id', 'project_id', 'filename', 'uploaded_file', 'content', 'embedding', 'imported_by_id', 'imported_at'
+    columns = [
+        'id', 'project_id', 'filename', 'uploaded_file', 'content',
+        'embedding_vector', 'embedding_dim', 'embedding_dtype', 'imported_by_id', 'imported_at',
+        'status', 'status_message', 'source_url', 'etag', 'last_modified', 'content_hash', 'fetched_at',
+    ]
+    datetime_columns = ('imported_at', 'fetched_at')
+
+    def sql_lines():
+        # 逐筆產生 SQL，不把整份匯出放進記憶體
+        yield '-- Exported ProjectDocument rows for project id=%d (%s)\n' % (project.id, project.project_code or project.name)
+        yield '-- Generated at %s\n' % timezone.now().strftime('%Y-%m-%d %H:%M:%S')
+        yield 'BEGIN;\n'
+
+        # 可選：先刪除同專案舊資料，以避免重複（如不需要可移除下一行）
+        yield f"DELETE FROM {table_name} WHERE project_id = {project.id};\n"
+
+        rows = (
+            ProjectDocument.objects
+            .filter(project=project)
+            .order_by('id')
+            .values_list(*columns)
+            .iterator(chunk_size=200)
         )
-    )
-
-    lines = []
-    lines.append('-- Exported ProjectDocument rows for project id=%d (%s)' % (project.id, project.project_code or project.name))
-    lines.append('-- Generated at %s' % timezone.now().strftime('%Y-%m-%d %H:%M:%S'))
-    lines.append('BEGIN;')
-
-    # 可選：先刪除同專案舊資料，以避免重複（如不需要可移除下一行）
-    lines.append(f"DELETE FROM {table_name} WHERE project_id = {project.id};")
-
-    if rows:
-        columns = ['id', 'project_id', 'filename', 'uploaded_file', 'content', 'embedding', 'imported_by_id', 'imported_at']
         col_list = ', '.join(columns)
         for r in rows:
             values = []
-            for c in columns:
-                val = r[c]
-                if c == 'embedding' and val is not None:
-                    # 序列化為 JSON 字串
-                    val = json.dumps(val, ensure_ascii=False)
-                if c == 'imported_at' and val is not None:
+            for c, val in zip(columns, r):
+                if c in datetime_columns and val is not None:
                     # 轉為 ISO 格式字串
                     val = val.isoformat(sep=' ', timespec='seconds')
                 values.append(sql_value(val))
             values_sql = ', '.join(values)
-            lines.append(f"INSERT INTO {table_name} ({col_list}) VALUES ({values_sql});")
+            yield f"INSERT INTO {table_name} ({col_list}) VALUES ({values_sql});\n"
 
-    lines.append('COMMIT;')
-
-    sql_bytes = '\n'.join(lines).encode('utf-8')
-
-    # 以 ZIP 打包
-    memfile = io.BytesIO()
-    with zipfile.ZipFile(memfile, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
-        filename_part = (project.project_code or project.name or f'project_{project.id}').replace(' ', '_')
-        sql_name = f"project_{filename_part}_documents.sql"
-        zf.writestr(sql_name, sql_bytes)
+        yield 'COMMIT;\n'
 
-    memfile.seek(0)
-    resp = HttpResponse(memfile.read(), content_type='application/zip')
+    # 以 ZIP 串流打包：邊查詢、邊產生 SQL、邊壓縮送出，記憶體用量與專案大小無關
+    filename_part = (project.project_code or project.name or f'project_{project.id}').replace(' ', '_')
+    sql_name = f"project_{filename_part}_documents.sql"
+    resp = StreamingHttpResponse(stream_zip([(sql_name, sql_lines())]), content_type='application/zip')
     ts = timezone.now().strftime('%Y%m%d_%H%M%S')
     download_name = f"project_{project.id}_documents_{ts}.zip"
     resp['Content-Disposition'] = f'attachment; filename="{download_name}"'
@@ -537,6 +684,43 @@ def project_export_project_sql(request, pk):
     return resp
 
 
+# 專案包匯出：專案設定 + 文件 + 片段 + 向量，匯入到其他環境時不必重新向量化
+@login_required
+def project_export_bundle(request, pk):
+    project = get_object_or_404(LLMProject, pk=pk)
+    resp = StreamingHttpResponse(bundle.export_stream(project), content_type='application/zip')
+    ts = timezone.now().strftime('%Y%m%d_%H%M%S')
+    filename_part = (project.project_code or f'project_{project.id}').replace(' ', '_')
+    resp['Content-Disposition'] = f'attachment; filename="bundle_{filename_part}_{ts}.zip"'
+    return resp
+
+
+# 專案包匯入：建立新專案（可指定新的專案代碼），完成後進入編輯頁
+@require_POST
+@login_required
+def project_import_bundle(request):
+    upload = request.FILES.get('bundle')
+    project_code = (request.POST.get('project_code') or '').strip() or None
+    error = None
+    if not upload:
+        error = '請選擇專案包檔案'
+    else:
+        try:
+            project, _ = bundle.import_bundle(upload, project_code=project_code, user=request.user)
+        except bundle.BundleError as e:
+            error = str(e)
+        else:
+            return redirect('project_edit', pk=project.pk)
+
+    results, total, next_cursor = project_search.search_projects()
+    return render(
+        request,
+        "projects/project_publish.html",
+        {"q": "", "results": results, "total": total, "next_cursor": next_cursor, "bundle_error": error},
+        status=400,
+    )
+
+
 # 匯出：將 project_test.html 渲染為靜態 HTML，打包 ZIP 下載
 @login_required
 def project_export_example_html(request, pk):
@@ -559,7 +743,14 @@ def project_export_example_html(request, pk):
     return resp
 
 
-# 爬蟲：輸入網址，擷取文字，轉為 Markdown，向量化後匯入資料庫
+def _int_param(value, default, low, high):
+    try:
+        return max(low, min(int(value), high))
+    except (TypeError, ValueError):
+        return default
+
+
+# 爬蟲：輸入網址或 sitemap.xml，背景工作抓取同網域頁面，轉為 Markdown，向量化後匯入資料庫
 @login_required
 def project_crawl(request, pk):
     project = get_object_or_404(LLMProject, pk=pk)
@@ -568,6 +759,9 @@ def project_crawl(request, pk):
         'project': project,
         'result': None,
         'error': None,
+        'job': None,
+        'default_depth': getattr(settings, 'PROJECT_CRAWL_MAX_DEPTH', DEFAULT_MAX_DEPTH),
+        'default_pages': getattr(settings, 'PROJECT_CRAWL_MAX_PAGES', DEFAULT_MAX_PAGES),
     }
 
     if request.method == 'POST':
@@ -575,67 +769,174 @@ def project_crawl(request, pk):
         if not url:
             context['error'] = '請輸入網址'
             return render(request, 'projects/project_crawl.html', context)
+        if urlparse(url).scheme not in ('http', 'https'):
+            context['error'] = '網址需以 http:// 或 https:// 開頭'
+            return render(request, 'projects/project_crawl.html', context)
+
+        job = enqueue(
+            'crawl_site',
+            {
+                'project_id': project.pk,
+                'url': url,
+                'max_depth': _int_param(request.POST.get('max_depth'), context['default_depth'], 0, 10),
+                'max_pages': _int_param(request.POST.get('max_pages'), context['default_pages'], 1, 5000),
+                'user_id': request.user.pk,
+            },
+        )
+        return redirect(f"{reverse('project_crawl', args=[project.pk])}?job={job.pk}")
+
+    job_id = request.GET.get('job')
+    if job_id and job_id.isdigit():
+        context['job'] = BackgroundJob.objects.filter(
+            pk=job_id, kind='crawl_site', payload__project_id=project.pk
+        ).first()
+    return render(request, 'projects/project_crawl.html', context)
+
+
+@login_required
+def project_crawl_status(request, pk, job_pk):
+    return _job_status(pk, job_pk, 'crawl_site')
+
+
+@login_required
+def project_import_bulk_status(request, pk, job_pk):
+    return _job_status(pk, job_pk, 'bulk_import')
+
+
+def _job_status(pk, job_pk, kind):
+    """爬蟲、批次匯入頁面輪詢用：回傳背景工作狀態與進度（job.result）"""
+    project = get_object_or_404(LLMProject, pk=pk)
+    job = get_object_or_404(BackgroundJob, pk=job_pk, kind=kind, payload__project_id=project.pk)
+    return JsonResponse({
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': job.result or {},
+        'error': job.last_error.strip().splitlines()[-1] if job.status == BackgroundJob.STATUS_FAILED and job.last_error else '',
+    })
+
+
+def project_metrics(request):
+    """
+    Prometheus text format 指標；staff 登入，或帶 Authorization: Bearer <PROJECT_METRICS_TOKEN>
+    """
+    token = getattr(settings, 'PROJECT_METRICS_TOKEN', None)
+    auth = request.headers.get('Authorization', '')
+    allowed = request.user.is_authenticated and request.user.is_staff
+    if not allowed and token:
+        allowed = hmac.compare_digest(auth.encode(), f'Bearer {token}'.encode())
+    if not allowed:
+        return HttpResponse('forbidden', status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ---- async 版本：在 ASGI（uvicorn）下執行，等待 Gemini / 網路時不佔用 worker thread ----
+# ORM 呼叫一律經 sync_to_async；回應格式與同步版本相同
+
+@require_POST
+@login_required
+async def project_test_api_async(request, pk):
+    """async 版 project_test_api"""
+    obj = await aget_object_or_404(LLMProject, pk=pk)
+    question = (request.POST.get("question") or "").strip()
+    if not question:
+        return JsonResponse({"error": "請輸入問題"}, status=400)
+
+    cache_key = await sync_to_async(answer_cache.make_key)(obj, question)
+    cached = await sync_to_async(answer_cache.get)(cache_key)
+    if cached is not None:
+        return JsonResponse({'answer': cached.answer, 'sources': cached.sources, 'cached': True})
+
+    # 檢索內部會同時進行 BM25、查詢向量化與載入向量矩陣
+    with metrics.span("retrieve"):
+        hits = await asearch_similar_docs(project_id=obj.id, question=question, top_k=3)
+    context_text, role_prompt = _build_context(obj, hits)
+    answer = await acall_gemini(role_prompt, question, context=context_text, llm_model=obj.llm_model)
+    if answer != FALLBACK_ANSWER:
+        await sync_to_async(answer_cache.put)(cache_key, answer, hits)
+
+    return JsonResponse({
+        'answer': answer,
+        'sources': hits,
+    })
+
+
+@require_POST
+@login_required
+async def project_generate_image_api_async(request, pk):
+    """async 版 project_generate_image_api"""
+    _ = await aget_object_or_404(LLMProject, pk=pk)
+    img_prompt = (request.POST.get('img_prompt') or '').strip()
+    if not img_prompt:
+        return JsonResponse({'error': '缺少 img_prompt'}, status=400)
+
+    try:
+        image = await image_cache.aget_or_generate(img_prompt, params=_image_params(request.POST))
+    except Exception as e:
+        return JsonResponse({'error': f'圖片生成失敗：{e}'}, status=500)
+    return JsonResponse({'image_url': image.url, 'content_type': image.content_type, 'cached': image.cached})
+
+
+@login_required
+async def project_crawl_async(request, pk):
+    """async 版 project_crawl"""
+    project = await aget_object_or_404(LLMProject, pk=pk)
+    arender = sync_to_async(render)
+
+    context = {
+        'project': project,
+        'result': None,
+        'error': None,
+        'job': None,
+        'default_depth': getattr(settings, 'PROJECT_CRAWL_MAX_DEPTH', DEFAULT_MAX_DEPTH),
+        'default_pages': getattr(settings, 'PROJECT_CRAWL_MAX_PAGES', DEFAULT_MAX_PAGES),
+    }
+
+    if request.method == 'POST':
+        url = (request.POST.get('url') or '').strip()
+        if not url:
+            context['error'] = '請輸入網址'
+            return await arender(request, 'projects/project_crawl.html', context)
+        if urlparse(url).scheme not in ('http', 'https'):
+            context['error'] = '網址需以 http:// 或 https:// 開頭'
+            return await arender(request, 'projects/project_crawl.html', context)
 
         try:
-            resp = requests.get(
-                url,
-                timeout=20,
-                headers={'User-Agent': 'Mozilla/5.0 (compatible; CSWBot/1.0; +https://example.com/bot)'},
-                verify=True,
-            )
+            resp = await async_http_client().get(url, headers=CRAWL_HEADERS, timeout=20)
             resp.raise_for_status()
-        except SSLError as e:
-            context['error'] = f'抓取失敗（SSL）：{e}'
-            return render(request, 'projects/project_crawl.html', context)
         except Exception as e:
             context['error'] = f'抓取失敗：{e}'
-            return render(request, 'projects/project_crawl.html', context)
+            return await arender(request, 'projects/project_crawl.html', context)
 
-        # 解析 HTML，抽取主要文字
-        html = resp.text
-        soup = BeautifulSoup(html, 'html.parser')
-        # 移除 script/style
-        for tag in soup(['script', 'style', 'noscript']):
-            tag.decompose()
-        # 嘗試抓主體
-        main = soup.find('main') or soup.find('article') or soup
-        text_parts = []
-        # 標題
-        if soup.title and soup.title.string:
-            text_parts.append(f"# {soup.title.string.strip()}")
-        # 轉為 Markdown-ish（簡化版）
-        for h in main.find_all(['h1','h2','h3','h4','h5','h6']):
-            prefix = '#' * int(h.name[1])
-            text_parts.append(f"\n{prefix} {h.get_text(strip=True)}\n")
-        # 段落
-        for p in main.find_all('p'):
-            content = p.get_text(" ", strip=True)
-            if content:
-                text_parts.append(content)
-        # 清理多重空白
-        md_text = '\n\n'.join(text_parts)
-        md_text = re.sub(r'\n{3,}', '\n\n', md_text).strip()
-        if not md_text:
-            md_text = soup.get_text("\n", strip=True)
-
-        # 儲存為 ProjectDocument
-        filename = re.sub(r'[^a-zA-Z0-9._-]+', '_', url)[:200] or 'page'
-        doc = ProjectDocument(
-            project=project,
-            filename=f"crawl_{filename}.md",
-            imported_by=request.user,
-            content=md_text,
+        md_text = await sync_to_async(html_to_markdown, thread_sensitive=False)(resp.text)
+
+        # 先以 async API 算好片段向量寫入向量快取，index_document 就不會在 ORM thread 上等網路
+        try:
+            await aembed_texts([c.full_text for c in split_text(md_text)])
+        except Exception as e:
+            logger.warning("向量化失敗：%s", e)
+            metrics.ERRORS.inc(component="crawl")
+
+        # 同一網址已爬過就就地更新；內容沒變則不重建片段
+        page = Page(
+            url=url,
+            final_url=normalize_url(str(resp.url)),
+            depth=0,
+            markdown=md_text,
+            etag=resp.headers.get('ETag', ''),
+            last_modified=resp.headers.get('Last-Modified', ''),
         )
+        user = await request.auser()
         try:
-            doc.embedding = compute_embedding(md_text)
-        except Exception:
-            doc.embedding = None
-        doc.save()
+            saved = await sync_to_async(save_pages)(project.pk, [page], user_id=user.pk)
+        except Exception as e:
+            # 向量化失敗：文件保留待處理狀態，再送出一次同一網址即可重建
+            context['error'] = f'向量化失敗，請稍後再試：{e}'
+            return await arender(request, 'projects/project_crawl.html', context)
+        doc = (saved['created'] + saved['updated'] + saved['unchanged'])[0]
 
         context['result'] = {
             'doc_id': doc.id,
             'filename': doc.filename,
         }
-        return render(request, 'projects/project_crawl.html', context)
 
-    return render(request, 'projects/project_crawl.html', context)
+    return await arender(request, 'projects/project_crawl.html', context)